@@ -0,0 +1,258 @@
+"""
+Admission Control Module
+Adaptive concurrency limit and deadline-aware priority queue for upstream LLM calls
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Priorities: lower values are admitted first
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+class AdmissionRejected(Exception):
+    """Raised when a request is not admitted; carries the HTTP status and Retry-After hint."""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: Optional[int] = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class QueueFullError(AdmissionRejected):
+    status_code = 429
+
+class QueueTimeoutError(AdmissionRejected):
+    """Waited ADMISSION_MAX_WAIT without a slot: the upstream is overloaded"""
+    status_code = 503
+
+class DeadlineExceededError(AdmissionRejected):
+    """The caller's own deadline passed; retrying the same request won't help, so no Retry-After"""
+    status_code = 504
+
+    def __init__(self, message: str):
+        super().__init__(message, retry_after=None)
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limit driven by observed upstream latency.
+
+    A slow-moving baseline tracks the best recent latency. A sample slower than
+    baseline * tolerance, or a failed call, shrinks the limit multiplicatively;
+    otherwise the limit grows additively (by about one per limit's worth of
+    calls) while it is actually being used.
+    """
+
+    def __init__(
+        self,
+        initial_limit: Optional[int] = None,
+        min_limit: Optional[int] = None,
+        max_limit: Optional[int] = None,
+        tolerance: Optional[float] = None,
+        backoff: float = 0.9,
+    ):
+        self.min_limit = min_limit or int(os.getenv("ADMISSION_MIN_LIMIT", "2"))
+        self.max_limit = max_limit or int(os.getenv("ADMISSION_MAX_LIMIT", "200"))
+        self.limit = float(initial_limit or int(os.getenv("ADMISSION_INITIAL_LIMIT", "20")))
+        self.tolerance = tolerance or float(os.getenv("ADMISSION_LATENCY_TOLERANCE", "2.0"))
+        self.backoff = backoff
+        self.baseline: Optional[float] = None
+        self.smoothed: Optional[float] = None
+
+    def update(self, latency: float, in_flight: int, ok: bool) -> None:
+        if ok:
+            self.smoothed = latency if self.smoothed is None else 0.8 * self.smoothed + 0.2 * latency
+            if self.baseline is None or latency < self.baseline:
+                self.baseline = latency
+            else:
+                # Let the baseline drift up slowly so it follows real shifts in model speed
+                self.baseline += (latency - self.baseline) * 0.01
+
+        if not ok or latency > self.baseline * self.tolerance:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+        elif in_flight >= self.limit / 2:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    @property
+    def current(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+class _Waiter:
+    __slots__ = ("priority", "deadline", "caller_deadline", "future", "enqueued_at")
+
+    def __init__(self, priority: int, deadline: float, caller_deadline: bool, future: asyncio.Future):
+        self.priority = priority
+        self.deadline = deadline
+        self.caller_deadline = caller_deadline
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+class Slot:
+    """An admitted request; call first_token() on streams to report time-to-first-token."""
+
+    def __init__(self, controller: "AdmissionController"):
+        self.controller = controller
+        self.started_at = time.monotonic()
+        self.latency: Optional[float] = None
+
+    def first_token(self) -> None:
+        if self.latency is None:
+            self.latency = time.monotonic() - self.started_at
+
+class AdmissionController:
+    """
+    Admits upstream calls under the adaptive limit.
+
+    Requests beyond the limit wait in a bounded priority queue ordered by
+    (priority, deadline). A waiter whose deadline passes is failed instead of
+    being sent upstream, and enqueueing into a full queue fails immediately
+    with a Retry-After estimate.
+    """
+
+    def __init__(self, limiter: Optional[AdaptiveLimiter] = None, max_queue: Optional[int] = None, max_wait: Optional[float] = None):
+        self.limiter = limiter or AdaptiveLimiter()
+        self.max_queue = max_queue or int(os.getenv("ADMISSION_MAX_QUEUE", "100"))
+        self.max_wait = max_wait or float(os.getenv("ADMISSION_MAX_WAIT_SECONDS", "10"))
+        self._heap: List[tuple] = []
+        self._sequence = itertools.count()
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.expired = 0
+        self.total_wait = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._heap)
+
+    def retry_after(self) -> int:
+        """Rough seconds until the current queue drains"""
+        latency = self.limiter.smoothed or 1.0
+        return max(1, math.ceil(latency * (self.queue_depth + 1) / self.limiter.current))
+
+    def ensure_capacity(self) -> None:
+        """Fail fast if a new request could not even be queued"""
+        if self.in_flight >= self.limiter.current and self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError("Upstream queue is full", self.retry_after())
+
+    def _expired_error(self, caller_deadline: bool, when: str) -> AdmissionRejected:
+        """The caller's deadline is a 504; running out of max_wait is overload, a 503 with Retry-After"""
+        self.expired += 1
+        if caller_deadline:
+            return DeadlineExceededError(f"Request deadline passed {when}")
+        return QueueTimeoutError(f"No upstream capacity within {self.max_wait:g}s", self.retry_after())
+
+    async def _acquire(self, priority: int, deadline: Optional[float]) -> None:
+        now = time.monotonic()
+        caller_deadline = deadline is not None and deadline <= now + self.max_wait
+        deadline = deadline if caller_deadline else now + self.max_wait
+        if deadline <= now:
+            raise self._expired_error(caller_deadline, "before admission")
+
+        if self.in_flight < self.limiter.current and not self._heap:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+
+        if self.queue_depth >= self.max_queue:
+            self.rejected += 1
+            raise QueueFullError("Upstream queue is full", self.retry_after())
+
+        waiter = _Waiter(priority, deadline, caller_deadline, asyncio.get_running_loop().create_future())
+        heapq.heappush(self._heap, (priority, deadline, next(self._sequence), waiter))
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=deadline - now)
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            raise self._expired_error(caller_deadline, "while queued")
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled() and waiter.future.exception() is None:
+                # Admitted just as we were cancelled; hand the slot on
+                self._release_slot()
+            else:
+                self._discard(waiter)
+            raise
+        self.total_wait += time.monotonic() - waiter.enqueued_at
+
+    def _discard(self, waiter: _Waiter) -> None:
+        if not waiter.future.done():
+            waiter.future.cancel()
+        self._heap = [entry for entry in self._heap if entry[3] is not waiter]
+        heapq.heapify(self._heap)
+
+    def _release_slot(self) -> None:
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        """Hand free slots to the best queued waiters, failing any that have expired"""
+        now = time.monotonic()
+        while self._heap and self.in_flight < self.limiter.current:
+            _, deadline, _, waiter = heapq.heappop(self._heap)
+            if waiter.future.done():
+                continue
+            if deadline <= now:
+                waiter.future.set_exception(self._expired_error(waiter.caller_deadline, "while queued"))
+                continue
+            self.in_flight += 1
+            self.admitted += 1
+            waiter.future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_INTERACTIVE, deadline: Optional[float] = None) -> AsyncIterator[Slot]:
+        """
+        Hold an upstream slot for the duration of the block.
+
+        The latency fed to the limiter is the time to first token if the
+        caller reported one, otherwise the time the block took.
+        """
+        await self._acquire(priority, deadline)
+        slot = Slot(self)
+        ok = False
+        cancelled = False
+        try:
+            yield slot
+            ok = True
+        except (asyncio.CancelledError, GeneratorExit):
+            # The caller went away or hit its deadline, or a stream holding the
+            # slot was closed early; that says nothing about upstream health,
+            # and the truncated latency is not a real sample
+            cancelled = True
+            raise
+        finally:
+            if not cancelled or slot.latency is not None:
+                latency = slot.latency if slot.latency is not None else time.monotonic() - slot.started_at
+                self.limiter.update(latency, self.in_flight, ok or cancelled)
+            self._release_slot()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "limit": self.limiter.current,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "queue_capacity": self.max_queue,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "expired": self.expired,
+            "avg_wait_ms": round(self.total_wait * 1000 / self.admitted, 2) if self.admitted else 0.0,
+            "latency_baseline_ms": round(self.limiter.baseline * 1000, 1) if self.limiter.baseline else None,
+            "latency_smoothed_ms": round(self.limiter.smoothed * 1000, 1) if self.limiter.smoothed else None,
+        }
+
+_admission: Optional[AdmissionController] = None
+
+def get_admission_controller() -> AdmissionController:
+    """Get or create the shared AdmissionController instance."""
+    global _admission
+    if _admission is None:
+        _admission = AdmissionController()
+    return _admission
@@ -0,0 +1,248 @@
+"""
+Analysis Worker Module
+Claims unprocessed inputs with SKIP LOCKED, analyzes them and marks them processed in bulk,
+leaving rows whose analysis failed unprocessed for a bounded number of retries
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import signal
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+import asyncpg
+
+from database import Database
+from input_analysis import analyze_input
+from logging_setup import configure_logging
+from metrics import ANALYSIS_BATCH_SECONDS, ANALYSIS_FAILURES, ANALYSIS_LAG_SECONDS, ANALYSIS_ROWS, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Oldest first through the partial index on unprocessed rows, skipping rows
+# that failed too often or are waiting out their retry delay. Rows locked by
+# another worker are skipped rather than waited on, so every worker gets a
+# disjoint batch and the locks are held until this transaction commits.
+CLAIM_SQL = """
+    SELECT id, created_at, input
+    FROM input_table
+    WHERE processed = false
+      AND analysis_attempts < $2
+      AND (analysis_retry_at IS NULL OR analysis_retry_at <= now())
+    ORDER BY created_at, id
+    LIMIT $1
+    FOR UPDATE SKIP LOCKED
+"""
+
+# Successful rows become processed. Failed ones keep processed = false, count
+# the attempt and wait retry_delay * 2^attempts before they can be claimed again.
+MARK_ANALYZED_SQL = """
+    UPDATE input_table AS t
+    SET processed = NOT r.failed,
+        analysis = r.analysis::jsonb,
+        analysis_attempts = t.analysis_attempts + r.failed::integer,
+        analysis_retry_at = CASE
+            WHEN r.failed THEN now() + make_interval(secs => $5 * power(2, t.analysis_attempts))
+        END
+    FROM unnest($1::integer[], $2::timestamptz[], $3::text[], $4::boolean[]) AS r(id, created_at, analysis, failed)
+    WHERE t.id = r.id AND t.created_at = r.created_at
+"""
+
+# Makes rows that used up their attempts claimable again, e.g. after fixing a stage
+RETRY_EXHAUSTED_SQL = """
+    UPDATE input_table
+    SET analysis_attempts = 0, analysis_retry_at = NULL
+    WHERE processed = false AND analysis_attempts >= $1
+"""
+
+class AnalysisWorker:
+    """
+    Runs the analysis pipeline over stored inputs.
+
+    Each of `concurrency` loops holds one dedicated connection and repeats:
+    claim up to batch_size rows in a transaction, analyze them concurrently,
+    write every result and the processed flag in one UPDATE, commit. A
+    worker that dies mid-batch rolls back and releases its rows to the next
+    claimant, so no row is lost or processed twice, and any number of
+    worker processes can share the table. An empty claim backs off up to
+    poll_interval before polling again.
+
+    A row with a failed stage is not marked processed: its errors are stored
+    in analysis and it is claimed again after an exponential retry delay,
+    up to max_attempts failed runs.
+    """
+
+    def __init__(
+        self,
+        database: Optional[Database] = None,
+        batch_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+        poll_interval: Optional[float] = None,
+        max_attempts: Optional[int] = None,
+        retry_delay: Optional[float] = None,
+    ):
+        self.database = database or Database()
+        self.batch_size = batch_size or int(os.getenv("ANALYSIS_BATCH_SIZE", "200"))
+        self.concurrency = concurrency or int(os.getenv("ANALYSIS_WORKER_CONCURRENCY", "2"))
+        self.poll_interval = poll_interval or float(os.getenv("ANALYSIS_POLL_INTERVAL_SECONDS", "2.0"))
+        self.max_attempts = max_attempts or int(os.getenv("ANALYSIS_MAX_ATTEMPTS", "5"))
+        self.retry_delay = retry_delay if retry_delay is not None else float(os.getenv("ANALYSIS_RETRY_DELAY_SECONDS", "60"))
+        self._stopping = asyncio.Event()
+        self.processed = 0
+        self.failed = 0
+        self.batches = 0
+        self.started_at = time.monotonic()
+        self.last_lag: Optional[float] = None
+
+    def stop(self) -> None:
+        """Finish the batches in progress, then return from run()"""
+        self._stopping.set()
+
+    async def process_batch(self, conn: asyncpg.Connection) -> int:
+        """Claim, analyze and mark one batch; returns the number of rows claimed"""
+        started = time.perf_counter()
+        async with conn.transaction():
+            rows = await conn.fetch(CLAIM_SQL, self.batch_size, self.max_attempts)
+            if not rows:
+                return 0
+            results = await asyncio.gather(*(analyze_input(row["input"]) for row in rows))
+            analyses = []
+            failed = []
+            for result in results:
+                analysis: Dict[str, object] = dict(result.results)
+                if result.errors:
+                    analysis["errors"] = result.errors
+                analyses.append(json.dumps(analysis))
+                failed.append(bool(result.errors))
+            await conn.execute(
+                MARK_ANALYZED_SQL,
+                [row["id"] for row in rows], [row["created_at"] for row in rows], analyses, failed,
+                self.retry_delay
+            )
+
+        now = datetime.now(timezone.utc)
+        succeeded = 0
+        for row, row_failed in zip(rows, failed):
+            if not row_failed:
+                succeeded += 1
+                ANALYSIS_LAG_SECONDS.observe((now - row["created_at"]).total_seconds())
+        if len(rows) > succeeded:
+            logger.warning("Analysis failed for %d of %d rows; they stay unprocessed for retry", len(rows) - succeeded, len(rows))
+        self.last_lag = (now - rows[0]["created_at"]).total_seconds()
+        ANALYSIS_ROWS.inc(succeeded)
+        ANALYSIS_FAILURES.inc(len(rows) - succeeded)
+        ANALYSIS_BATCH_SECONDS.observe(time.perf_counter() - started)
+        self.processed += succeeded
+        self.failed += len(rows) - succeeded
+        self.batches += 1
+        return len(rows)
+
+    async def retry_exhausted(self) -> int:
+        """Reset rows that used up their attempts so they are claimed again; returns how many"""
+        conn = await self.database.connect_single()
+        try:
+            status = await conn.execute(RETRY_EXHAUSTED_SQL, self.max_attempts)
+        finally:
+            await conn.close()
+        return int(status.split()[-1])
+
+    async def _sleep(self, seconds: float) -> None:
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _loop(self, number: int, drain: bool) -> None:
+        conn: Optional[asyncpg.Connection] = None
+        idle_delay = 0.1
+        retry_delay = self.database.retry_delay
+        try:
+            while not self._stopping.is_set():
+                try:
+                    if conn is None or conn.is_closed():
+                        conn = await self.database.connect_single()
+                        retry_delay = self.database.retry_delay
+                    count = await self.process_batch(conn)
+                except (asyncpg.PostgresError, asyncpg.InterfaceError, OSError) as e:
+                    logger.warning("Analysis loop %s failed, retrying in %.1f seconds: %s", number, retry_delay, e)
+                    if conn is not None:
+                        conn.terminate()
+                        conn = None
+                    await self._sleep(retry_delay)
+                    retry_delay = min(retry_delay * 2, 30.0)
+                    continue
+
+                if count == self.batch_size:
+                    idle_delay = 0.1
+                    continue
+                if drain:
+                    if count == 0:
+                        return
+                    continue
+                if count == 0:
+                    # Jitter keeps idle workers from polling in lockstep
+                    await self._sleep(idle_delay * random.uniform(0.5, 1.0))
+                    idle_delay = min(idle_delay * 2, self.poll_interval)
+        finally:
+            if conn is not None:
+                await conn.close()
+
+    async def run(self, drain: bool = False) -> None:
+        """
+        Process until stop() is called, or with drain=True until no
+        unprocessed rows are left.
+        """
+        self.started_at = time.monotonic()
+        await asyncio.gather(*(self._loop(number, drain) for number in range(self.concurrency)))
+
+    def stats(self) -> Dict[str, object]:
+        elapsed = time.monotonic() - self.started_at
+        return {
+            "processed": self.processed,
+            "failed": self.failed,
+            "batches": self.batches,
+            "rows_per_second": round(self.processed / elapsed, 1) if elapsed > 0 else 0.0,
+            "last_lag_seconds": round(self.last_lag, 1) if self.last_lag is not None else None,
+        }
+
+async def _report(worker: AnalysisWorker, interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        logger.info("Analysis worker progress: %s", worker.stats(), extra={"sample_rate": 1.0})
+
+async def _main(args: argparse.Namespace) -> int:
+    worker = AnalysisWorker(batch_size=args.batch_size, concurrency=args.concurrency)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, worker.stop)
+
+    if args.retry_exhausted:
+        logger.info("Reset %d inputs whose analysis had used up its attempts", await worker.retry_exhausted())
+
+    REGISTRY.start()
+    reporter = asyncio.create_task(_report(worker, float(os.getenv("ANALYSIS_REPORT_INTERVAL_SECONDS", "60"))))
+    try:
+        await worker.run(drain=args.drain)
+    finally:
+        reporter.cancel()
+        await REGISTRY.stop()
+    logger.info("Analysis worker stopped: %s", worker.stats())
+    return 0
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Analyze stored inputs and mark them processed")
+    parser.add_argument("--drain", action="store_true", help="exit once no claimable unprocessed inputs are left")
+    parser.add_argument("--retry-exhausted", action="store_true", help="first make inputs that failed ANALYSIS_MAX_ATTEMPTS times claimable again")
+    parser.add_argument("--batch-size", type=int, help="rows claimed per transaction (default: ANALYSIS_BATCH_SIZE or 200)")
+    parser.add_argument("--concurrency", type=int, help="claim loops in this process (default: ANALYSIS_WORKER_CONCURRENCY or 2)")
+    args = parser.parse_args()
+    configure_logging(os.getenv("LOG_LEVEL", "INFO"))
+    return asyncio.run(_main(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,84 +1,180 @@
-from fastapi import FastAPI, HTTPException, Depends, Cookie, Response
+from fastapi import APIRouter, FastAPI, HTTPException, Depends, Cookie, Header, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from pydantic_settings import BaseSettings
-from typing import Optional
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel
+from typing import AsyncIterator, Optional
+from contextlib import asynccontextmanager
 from datetime import datetime
+from uuid import UUID
+import asyncio
+import hmac
+import json
 import logging
 import os
 
 # Import processing modules
-from input_processor import process_input_async
-from llm_gateway import get_ai_response_async
-from response_processor import process_response_async
+from input_processor import input_pipeline, process_input_async
+from llm_gateway import get_ai_response_async, stream_ai_response_async
+from response_processor import process_response_async, process_response_stream, response_pipeline
+from database import get_database
+from input_log import get_input_log
+from conversation_store import ConversationStore, get_conversation_store
+from response_cache import get_response_cache
+from singleflight import get_single_flight
+from admission import AdmissionRejected, get_admission_controller
+from idempotency import (
+    IDEMPOTENCY_HEADER, MAX_KEY_LENGTH, REPLAYED_HEADER, IdempotencyConflict, fingerprint, get_idempotent_requests
+)
+from cancellation import ClientDisconnected, cancel_on_disconnect, record_abort, request_deadline, stats as cancellation_stats
+from llm_router import close_router, get_router
+from upstream_transport import warm_up
+from batch import BatchLineError, BatchRunner, split_lines
+from pipeline import shutdown_executors
+from session_store import SessionStoreFull, get_session_store
+from metrics import REGISTRY
+from rate_limit import RateLimitMiddleware, get_address_rate_limiter, get_rate_limiter
+from logging_setup import RequestIdMiddleware, configure_logging, dropped_records, shutdown_logging
+from prompt_registry import PromptProfile, get_prompt_registry, use_profile
+from settings import Settings, get_settings
 from auth import (
     LoginRequest, LoginResponse, AuthCheckResponse,
-    authenticate_user, create_session, get_session, remove_session
+    authenticate_user, create_session, get_session, remove_session, verification_cache
 )
 
-# Configuration
-class Settings(BaseSettings):
-    baseten_api_key: str = Field(..., env="BASETEN_API_KEY")
-    cors_origins: str = Field("*", env="CORS_ORIGINS")
-    debug: bool = Field(False, env="DEBUG")
-    log_level: str = Field("INFO", env="LOG_LEVEL")
-    port: int = Field(5004, env="PORT")
-    
-    class Config:
-        env_file = ".env"
-        case_sensitive = False
-
 # Request/Response models
 class ChatRequest(BaseModel):
     message: str
     conversation_id: Optional[str] = None
+    input_id: Optional[UUID] = None
+    use_cache: bool = True
+    profile: Optional[str] = None
 
 class ChatResponse(BaseModel):
     response: str
     conversation_id: str
     timestamp: str
+    input_id: Optional[str] = None
+    input_saved: bool = False
+    profile: Optional[str] = None
 
 class HealthResponse(BaseModel):
     status: str
     service: str
     timestamp: str
+    database: Optional[str] = None
 
-# Initialize settings
-try:
-    settings = Settings()
-except Exception as e:
-    print(f"Error loading settings: {e}")
-    print("Make sure BASETEN_API_KEY is set in environment or .env file")
-    raise
-
-# Configure logging
-logging.basicConfig(
-    level=getattr(logging, settings.log_level.upper()),
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
-# Create FastAPI app
-app = FastAPI(
-    title="NotATherapist Backend",
-    description="AI-powered mental health companion API",
-    version="2.0.0",
-    docs_url="/docs",
-    redoc_url="/redoc"
-)
+def check_worker_settings(settings: Settings) -> None:
+    """Refuse multi-worker configurations that would split session state between processes"""
+    if settings.web_concurrency <= 1:
+        return
+    if not settings.secret_key:
+        raise RuntimeError(
+            f"WEB_CONCURRENCY={settings.web_concurrency} requires SECRET_KEY so every worker accepts the same "
+            "session tokens; set SECRET_KEY in the environment or run a single worker (WEB_CONCURRENCY=1)"
+        )
+    if os.getenv("SESSION_STORE_BACKEND", "memory").lower() == "memory":
+        logger.warning("SESSION_STORE_BACKEND=memory with several workers: a logout only revokes the token on the worker that handled it")
+    if os.getenv("CONVERSATION_STORE_BACKEND", "memory").lower() != "postgres":
+        logger.warning("CONVERSATION_STORE_BACKEND=memory with several workers: conversation history is only seen by the worker that recorded it")
+    if os.getenv("IDEMPOTENCY_BACKEND", "memory").lower() != "postgres":
+        logger.warning("IDEMPOTENCY_BACKEND=memory with several workers: a retried request is only recognised by the worker that ran it")
 
-# Configure CORS
-cors_origins = settings.cors_origins
-if cors_origins != "*":
-    cors_origins = [origin.strip() for origin in cors_origins.split(",")]
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Per-worker startup and graceful drain.
+    
+    Runs in each worker after it has been forked, so the database pool,
+    upstream clients and background tasks all belong to the worker's own
+    event loop. On shutdown the server has already stopped accepting and
+    finished in-flight requests; queued writes are then flushed before the
+    pools are closed.
+    """
+    settings = get_settings()
+    database = get_database()
+    input_log = get_input_log()
+    database.start()
+    input_log.start()
+    get_session_store().start()
+    get_idempotent_requests().start()
+    REGISTRY.start()
+    # Open upstream connections before the first chat instead of during it
+    await warm_up(get_router(settings.baseten_api_key))
+    get_prompt_registry().install_reload_signal(asyncio.get_running_loop())
+    logger.info("Worker %s started", os.getpid(), extra={"sample_rate": 1.0})
+    yield
+    logger.info("Worker %s draining", os.getpid(), extra={"sample_rate": 1.0})
+    await input_log.stop()
+    await get_conversation_store().drain()
+    await database.close()
+    await get_session_store().stop()
+    await get_idempotent_requests().stop()
+    await get_rate_limiter().store.stop()
+    await close_router()
+    shutdown_executors()
+    await REGISTRY.stop()
+    shutdown_logging()
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=cors_origins if cors_origins != "*" else ["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+router = APIRouter()
+
+def create_app() -> FastAPI:
+    """
+    Application factory.
+    
+    Nothing that owns sockets, threads or an event loop is created at import
+    time, so the module is safe to import in a pre-fork master; every worker
+    calls this factory (e.g. gunicorn "app:create_app()") and builds its own
+    state in the lifespan.
+    """
+    settings = get_settings()
+    
+    # Structured logging through a background writer thread
+    configure_logging(settings.log_level)
+    check_worker_settings(settings)
+    # Load and validate the prompt profiles; a bad file fails startup here
+    get_prompt_registry()
+    
+    app = FastAPI(
+        title="NotATherapist Backend",
+        description="AI-powered mental health companion API",
+        version="2.0.0",
+        docs_url="/docs",
+        redoc_url="/redoc",
+        lifespan=lifespan
+    )
+    
+    # Refuse over-limit clients before any handler or upstream work. Added
+    # before CORS so that rejections still carry CORS headers.
+    app.add_middleware(RateLimitMiddleware)
+    
+    # Configure CORS
+    cors_origins = settings.cors_origins
+    if cors_origins != "*":
+        cors_origins = [origin.strip() for origin in cors_origins.split(",")]
+    
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=cors_origins if cors_origins != "*" else ["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    
+    # Outermost, so every log line of a request carries its ID
+    app.add_middleware(RequestIdMiddleware)
+    
+    app.include_router(router)
+    return app
+
+def __getattr__(name: str):
+    """Keep `uvicorn app:app` working by building the app on first access"""
+    if name == "app":
+        app = create_app()
+        globals()["app"] = app
+        return app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Authentication dependency
 async def get_current_user(auth_token: Optional[str] = Cookie(default=None)):
@@ -86,13 +182,30 @@ async def get_current_user(auth_token: Optional[str] = Cookie(default=None)):
     if not auth_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    user_session = get_session(auth_token)
+    user_session = await get_session(auth_token)
     if not user_session:
         raise HTTPException(status_code=401, detail="Invalid or expired session")
     
     return user_session
 
-@app.post("/auth/login", response_model=LoginResponse)
+async def require_admin(authorization: Optional[str] = Header(default=None)):
+    """Allow only requests carrying ADMIN_TOKEN as a bearer token; operator endpoints are off while it is unset"""
+    token = get_settings().admin_token
+    if not token:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them")
+    scheme, _, supplied = (authorization or "").partition(" ")
+    if scheme.lower() != "bearer" or not hmac.compare_digest(supplied.strip().encode(), token.encode()):
+        raise HTTPException(status_code=401, detail="Admin token required", headers={"WWW-Authenticate": "Bearer"})
+
+def admission_http_error(error: AdmissionRejected) -> HTTPException:
+    """Map an admission rejection to a fast-fail response, with a Retry-After hint when retrying can help"""
+    return HTTPException(
+        status_code=error.status_code,
+        detail=str(error),
+        headers={"Retry-After": str(error.retry_after)} if error.retry_after is not None else None
+    )
+
+@router.post("/auth/login", response_model=LoginResponse)
 async def login(request: LoginRequest, response: Response):
     """
     Login endpoint that validates credentials and creates a session.
@@ -127,7 +240,7 @@ async def login(request: LoginRequest, response: Response):
             max_age=86400  # 24 hours
         )
         
-        logger.info(f"User logged in: {user_info['name']}")
+        logger.info("User logged in: %s", user_info['name'])
         
         return LoginResponse(
             success=True,
@@ -139,10 +252,10 @@ async def login(request: LoginRequest, response: Response):
     except HTTPException:
         raise
     except Exception as e:
-        logger.error(f"Login error: {str(e)}")
+        logger.error("Login error: %s", e)
         raise HTTPException(status_code=500, detail="Login failed")
 
-@app.get("/auth/check", response_model=AuthCheckResponse)
+@router.get("/auth/check", response_model=AuthCheckResponse)
 async def check_auth(auth_token: Optional[str] = Cookie(default=None)):
     """
     Check if user is authenticated.
@@ -153,7 +266,7 @@ async def check_auth(auth_token: Optional[str] = Cookie(default=None)):
     if not auth_token:
         return AuthCheckResponse(authenticated=False)
     
-    user_session = get_session(auth_token)
+    user_session = await get_session(auth_token)
     if not user_session:
         return AuthCheckResponse(authenticated=False)
     
@@ -162,7 +275,7 @@ async def check_auth(auth_token: Optional[str] = Cookie(default=None)):
         name=user_session.get("name")
     )
 
-@app.post("/auth/logout")
+@router.post("/auth/logout")
 async def logout(response: Response, auth_token: Optional[str] = Cookie(default=None)):
     """
     Logout endpoint that removes the session.
@@ -171,17 +284,48 @@ async def logout(response: Response, auth_token: Optional[str] = Cookie(default=
         Success message
     """
     if auth_token:
-        remove_session(auth_token)
+        try:
+            await remove_session(auth_token)
+        except SessionStoreFull:
+            # The token would stay valid; don't tell the client it was revoked
+            raise HTTPException(status_code=503, detail="Logout could not be recorded, try again later")
         response.delete_cookie(key="auth_token")
         logger.info("User logged out")
     
     return {"message": "Logged out successfully"}
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest, user_session: dict = Depends(get_current_user)):
+def select_profile(name: Optional[str], user_name: str) -> PromptProfile:
+    """
+    Pick the prompt profile for a request and make it current for the
+    processing stages: the requested one, else the user's A/B variant.
+    """
+    try:
+        profile = get_prompt_registry().select(name, bucket_key=user_name)
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"Unknown prompt profile: {name}")
+    use_profile(profile)
+    return profile
+
+@router.post("/chat", response_model=ChatResponse)
+async def chat(
+    request: ChatRequest,
+    http_request: Request,
+    http_response: Response,
+    user_session: dict = Depends(get_current_user)
+):
     """
     Main chat endpoint that coordinates the processing pipeline.
     
+    The whole pipeline runs under the request deadline (X-Request-Timeout
+    header, else REQUEST_DEADLINE_SECONDS) and is cancelled, upstream call
+    included, if the client disconnects first.
+    
+    With an Idempotency-Key header the request runs at most once per key:
+    a retry gets the stored response, or waits for the first attempt if it
+    is still running, and is marked with Idempotent-Replayed: true. A keyed
+    request keeps running after its client disconnects so the retry can
+    pick it up. Reusing a key for a different request is a 422.
+    
     Args:
         request: ChatRequest containing the message and optional conversation_id
         
@@ -189,52 +333,306 @@ async def chat(request: ChatRequest, user_session: dict = Depends(get_current_us
         ChatResponse with the AI response and metadata
         
     Raises:
-        HTTPException: If processing fails
+        HTTPException: If processing fails, 504 past the deadline, 499 if
+            the client disconnected
     """
     try:
+        deadline = request_deadline(http_request.headers)
+        idempotency_key = http_request.headers.get(IDEMPOTENCY_HEADER)
+        if idempotency_key is not None and not 0 < len(idempotency_key) <= MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters")
         user_name = user_session.get("name", "Unknown")
-        logger.info(f"User {user_name} - Received message: {request.message[:50]}... (conversation: {request.conversation_id})")
+        profile = select_profile(request.profile, user_name)
+        logger.info("Chat request received (conversation: %s, %s chars)", request.conversation_id, len(request.message))
+        
+        conversation_id = request.conversation_id or f"conv_{datetime.now().timestamp()}"
+        conversation_key = ConversationStore.make_key(user_name, conversation_id)
+        conversation_store = get_conversation_store()
+        
+        async def respond() -> dict:
+            # Queue input for the database; the write happens off the chat path
+            input_id, input_saved = get_input_log().enqueue(
+                request.message, request.conversation_id, request.input_id
+            )
+            
+            # Step 1: Process input (add joke request)
+            processed_message = await process_input_async(request.message, deadline)
+            
+            # Step 2: Get AI response with the token-budgeted conversation history
+            history = await conversation_store.build_history(conversation_key)
+            ai_response = await get_ai_response_async(
+                processed_message, get_settings().baseten_api_key, history,
+                use_cache=request.use_cache, cache_text=request.message,
+                deadline=deadline, profile=profile
+            )
+            await conversation_store.append(conversation_key, request.message, ai_response)
+            
+            # Step 3: Process response (add joke acknowledgment)
+            final_response = await process_response_async(ai_response, deadline)
+            
+            return ChatResponse(
+                response=final_response,
+                conversation_id=conversation_id,
+                timestamp=datetime.now().isoformat(),
+                input_id=input_id,
+                input_saved=input_saved,
+                profile=profile.label
+            ).model_dump()
+        
+        if idempotency_key is None:
+            return await cancel_on_disconnect(http_request, respond())
+        
+        # Keys are scoped to the user so one user's key never replays another's response
+        result, replayed = await cancel_on_disconnect(
+            http_request,
+            get_idempotent_requests().run(f"{user_name}:{idempotency_key}", fingerprint(request.model_dump()), respond)
+        )
+        if replayed:
+            http_response.headers[REPLAYED_HEADER] = "true"
+        return result
+        
+    except HTTPException:
+        raise
+    except IdempotencyConflict as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except ClientDisconnected:
+        # Nobody reads this response; the status is for access logs and metrics
+        raise HTTPException(status_code=499, detail="Client closed request")
+    except AdmissionRejected as e:
+        raise admission_http_error(e)
+    except Exception as e:
+        logger.error("Error processing chat request: %s", e)
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to process request: {str(e)}"
+        )
+
+@router.post("/chat/batch")
+async def chat_batch(
+    http_request: Request,
+    concurrency: Optional[int] = Query(default=None, ge=1),
+    retries: Optional[int] = Query(default=None, ge=0),
+    use_cache: bool = True,
+    profile: Optional[str] = None,
+    user_session: dict = Depends(get_current_user)
+):
+    """
+    Bulk chat endpoint for evaluation sets and replays.
+    
+    The request body is JSONL, one {"message": ...} per line. Every message
+    runs through the same input processing, AI call and response processing
+    as /chat, without conversation history, at batch admission priority.
+    Results are streamed back as NDJSON in completion order, each tagged
+    with the index of its input line:
+    {"index": 0, "response": "...", "attempts": 1} or
+    {"index": 1, "error": "...", "attempts": 3}. The body is read
+    incrementally, so memory use does not grow with the size of the batch.
+    
+    Args:
+        concurrency: Prompts in flight, capped at BATCH_MAX_CONCURRENCY
+        retries: Retries per prompt before it is reported as failed
+        use_cache: Set to False to bypass the response cache
+        profile: Prompt profile name; defaults to the user's A/B variant
         
-        # Step 1: Process input (add joke request)
-        processed_message = await process_input_async(request.message)
-        logger.info(f"Processed input: {processed_message[:100]}...")
+    Returns:
+        StreamingResponse with media type application/x-ndjson
+    """
+    max_concurrency = int(os.getenv("BATCH_MAX_CONCURRENCY", "32"))
+    prompt_profile = select_profile(profile, user_session.get("name", "Unknown"))
+    runner = BatchRunner(
+        get_settings().baseten_api_key,
+        concurrency=min(concurrency, max_concurrency) if concurrency else None,
+        retries=retries,
+        use_cache=use_cache,
+        profile=prompt_profile
+    )
+    logger.info("Batch chat request received (concurrency: %s)", runner.concurrency)
+    
+    async def generate() -> AsyncIterator[str]:
+        try:
+            async for result in runner.run(split_lines(http_request.stream())):
+                yield json.dumps(result) + "\n"
+        except BatchLineError as e:
+            yield json.dumps({"error": str(e)}) + "\n"
+        logger.info("Batch chat request finished: %s", runner.stats())
+    
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+def format_sse(event: str, data: dict) -> str:
+    """Format a single Server-Sent Events message"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request, user_session: dict = Depends(get_current_user)):
+    """
+    Streaming chat endpoint that forwards the AI response as Server-Sent Events.
+    
+    Emits a `start` event with the conversation id, one `delta` event per
+    chunk of generated text (including the response processor suffix), and
+    a final `done` event. Failures after the stream has started are reported
+    as an `error` event since the status code has already been sent.
+    The request deadline bounds input processing and the wait for the
+    first token; a client disconnect cancels the upstream stream.
+    
+    Args:
+        request: ChatRequest containing the message and optional conversation_id
+        
+    Returns:
+        StreamingResponse with media type text/event-stream
+        
+    Raises:
+        HTTPException: If input processing fails or the upstream queue is full
+    """
+    try:
+        user_name = user_session.get("name", "Unknown")
+        profile = select_profile(request.profile, user_name)
+        logger.info("Streaming chat request received (conversation: %s, %s chars)", request.conversation_id, len(request.message))
         
-        # Step 2: Get AI response
-        ai_response = await get_ai_response_async(processed_message, settings.baseten_api_key)
-        logger.info(f"AI response received: {ai_response[:50]}...")
+        # Fail fast while a proper status code can still be sent
+        get_admission_controller().ensure_capacity()
+        deadline = request_deadline(http_request.headers)
         
-        # Step 3: Process response (add joke acknowledgment)
-        final_response = await process_response_async(ai_response)
-        logger.info(f"Final response: {final_response[:50]}...")
+        conversation_id = request.conversation_id or f"conv_{datetime.now().timestamp()}"
+        conversation_key = ConversationStore.make_key(user_name, conversation_id)
+        conversation_store = get_conversation_store()
         
-        return ChatResponse(
-            response=final_response,
-            conversation_id=request.conversation_id or f"conv_{datetime.now().timestamp()}",
-            timestamp=datetime.now().isoformat()
+        # Queue input for the database; the write happens off the chat path
+        input_id, input_saved = get_input_log().enqueue(
+            request.message, request.conversation_id, request.input_id
         )
         
+        # Step 1: Process input before the upstream stream is opened
+        processed_message = await process_input_async(request.message, deadline)
+        history = await conversation_store.build_history(conversation_key)
+        
+    except HTTPException:
+        raise
+    except AdmissionRejected as e:
+        raise admission_http_error(e)
     except Exception as e:
-        logger.error(f"Error processing chat request: {str(e)}")
+        logger.error("Error processing chat request: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Failed to process request: {str(e)}"
         )
+    
+    async def event_stream() -> AsyncIterator[str]:
+        # The response may be iterated outside the handler's context
+        use_profile(profile)
+        yield format_sse("start", {
+            "conversation_id": conversation_id,
+            "input_id": input_id,
+            "input_saved": input_saved,
+            "profile": profile.label
+        })
+        try:
+            # Steps 2 and 3: Forward AI deltas through the response processor
+            ai_chunks = []
+            
+            async def record(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+                async for chunk in chunks:
+                    ai_chunks.append(chunk)
+                    yield chunk
+            
+            chunks = stream_ai_response_async(
+                processed_message, get_settings().baseten_api_key, history,
+                use_cache=request.use_cache, cache_text=request.message,
+                deadline=deadline, profile=profile
+            )
+            async for delta in process_response_stream(record(chunks)):
+                yield format_sse("delta", {"delta": delta})
+            
+            await conversation_store.append(conversation_key, request.message, "".join(ai_chunks))
+            
+            yield format_sse("done", {
+                "conversation_id": conversation_id,
+                "timestamp": datetime.now().isoformat()
+            })
+        except asyncio.CancelledError:
+            # The client disconnected; closing the generators stops the upstream stream
+            record_abort("cancelled", "stream")
+            raise
+        except AdmissionRejected as e:
+            yield format_sse("error", {"detail": str(e), "retry_after": e.retry_after})
+        except Exception as e:
+            logger.error("Error streaming chat response: %s", e)
+            yield format_sse("error", {"detail": f"Failed to process request: {str(e)}"})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no"
+        }
+    )
 
-@app.get("/health", response_model=HealthResponse)
+@router.get("/health", response_model=HealthResponse)
 async def health():
     """
     Health check endpoint for monitoring.
     
     Returns:
-        HealthResponse with service status
+        HealthResponse with service status and database connectivity
     """
+    database = get_database()
+    if not database.is_connected:
+        database_status = "disconnected"
+    elif await database.ping():
+        database_status = "connected"
+    else:
+        database_status = "unreachable"
+    
     return HealthResponse(
         status="healthy",
         service="backend",
-        timestamp=datetime.now().isoformat()
+        timestamp=datetime.now().isoformat(),
+        database=database_status
     )
 
-@app.get("/")
+@router.get("/stats", dependencies=[Depends(require_admin)])
+async def stats():
+    """
+    Runtime statistics for the in-process caches and queues. Requires
+    Authorization: Bearer $ADMIN_TOKEN.
+    
+    Returns:
+        Dict of per-subsystem counters
+    """
+    return {
+        "response_cache": get_response_cache().stats(),
+        "single_flight": get_single_flight().stats(),
+        "admission": get_admission_controller().stats(),
+        "llm_router": get_router(get_settings().baseten_api_key).stats(),
+        "pipelines": {
+            "input": input_pipeline.stats(),
+            "response": response_pipeline.stats()
+        },
+        "conversations": get_conversation_store().stats(),
+        "input_log": get_input_log().stats(),
+        "auth": {
+            "verification_cache": verification_cache.stats(),
+            "session_store": get_session_store().stats()
+        },
+        "rate_limit": {**get_rate_limiter().stats(), "per_address": get_address_rate_limiter().stats()},
+        "prompts": get_prompt_registry().stats(),
+        "cancellation": cancellation_stats(),
+        "idempotency": get_idempotent_requests().stats(),
+        "logging": {"dropped_records": dropped_records()},
+        "timestamp": datetime.now().isoformat()
+    }
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """
+    Prometheus metrics for this server.
+    
+    With METRICS_DIR set the snapshots of all workers are merged, so any
+    worker answers for the whole server.
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/")
 async def root():
     """
     Root endpoint with API information.
@@ -248,14 +646,19 @@ async def root():
         "status": "running",
         "docs": "/docs",
         "redoc": "/redoc",
-        "health": "/health"
+        "health": "/health",
+        "stats": "/stats",
+        "metrics": "/metrics"
     }
 
 if __name__ == "__main__":
     import uvicorn
+    settings = get_settings()
     uvicorn.run(
-        app,
+        "app:create_app",
+        factory=True,
         host="0.0.0.0",
         port=settings.port,
+        workers=settings.web_concurrency,
         log_level=settings.log_level.lower()
-    )
\ No newline at end of file
+    )
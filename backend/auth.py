@@ -2,27 +2,96 @@
 Authentication Module
 Handles user authentication and session management
 """
-from datetime import datetime, timedelta
-from typing import Optional, Dict
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Dict, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel
+from session_store import get_session_store
+from settings import get_settings
+from metrics import AUTH_VERIFY_SECONDS
+import hashlib
 import secrets
 import logging
+import os
+import time
 
 logger = logging.getLogger(__name__)
 
 # Configuration
-SECRET_KEY = secrets.token_urlsafe(32)  # Generate a random secret key
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "1440"))  # 24 hours
+
+_secret_key: Optional[str] = None
+
+def get_secret_key() -> str:
+    """
+    The JWT signing key: SECRET_KEY from the same settings (environment or
+    .env) that the app's multi-worker startup check reads. All workers and
+    replicas must share it to accept each other's tokens.
+    """
+    global _secret_key
+    if _secret_key is None:
+        _secret_key = get_settings().secret_key
+        if not _secret_key:
+            _secret_key = secrets.token_urlsafe(32)
+            logger.warning("SECRET_KEY is not set; using a random per-process key, sessions will not survive restarts or span workers")
+    return _secret_key
 
 # Password hashing
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
-# In-memory session store (for simple implementation)
-# In production, use Redis or a database
-sessions: Dict[str, dict] = {}
+REVOKED_PREFIX = "revoked:"
+
+class VerificationCache:
+    """
+    LRU cache of verified tokens keyed by the token's SHA-256.
+
+    An entry lives until the token's own exp or ttl_seconds, whichever comes
+    first, so a cached token never outlives its signature and a revocation
+    made on another worker is picked up within ttl_seconds.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        self.max_entries = max_entries or int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))
+        self._entries: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token_hash: str) -> Optional[dict]:
+        entry = self._entries.get(token_hash)
+        if entry is not None:
+            user_info, expires_at = entry
+            if time.time() < expires_at:
+                self._entries.move_to_end(token_hash)
+                self.hits += 1
+                return user_info
+            del self._entries[token_hash]
+        self.misses += 1
+        return None
+
+    def set(self, token_hash: str, user_info: dict, exp: float) -> None:
+        self._entries[token_hash] = (user_info, min(exp, time.time() + self.ttl_seconds))
+        self._entries.move_to_end(token_hash)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def discard(self, token_hash: str) -> None:
+        self._entries.pop(token_hash, None)
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "capacity": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
+
+verification_cache = VerificationCache()
 
 class LoginRequest(BaseModel):
     name: str
@@ -61,14 +130,14 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
+    encoded_jwt = jwt.encode(to_encode, get_secret_key(), algorithm=ALGORITHM)
     return encoded_jwt
 
 def verify_token(token: str) -> Optional[dict]:
     """Verify and decode a JWT token"""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, get_secret_key(), algorithms=[ALGORITHM])
         return payload
     except JWTError:
         return None
@@ -83,11 +152,11 @@ async def authenticate_user(name: str, password: str) -> Optional[dict]:
     password = password.strip()[:32]
     
     if not name or not password:
-        logger.warning(f"Login attempt with empty credentials")
+        logger.warning("Login attempt with empty credentials")
         return None
     
     if password.lower() != "password":
-        logger.warning(f"Login attempt with incorrect password for user: {name}")
+        logger.warning("Login attempt with incorrect password for user: %s", name)
         return None
     
     # Create user session
@@ -96,36 +165,56 @@ async def authenticate_user(name: str, password: str) -> Optional[dict]:
         "login_time": datetime.utcnow().isoformat()
     }
     
-    logger.info(f"User authenticated successfully: {name}")
+    logger.info("User authenticated successfully: %s", name)
     return user_info
 
+def hash_token(token: str) -> str:
+    """Stable identifier for a token that is safe to use as a cache or store key"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
 def create_session(user_info: dict) -> str:
-    """Create a session and return session token"""
-    token = create_access_token(data={"sub": user_info["name"]})
-    sessions[token] = user_info
-    return token
+    """
+    Create a session and return session token.
+    The token carries everything needed to rebuild the session, so any
+    worker holding SECRET_KEY can validate it without shared state.
+    """
+    return create_access_token(data={"sub": user_info["name"], "login_time": user_info["login_time"]})
 
-def get_session(token: str) -> Optional[dict]:
+async def get_session(token: str) -> Optional[dict]:
     """Get session info from token"""
+    started = time.perf_counter()
+    token_hash = hash_token(token)
+    user_info = verification_cache.get(token_hash)
+    if user_info is not None:
+        AUTH_VERIFY_SECONDS.observe(time.perf_counter() - started, "cached")
+        return user_info
+    
     # First verify the token is valid
     payload = verify_token(token)
     if not payload:
+        AUTH_VERIFY_SECONDS.observe(time.perf_counter() - started, "invalid")
         return None
     
-    # Check if session exists
-    if token in sessions:
-        return sessions[token]
+    # Logged-out tokens stay revoked until they would have expired anyway
+    if await get_session_store().get(REVOKED_PREFIX + token_hash) is not None:
+        AUTH_VERIFY_SECONDS.observe(time.perf_counter() - started, "revoked")
+        return None
     
-    # If token is valid but session doesn't exist, create one
-    # This handles server restarts
     user_info = {
         "name": payload.get("sub"),
-        "login_time": datetime.utcnow().isoformat()
+        "login_time": payload.get("login_time") or datetime.utcnow().isoformat()
     }
-    sessions[token] = user_info
+    verification_cache.set(token_hash, user_info, payload["exp"])
+    AUTH_VERIFY_SECONDS.observe(time.perf_counter() - started, "verified")
     return user_info
 
-def remove_session(token: str):
-    """Remove a session"""
-    if token in sessions:
-        del sessions[token]
\ No newline at end of file
+async def remove_session(token: str):
+    """Revoke a session until its token expires"""
+    token_hash = hash_token(token)
+    verification_cache.discard(token_hash)
+    payload = verify_token(token)
+    if not payload:
+        return
+    ttl = payload["exp"] - time.time()
+    if ttl > 0:
+        await get_session_store().set(REVOKED_PREFIX + token_hash, {"revoked_at": datetime.now(timezone.utc).isoformat()}, ttl)
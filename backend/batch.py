@@ -0,0 +1,245 @@
+"""
+Batch Module
+Bulk chat processing of JSONL prompts with bounded concurrency, streaming NDJSON results
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import sys
+from typing import AsyncIterator, Iterable, List, Optional, Set
+
+from admission import PRIORITY_BATCH, AdmissionRejected
+from input_processor import process_input_async
+from llm_gateway import get_ai_response_async
+from prompt_registry import PromptProfile, get_prompt_registry, use_profile
+from response_processor import process_response_async
+from sync_runner import get_loop_runner
+
+logger = logging.getLogger(__name__)
+
+class BatchLineError(ValueError):
+    """Raised for an input line that is not a usable prompt"""
+
+def parse_line(line: str) -> str:
+    """
+    Extract the message from one JSONL line: either an object with a
+    "message" field or a bare JSON string.
+    """
+    try:
+        # Readers decode with surrogateescape, so invalid UTF-8 only fails here
+        line.encode("utf-8")
+    except UnicodeEncodeError as e:
+        raise BatchLineError(f"Invalid UTF-8 at character {e.start}") from e
+    try:
+        item = json.loads(line)
+    except ValueError as e:
+        raise BatchLineError(f"Invalid JSON: {e}") from e
+    if isinstance(item, dict):
+        item = item.get("message")
+    if not isinstance(item, str) or not item.strip():
+        raise BatchLineError('Expected a non-empty "message" string')
+    return item
+
+async def split_lines(chunks: AsyncIterator[bytes], max_line_bytes: Optional[int] = None) -> AsyncIterator[str]:
+    """
+    Turn a byte stream into text lines without holding more than one line,
+    so request bodies are never buffered whole. Blank lines are skipped; a
+    line longer than max_line_bytes is a client error. Invalid UTF-8 is kept
+    as lone surrogates, so parse_line reports just that line and the rest
+    of the batch still runs.
+    """
+    max_line_bytes = max_line_bytes or int(os.getenv("BATCH_MAX_LINE_BYTES", str(1024 * 1024)))
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line.decode("utf-8", errors="surrogateescape")
+        if len(pending) > max_line_bytes:
+            raise BatchLineError(f"Input line longer than {max_line_bytes} bytes")
+    if pending.strip():
+        yield pending.decode("utf-8", errors="surrogateescape")
+
+class BatchRunner:
+    """
+    Runs each prompt through input processing, the AI call and response
+    processing, with at most `concurrency` prompts in flight.
+
+    Input lines are pulled only when a slot frees up and results are yielded
+    as soon as they complete, so memory stays constant however long the
+    input is, and a slow reader of the output pauses intake instead of
+    piling up results. Upstream calls use batch admission priority, so
+    interactive chat is always served first. Failed prompts are retried
+    with jittered exponential backoff (honouring Retry-After for admission
+    rejections) before being reported as errors. Every prompt uses the
+    given prompt profile, or the registry default.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        concurrency: Optional[int] = None,
+        retries: Optional[int] = None,
+        use_cache: bool = True,
+        backoff: Optional[float] = None,
+        profile: Optional[PromptProfile] = None,
+    ):
+        self.api_key = api_key
+        self.profile = profile or get_prompt_registry().default
+        self.concurrency = max(1, concurrency or int(os.getenv("BATCH_CONCURRENCY", "8")))
+        self.retries = retries if retries is not None else int(os.getenv("BATCH_MAX_RETRIES", "2"))
+        self.use_cache = use_cache
+        self.backoff = backoff or float(os.getenv("BATCH_RETRY_BACKOFF_SECONDS", "1.0"))
+        self.completed = 0
+        self.failed = 0
+
+    async def process(self, message: str) -> str:
+        # Each prompt runs in its own task, so this only affects that prompt
+        use_profile(self.profile)
+        processed_message = await process_input_async(message)
+        ai_response = await get_ai_response_async(
+            processed_message, self.api_key,
+            use_cache=self.use_cache, cache_text=message, priority=PRIORITY_BATCH,
+            profile=self.profile
+        )
+        return await process_response_async(ai_response)
+
+    async def run_one(self, index: int, line: str) -> dict:
+        try:
+            message = parse_line(line)
+        except BatchLineError as e:
+            self.failed += 1
+            return {"index": index, "error": str(e), "attempts": 0}
+
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = await self.process(message)
+                self.completed += 1
+                return {"index": index, "response": response, "attempts": attempt}
+            except Exception as e:
+                if attempt > self.retries:
+                    self.failed += 1
+                    logger.warning("Batch item %s failed after %s attempts: %s", index, attempt, e)
+                    return {"index": index, "error": str(e), "attempts": attempt}
+                delay = self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                if isinstance(e, AdmissionRejected) and e.retry_after is not None:
+                    delay = max(delay, e.retry_after)
+                await asyncio.sleep(delay)
+
+    async def run(self, lines: AsyncIterator[str]) -> AsyncIterator[dict]:
+        """Yield one result per input line, in completion order, tagged with the line's index"""
+        lines = lines.__aiter__()
+        in_flight: Set[asyncio.Task] = set()
+        index = 0
+        exhausted = False
+        try:
+            while True:
+                while not exhausted and len(in_flight) < self.concurrency:
+                    try:
+                        line = await lines.__anext__()
+                    except StopAsyncIteration:
+                        exhausted = True
+                        break
+                    in_flight.add(asyncio.create_task(self.run_one(index, line)))
+                    index += 1
+                if not in_flight:
+                    return
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+        finally:
+            # The consumer went away or the input was malformed; stop outstanding work
+            for task in in_flight:
+                task.cancel()
+
+    def stats(self) -> dict:
+        return {"completed": self.completed, "failed": self.failed}
+
+def run_batch(messages: Iterable[str], api_key: Optional[str] = None, **options) -> List[dict]:
+    """
+    Synchronous batch API for scripts, task-queue workers and notebooks.
+
+    Runs every message through the full chat pipeline on the shared
+    background loop, reusing its upstream connections across calls, and
+    returns one result per message in input order, shaped like the
+    /chat/batch output. options are passed to BatchRunner.
+    """
+    api_key = api_key or os.getenv("BASETEN_API_KEY")
+    if not api_key:
+        raise ValueError("BASETEN_API_KEY environment variable is required")
+    runner = BatchRunner(api_key, **options)
+
+    async def lines() -> AsyncIterator[str]:
+        for message in messages:
+            yield json.dumps({"message": message})
+
+    async def collect() -> List[dict]:
+        return [result async for result in runner.run(lines())]
+
+    return sorted(get_loop_runner().run(collect()), key=lambda result: result["index"])
+
+async def _read_file(path: str) -> AsyncIterator[str]:
+    if path == "-":
+        stream = open(sys.stdin.fileno(), encoding="utf-8", errors="surrogateescape", closefd=False)
+    else:
+        stream = open(path, encoding="utf-8", errors="surrogateescape")
+    try:
+        while True:
+            line = await asyncio.to_thread(stream.readline)
+            if not line:
+                return
+            if line.strip():
+                yield line
+    finally:
+        stream.close()
+
+async def _main(args: argparse.Namespace) -> int:
+    from llm_router import close_router
+
+    api_key = os.getenv("BASETEN_API_KEY")
+    if not api_key:
+        print("BASETEN_API_KEY must be set", file=sys.stderr)
+        return 2
+
+    try:
+        profile = get_prompt_registry().select(args.profile)
+    except KeyError:
+        print(f"Unknown prompt profile: {args.profile}", file=sys.stderr)
+        return 2
+
+    runner = BatchRunner(
+        api_key, concurrency=args.concurrency, retries=args.retries,
+        use_cache=not args.no_cache, profile=profile
+    )
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        async for result in runner.run(_read_file(args.input)):
+            output.write(json.dumps(result) + "\n")
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        await close_router()
+    stats = runner.stats()
+    print(f"Completed {stats['completed']}, failed {stats['failed']}", file=sys.stderr)
+    return 1 if stats["failed"] else 0
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run a JSONL file of chat messages through the pipeline, writing NDJSON results")
+    parser.add_argument("input", help='JSONL file, one {"message": ...} per line, or - for stdin')
+    parser.add_argument("-o", "--output", default="-", help="NDJSON output file (default: stdout)")
+    parser.add_argument("--concurrency", type=int, help="prompts in flight (default: BATCH_CONCURRENCY or 8)")
+    parser.add_argument("--retries", type=int, help="retries per prompt (default: BATCH_MAX_RETRIES or 2)")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the response cache")
+    parser.add_argument("--profile", help="prompt profile name (default: the registry default)")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper(), stream=sys.stderr)
+    return asyncio.run(_main(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
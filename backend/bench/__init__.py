@@ -0,0 +1,5 @@
+"""
+Benchmark Harness
+Mock OpenAI-compatible upstream, open-loop load generator and regression gate
+for the FastAPI backend and the legacy Flask gateway
+"""
@@ -0,0 +1,94 @@
+"""
+Benchmark command line.
+
+    python -m bench mock --ttft 0.3 --tokens-per-second 50
+    python -m bench run chat_burst --target backend --rps 40 --duration 30
+    python -m bench compare baseline.json current.json
+
+Run from the backend directory.
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+from datetime import datetime
+
+from bench import mock_upstream
+from bench.compare import compare
+from bench.mock_upstream import MockConfig
+from bench.scenarios import BACKEND_DIR, run
+
+SCENARIOS = ("login_storm", "chat_burst", "slow_upstream")
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__.split("\n")[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("mock", help="run the mock upstream in the foreground", add_help=False)
+
+    run_parser = commands.add_parser("run", help="run a load scenario")
+    run_parser.add_argument("scenario", choices=SCENARIOS)
+    run_parser.add_argument("--target", choices=("backend", "legacy", "legacy-async"), default="backend")
+    run_parser.add_argument("--target-url", help="benchmark an already running server instead of starting one")
+    run_parser.add_argument("--server-pid", type=int, help="pid to sample CPU/RSS from with --target-url")
+    run_parser.add_argument("--upstream-url", help="use an already running mock upstream")
+    run_parser.add_argument("--workers", type=int, default=1)
+    run_parser.add_argument("--rps", type=float, default=20.0)
+    run_parser.add_argument("--duration", type=float, default=30.0)
+    run_parser.add_argument("--arrival", choices=("poisson", "uniform"), default="poisson")
+    run_parser.add_argument("--users", type=int, default=20, help="distinct logged-in users for chat scenarios")
+    run_parser.add_argument("--no-stream", action="store_true", help="use /chat instead of /chat/stream")
+    run_parser.add_argument("--use-cache", action="store_true", help="allow response cache hits")
+    run_parser.add_argument("--max-in-flight", type=int, default=1000)
+    run_parser.add_argument("--request-timeout", type=float, default=120.0)
+    run_parser.add_argument("--ttft", type=float, default=MockConfig.ttft)
+    run_parser.add_argument("--tokens-per-second", type=float, default=MockConfig.tokens_per_second)
+    run_parser.add_argument("--output-tokens", type=int, default=MockConfig.output_tokens)
+    run_parser.add_argument("--error-rate", type=float, default=MockConfig.error_rate)
+    run_parser.add_argument("--jitter", type=float, default=MockConfig.jitter)
+    run_parser.add_argument("--slowdown", type=float, default=10.0, help="upstream slowdown factor in slow_upstream")
+    run_parser.add_argument("--output", help="result file (default bench/results/<scenario>-<target>-<time>.json)")
+
+    compare_parser = commands.add_parser("compare", help="fail if current regressed against baseline")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance-scale", type=float, default=1.0, help="multiply every tolerance")
+    return parser
+
+def main(argv=None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["mock"]:
+        mock_upstream.main(argv[1:])
+        return 0
+
+    args = build_parser().parse_args(argv)
+    if args.command == "run":
+        # Turn SIGTERM into an exit so the spawned servers are stopped
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(128 + signum))
+        result = run(args)
+        output = args.output or os.path.join(
+            BACKEND_DIR, "bench", "results",
+            f"{args.scenario}-{args.target}-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json",
+        )
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+        print(json.dumps(result["overall"], indent=2))
+        print(f"Results written to {output}")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    report = compare(baseline, current, args.tolerance_scale)
+    for warning in report["warnings"]:
+        print(f"warning: {warning}")
+    for row in report["metrics"]:
+        flag = "REGRESSED" if row["regressed"] else "ok"
+        print(f"{row['metric']:<28} {row['baseline']:>10} -> {row['current']:>10} (limit {row['limit']}) {flag}")
+    return 1 if report["regressions"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
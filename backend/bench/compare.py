@@ -0,0 +1,62 @@
+"""
+Compare Module
+Regression gate between two benchmark result files
+"""
+from typing import Dict, List, Optional, Tuple
+
+# (path into the result, direction, default tolerance). "higher" means a
+# larger value is worse; tolerances are relative except for error_rate,
+# which is compared in absolute percentage points
+CHECKS: List[Tuple[str, str, float]] = [
+    ("overall.latency_ms.p50", "higher", 0.10),
+    ("overall.latency_ms.p95", "higher", 0.10),
+    ("overall.latency_ms.p99", "higher", 0.15),
+    ("overall.ttft_ms.p95", "higher", 0.10),
+    ("overall.error_rate", "higher", 0.01),
+    ("overall.throughput_rps", "lower", 0.05),
+    ("server.cpu_percent_avg", "higher", 0.20),
+    ("server.rss_mb_max", "higher", 0.20),
+]
+
+def lookup(result: dict, path: str) -> Optional[float]:
+    value = result
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+def compare(baseline: dict, current: dict, tolerance_scale: float = 1.0) -> Dict[str, object]:
+    """
+    Check current against baseline.
+
+    Returns a report with every compared metric and the list of regressions,
+    i.e. metrics that moved the wrong way by more than their tolerance.
+    """
+    rows = []
+    regressions = []
+    for path, direction, tolerance in CHECKS:
+        before, after = lookup(baseline, path), lookup(current, path)
+        if before is None or after is None:
+            continue
+        tolerance *= tolerance_scale
+        if path.endswith("error_rate"):
+            limit = before + tolerance
+        elif direction == "higher":
+            limit = before * (1 + tolerance)
+        else:
+            limit = before * (1 - tolerance)
+        regressed = after > limit if direction == "higher" else after < limit
+        row = {"metric": path, "baseline": before, "current": after, "limit": round(limit, 4), "regressed": regressed}
+        rows.append(row)
+        if regressed:
+            regressions.append(row)
+
+    warnings = []
+    for key in ("scenario", "target"):
+        if baseline.get(key) != current.get(key):
+            warnings.append(f"{key} differs: {baseline.get(key)} vs {current.get(key)}")
+    if baseline.get("config", {}).get("rps") != current.get("config", {}).get("rps"):
+        warnings.append("offered load differs between runs")
+
+    return {"metrics": rows, "regressions": regressions, "warnings": warnings}
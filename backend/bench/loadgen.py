@@ -0,0 +1,155 @@
+"""
+Load Generator Module
+Open-loop request driver and latency summaries
+"""
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+# A request that starts this much later than scheduled means the generator
+# itself fell behind and the run under-reports queueing
+LATE_START_SECONDS = 0.01
+
+@dataclass
+class RequestSpec:
+    method: str
+    path: str
+    json: Optional[dict] = None
+    headers: Dict[str, str] = field(default_factory=dict)
+    stream: bool = False
+
+@dataclass
+class Sample:
+    phase: str
+    scheduled: float
+    start_lag: float
+    latency: Optional[float] = None
+    ttft: Optional[float] = None
+    status: Optional[int] = None
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None and self.status is not None and self.status < 400
+
+async def execute(client: httpx.AsyncClient, spec: RequestSpec, sample: Sample) -> None:
+    """Send one request and record latency, time to first delta and outcome"""
+    start = time.perf_counter()
+    try:
+        if spec.stream:
+            async with client.stream(spec.method, spec.path, json=spec.json, headers=spec.headers) as response:
+                sample.status = response.status_code
+                event = None
+                async for line in response.aiter_lines():
+                    if line.startswith("event: "):
+                        event = line[7:]
+                    elif line.startswith("data: "):
+                        if event == "delta" and sample.ttft is None:
+                            sample.ttft = time.perf_counter() - start
+                        elif event == "error":
+                            sample.error = "stream_error:" + json.loads(line[6:]).get("detail", "")[:80]
+        else:
+            response = await client.request(spec.method, spec.path, json=spec.json, headers=spec.headers)
+            sample.status = response.status_code
+        if sample.status >= 400 and sample.error is None:
+            sample.error = f"http_{sample.status}"
+    except httpx.HTTPError as e:
+        sample.error = type(e).__name__
+    finally:
+        sample.latency = time.perf_counter() - start
+
+async def run_open_loop(
+    client: httpx.AsyncClient,
+    rps: float,
+    duration: float,
+    make_request: Callable[[int], RequestSpec],
+    phase: str = "main",
+    arrival: str = "poisson",
+    max_in_flight: int = 2000,
+    samples: Optional[List[Sample]] = None,
+) -> List[Sample]:
+    """
+    Offer load at a fixed arrival rate regardless of how fast the server answers.
+
+    Arrivals are scheduled on the clock (Poisson or evenly spaced), not after
+    the previous response, so a slow server builds a queue the way it would
+    under real traffic instead of silently throttling the generator. Requests
+    beyond max_in_flight are recorded as client_overflow rather than sent.
+    """
+    samples = samples if samples is not None else []
+    tasks = set()
+    in_flight = 0
+    begin = time.perf_counter()
+    next_at = 0.0
+    index = 0
+
+    async def send(spec: RequestSpec, sample: Sample) -> None:
+        nonlocal in_flight
+        in_flight += 1
+        try:
+            await execute(client, spec, sample)
+        finally:
+            in_flight -= 1
+
+    while next_at < duration:
+        delay = begin + next_at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        sample = Sample(phase=phase, scheduled=next_at, start_lag=max(0.0, time.perf_counter() - begin - next_at))
+        samples.append(sample)
+        if in_flight >= max_in_flight:
+            sample.error = "client_overflow"
+        else:
+            task = asyncio.create_task(send(make_request(index), sample))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        index += 1
+        next_at += random.expovariate(rps) if arrival == "poisson" else 1.0 / rps
+
+    if tasks:
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return samples
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of an unsorted list"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(q / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+def distribution_ms(values: List[float]) -> Dict[str, Optional[float]]:
+    def ms(value: Optional[float]) -> Optional[float]:
+        return round(value * 1000, 2) if value is not None else None
+    return {
+        "p50": ms(percentile(values, 50)),
+        "p95": ms(percentile(values, 95)),
+        "p99": ms(percentile(values, 99)),
+        "mean": ms(sum(values) / len(values)) if values else None,
+        "max": ms(max(values)) if values else None,
+    }
+
+def summarize(samples: List[Sample], duration: float) -> Dict[str, object]:
+    """Latency, TTFT, throughput and error breakdown for a set of samples"""
+    ok = [s for s in samples if s.ok]
+    errors: Dict[str, int] = {}
+    for s in samples:
+        if not s.ok:
+            key = s.error or f"http_{s.status}"
+            errors[key] = errors.get(key, 0) + 1
+    return {
+        "requests": len(samples),
+        "ok": len(ok),
+        "errors": errors,
+        "error_rate": round(1 - len(ok) / len(samples), 4) if samples else 0.0,
+        "offered_rps": round(len(samples) / duration, 2) if duration else 0.0,
+        "throughput_rps": round(len(ok) / duration, 2) if duration else 0.0,
+        "latency_ms": distribution_ms([s.latency for s in ok]),
+        "ttft_ms": distribution_ms([s.ttft for s in ok if s.ttft is not None]),
+        "late_starts": sum(1 for s in samples if s.start_lag > LATE_START_SECONDS),
+    }
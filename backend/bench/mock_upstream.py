@@ -0,0 +1,188 @@
+"""
+Mock Upstream Module
+OpenAI-compatible chat completions server with configurable latency and failures
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from typing import AsyncIterator, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "well that sounds like a lot to carry and it makes sense you feel this way "
+    "here is a joke why did the scarecrow win an award because he was outstanding in his field"
+).split()
+
+@dataclass
+class MockConfig:
+    ttft: float = 0.3               # seconds before the first token
+    tokens_per_second: float = 50.0 # generation speed after the first token
+    output_tokens: int = 60         # tokens per completion
+    error_rate: float = 0.0         # fraction of requests that fail
+    error_status: int = 500         # status code of failed requests
+    jitter: float = 0.2             # +/- fraction applied to ttft and token gaps
+
+    def jittered(self, value: float) -> float:
+        if self.jitter <= 0:
+            return value
+        return max(0.0, value * (1 + random.uniform(-self.jitter, self.jitter)))
+
+class MockStats:
+    def __init__(self):
+        self.requests = 0
+        self.streams = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+def estimate_prompt_tokens(messages: list) -> int:
+    return sum(len(str(m.get("content", ""))) // 4 + 4 for m in messages)
+
+def create_mock_app(config: Optional[MockConfig] = None) -> FastAPI:
+    """
+    Build the mock server.
+
+    POST /v1/chat/completions answers streaming and non-streaming requests
+    with generated text paced by the config. GET/POST /_config reads or
+    changes the config while running, so a scenario can degrade the
+    upstream mid-run; GET /_stats reports what the mock has seen.
+    """
+    app = FastAPI(title="Mock LLM upstream")
+    app.state.config = config or MockConfig()
+    stats = MockStats()
+
+    def error_response(status: int) -> JSONResponse:
+        stats.errors += 1
+        return JSONResponse(
+            status_code=status,
+            content={"error": {"message": "Injected mock failure", "type": "mock_error", "code": status}},
+        )
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        config: MockConfig = app.state.config
+        stats.requests += 1
+        if random.random() < config.error_rate:
+            await asyncio.sleep(config.jittered(config.ttft) / 2)
+            return error_response(config.error_status)
+
+        model = body.get("model", "mock")
+        prompt_tokens = estimate_prompt_tokens(body.get("messages", []))
+        output_tokens = min(config.output_tokens, int(body.get("max_tokens") or config.output_tokens))
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        gap = 1.0 / config.tokens_per_second if config.tokens_per_second > 0 else 0.0
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": output_tokens,
+            "total_tokens": prompt_tokens + output_tokens,
+        }
+
+        def token(i: int) -> str:
+            return ("" if i == 0 else " ") + WORDS[i % len(WORDS)]
+
+        if not body.get("stream"):
+            stats.in_flight += 1
+            stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+            try:
+                await asyncio.sleep(config.jittered(config.ttft) + config.jittered(gap * max(0, output_tokens - 1)))
+            finally:
+                stats.in_flight -= 1
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(token(i) for i in range(output_tokens))},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            }
+
+        stats.streams += 1
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+
+        def chunk(delta: dict, finish_reason: Optional[str] = None) -> str:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(payload)}\n\n"
+
+        async def events() -> AsyncIterator[str]:
+            stats.in_flight += 1
+            stats.max_in_flight = max(stats.max_in_flight, stats.in_flight)
+            try:
+                await asyncio.sleep(config.jittered(config.ttft))
+                yield chunk({"role": "assistant", "content": ""})
+                for i in range(output_tokens):
+                    if i:
+                        await asyncio.sleep(config.jittered(gap))
+                    yield chunk({"content": token(i)})
+                yield chunk({}, "stop")
+                if include_usage:
+                    yield f"data: {json.dumps({'id': completion_id, 'object': 'chat.completion.chunk', 'created': created, 'model': model, 'choices': [], 'usage': usage})}\n\n"
+                yield "data: [DONE]\n\n"
+            finally:
+                stats.in_flight -= 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": "mock", "object": "model", "owned_by": "bench"}]}
+
+    @app.get("/_config")
+    async def get_config():
+        return asdict(app.state.config)
+
+    @app.post("/_config")
+    async def set_config(request: Request):
+        values = asdict(app.state.config)
+        values.update(await request.json())
+        app.state.config = MockConfig(**values)
+        return values
+
+    @app.get("/_stats")
+    async def get_stats():
+        return dict(vars(stats))
+
+    return app
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Run the mock OpenAI-compatible upstream")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--ttft", type=float, default=MockConfig.ttft)
+    parser.add_argument("--tokens-per-second", type=float, default=MockConfig.tokens_per_second)
+    parser.add_argument("--output-tokens", type=int, default=MockConfig.output_tokens)
+    parser.add_argument("--error-rate", type=float, default=MockConfig.error_rate)
+    parser.add_argument("--error-status", type=int, default=MockConfig.error_status)
+    parser.add_argument("--jitter", type=float, default=MockConfig.jitter)
+    args = parser.parse_args(argv)
+
+    import uvicorn
+    config = MockConfig(
+        ttft=args.ttft,
+        tokens_per_second=args.tokens_per_second,
+        output_tokens=args.output_tokens,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        jitter=args.jitter,
+    )
+    uvicorn.run(create_mock_app(config), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Process Stats Module
+Samples CPU and RSS of a server process and its workers during a run
+"""
+import asyncio
+import os
+import time
+from typing import Dict, List, Optional
+
+try:
+    import psutil
+except ImportError:  # Fall back to reading /proc directly
+    psutil = None
+
+_CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+def _proc_children(pid: int) -> List[int]:
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children") as f:
+                children.extend(int(child) for child in f.read().split())
+    except OSError:
+        pass
+    return children
+
+def _proc_tree(pid: int) -> List[int]:
+    pids, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        pids.append(current)
+        pending.extend(_proc_children(current))
+    return pids
+
+def _proc_usage(pid: int):
+    """(cpu seconds, rss bytes) of one process from /proc"""
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / _CLOCK_TICKS
+    rss = int(fields[21]) * _PAGE_SIZE
+    return cpu, rss
+
+def tree_usage(pid: int):
+    """(cpu seconds, rss bytes) summed over a process and all its descendants"""
+    cpu = rss = 0
+    if psutil is not None:
+        try:
+            root = psutil.Process(pid)
+            for process in [root] + root.children(recursive=True):
+                try:
+                    times = process.cpu_times()
+                    cpu += times.user + times.system
+                    rss += process.memory_info().rss
+                except psutil.Error:
+                    pass
+        except psutil.Error:
+            pass
+        return cpu, rss
+    for current in _proc_tree(pid):
+        try:
+            c, r = _proc_usage(current)
+        except (OSError, IndexError, ValueError):
+            continue
+        cpu += c
+        rss += r
+    return cpu, rss
+
+class ProcessSampler:
+    """Background sampler of CPU percent (of one core) and RSS for a process tree"""
+
+    def __init__(self, pid: Optional[int], interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.cpu_percent: List[float] = []
+        self.rss_mb: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        last_cpu, _ = tree_usage(self.pid)
+        last_time = time.perf_counter()
+        while True:
+            await asyncio.sleep(self.interval)
+            cpu, rss = tree_usage(self.pid)
+            now = time.perf_counter()
+            self.cpu_percent.append((cpu - last_cpu) / (now - last_time) * 100)
+            self.rss_mb.append(rss / (1024 * 1024))
+            last_cpu, last_time = cpu, now
+
+    def start(self) -> None:
+        if self.pid is not None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def summary(self) -> Dict[str, Optional[float]]:
+        def stat(values: List[float], fn) -> Optional[float]:
+            return round(fn(values), 1) if values else None
+        return {
+            "cpu_percent_avg": stat(self.cpu_percent, lambda v: sum(v) / len(v)),
+            "cpu_percent_max": stat(self.cpu_percent, max),
+            "rss_mb_avg": stat(self.rss_mb, lambda v: sum(v) / len(v)),
+            "rss_mb_max": stat(self.rss_mb, max),
+        }
@@ -0,0 +1,257 @@
+"""
+Scenarios Module
+Starts the mock upstream and the server under test, then runs a load scenario
+"""
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httpx
+
+from bench.loadgen import RequestSpec, Sample, run_open_loop, summarize
+from bench.procstats import ProcessSampler
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LEGACY_DIR = os.path.join(BACKEND_DIR, "llm_gateway")
+
+@dataclass
+class Phase:
+    name: str
+    duration: float
+    rps: float
+    upstream: Optional[dict] = None  # mock config overrides applied at phase start
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def wait_until_up(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            # Any answer will do: /health reports degraded without a database
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+def start_mock(port: int, args) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "bench", "mock", "--port", str(port),
+        "--ttft", str(args.ttft), "--tokens-per-second", str(args.tokens_per_second),
+        "--output-tokens", str(args.output_tokens), "--error-rate", str(args.error_rate),
+        "--jitter", str(args.jitter),
+    ]
+    process = subprocess.Popen(command, cwd=BACKEND_DIR)
+    try:
+        wait_until_up(f"http://127.0.0.1:{port}/_config")
+    except BaseException:
+        stop(process)
+        raise
+    return process
+
+def start_target(target: str, port: int, upstream_url: str, workers: int) -> subprocess.Popen:
+    """
+    Start the server under test pointed at the mock upstream.
+
+    The caller's environment is passed through, so DATABASE_* and feature
+    flags can be set for the run; keys the benchmark needs get defaults.
+    """
+    env = dict(os.environ)
+    env["LLM_BASE_URL"] = upstream_url
+    env.setdefault("BASETEN_API_KEY", "bench")
+    env.setdefault("SECRET_KEY", "bench-secret")
+    env.setdefault("LOG_LEVEL", "WARNING")
+    # Load comes from one address and a handful of users; measure the server, not the limiter
+    env.setdefault("RATE_LIMIT_ENABLED", "false")
+    env["WEB_CONCURRENCY"] = str(workers)
+    env["PORT"] = str(port)
+
+    if target == "backend":
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:create_app()"]
+        cwd = BACKEND_DIR
+    elif target == "legacy":
+        command = [
+            sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}",
+            "--threads", env.get("BENCH_LEGACY_THREADS", "2"), "--timeout", "120", "app:app",
+        ]
+        cwd = LEGACY_DIR
+    elif target == "legacy-async":
+        command = [
+            sys.executable, "-m", "gunicorn", "--bind", f"127.0.0.1:{port}",
+            "-k", "uvicorn.workers.UvicornWorker", "--timeout", "120", "asgi_app:app",
+        ]
+        cwd = LEGACY_DIR
+    else:
+        raise ValueError(f"Unknown target '{target}'")
+
+    process = subprocess.Popen(command, cwd=cwd, env=env)
+    try:
+        wait_until_up(f"http://127.0.0.1:{port}/health")
+    except BaseException:
+        stop(process)
+        raise
+    return process
+
+def stop(process: Optional[subprocess.Popen]) -> None:
+    if process is None or process.poll() is not None:
+        return
+    process.terminate()
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+async def login(client: httpx.AsyncClient, name: str) -> str:
+    response = await client.post("/auth/login", json={"name": name, "password": "password"})
+    response.raise_for_status()
+    return response.json()["token"]
+
+def chat_request_factory(target: str, tokens: List[str], stream: bool, use_cache: bool) -> Callable[[int], RequestSpec]:
+    """Unique prompts by default so the response cache and single-flight do not flatter the run"""
+    run_id = uuid.uuid4().hex[:8]
+
+    def make(index: int) -> RequestSpec:
+        message = f"bench {run_id} message {index}: I had a long day and need to talk"
+        if target.startswith("legacy"):
+            return RequestSpec("POST", "/chat", json={"message": message})
+        body = {"message": message, "use_cache": use_cache}
+        headers = {"Cookie": f"auth_token={tokens[index % len(tokens)]}"}
+        return RequestSpec("POST", "/chat/stream" if stream else "/chat", json=body, headers=headers, stream=stream)
+
+    return make
+
+def login_request_factory() -> Callable[[int], RequestSpec]:
+    run_id = uuid.uuid4().hex[:8]
+
+    def make(index: int) -> RequestSpec:
+        return RequestSpec("POST", "/auth/login", json={"name": f"user-{run_id}-{index}", "password": "password"})
+
+    return make
+
+def scenario_phases(name: str, rps: float, duration: float, args) -> List[Phase]:
+    third = duration / 3
+    if name == "login_storm":
+        return [Phase("storm", duration, rps)]
+    if name == "chat_burst":
+        return [
+            Phase("steady", third, rps / 4),
+            Phase("burst", third, rps),
+            Phase("recovery", third, rps / 4),
+        ]
+    if name == "slow_upstream":
+        return [
+            Phase("normal", third, rps),
+            Phase("degraded", third, rps, upstream={
+                "ttft": args.ttft * args.slowdown,
+                "tokens_per_second": args.tokens_per_second / args.slowdown,
+            }),
+            Phase("recovered", third, rps, upstream={"ttft": args.ttft, "tokens_per_second": args.tokens_per_second}),
+        ]
+    raise ValueError(f"Unknown scenario '{name}'")
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+            capture_output=True, text=True, timeout=5,
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+async def drive(args, base_url: str, mock_url: Optional[str], server_pid: Optional[int]) -> Dict[str, object]:
+    limits = httpx.Limits(max_connections=args.max_in_flight, max_keepalive_connections=args.max_in_flight)
+    timeout = httpx.Timeout(args.request_timeout)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=timeout) as client:
+        if args.scenario == "login_storm":
+            make_request = login_request_factory()
+        else:
+            tokens = []
+            if not args.target.startswith("legacy"):
+                tokens = [await login(client, f"bench-user-{i}") for i in range(args.users)]
+            make_request = chat_request_factory(args.target, tokens, not args.no_stream, args.use_cache)
+
+        sampler = ProcessSampler(server_pid)
+        sampler.start()
+        samples: List[Sample] = []
+        phases = {}
+        started = time.perf_counter()
+        for phase in scenario_phases(args.scenario, args.rps, args.duration, args):
+            if phase.upstream and mock_url:
+                await client.post(f"{mock_url}/_config", json=phase.upstream)
+            phase_samples = await run_open_loop(
+                client, phase.rps, phase.duration, make_request, phase=phase.name,
+                arrival=args.arrival, max_in_flight=args.max_in_flight,
+            )
+            samples.extend(phase_samples)
+            phases[phase.name] = {"rps": phase.rps, "duration": phase.duration, **summarize(phase_samples, phase.duration)}
+        elapsed = time.perf_counter() - started
+        await sampler.stop()
+
+        mock_stats = None
+        if mock_url:
+            mock_stats = (await client.get(f"{mock_url}/_stats")).json()
+
+    return {
+        "overall": summarize(samples, elapsed),
+        "phases": phases,
+        "server": sampler.summary(),
+        "upstream": mock_stats,
+    }
+
+def run(args) -> Dict[str, object]:
+    """Run one scenario end to end and return the result document"""
+    mock = server = None
+    mock_url = args.upstream_url
+    try:
+        if args.target_url:
+            base_url = args.target_url
+            server_pid = args.server_pid
+        else:
+            if not mock_url:
+                mock_port = free_port()
+                mock = start_mock(mock_port, args)
+                mock_url = f"http://127.0.0.1:{mock_port}"
+            port = free_port()
+            server = start_target(args.target, port, f"{mock_url}/v1", args.workers)
+            base_url = f"http://127.0.0.1:{port}"
+            server_pid = server.pid
+
+        metrics = asyncio.run(drive(args, base_url, mock_url, server_pid))
+    finally:
+        stop(server)
+        stop(mock)
+
+    return {
+        "scenario": args.scenario,
+        "target": args.target,
+        "revision": git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "config": {
+            "rps": args.rps,
+            "duration": args.duration,
+            "arrival": args.arrival,
+            "workers": args.workers,
+            "stream": not args.no_stream,
+            "use_cache": args.use_cache,
+            "upstream": {
+                "ttft": args.ttft,
+                "tokens_per_second": args.tokens_per_second,
+                "output_tokens": args.output_tokens,
+                "error_rate": args.error_rate,
+                "jitter": args.jitter,
+            },
+        },
+        **metrics,
+    }
@@ -0,0 +1,119 @@
+"""
+Cancellation Module
+End-to-end request deadlines and client-disconnect cancellation for the chat path
+"""
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Dict, Mapping, Optional, TypeVar
+
+from admission import DeadlineExceededError
+from metrics import CHAT_ABORTED
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Clients may ask for a shorter (or, up to the cap, longer) budget in seconds
+DEADLINE_HEADER = "x-request-timeout"
+DEFAULT_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "60"))
+MAX_DEADLINE_SECONDS = float(os.getenv("REQUEST_MAX_DEADLINE_SECONDS", "120"))
+
+class ClientDisconnected(Exception):
+    """Raised when the client went away before its response was ready"""
+
+_counts: Dict[str, int] = {"cancelled": 0, "deadline_exceeded": 0}
+
+def record_abort(reason: str, stage: str) -> None:
+    """Count a request abandoned for reason ("cancelled" or "deadline_exceeded") in stage"""
+    _counts[reason] += 1
+    CHAT_ABORTED.inc(1, reason, stage)
+
+def stats() -> Dict[str, int]:
+    return dict(_counts)
+
+def request_deadline(headers: Mapping[str, str]) -> float:
+    """
+    The time.monotonic() deadline for a request: X-Request-Timeout seconds
+    from now if the client sent a valid one, else REQUEST_DEADLINE_SECONDS,
+    never more than REQUEST_MAX_DEADLINE_SECONDS.
+    """
+    budget = DEFAULT_DEADLINE_SECONDS
+    value = headers.get(DEADLINE_HEADER)
+    if value:
+        try:
+            requested = float(value)
+            if requested > 0:
+                budget = requested
+        except ValueError:
+            pass
+    return time.monotonic() + min(budget, MAX_DEADLINE_SECONDS)
+
+def remaining(deadline: Optional[float]) -> Optional[float]:
+    """Seconds left before deadline, or None without one"""
+    return None if deadline is None else deadline - time.monotonic()
+
+@asynccontextmanager
+async def deadline_scope(deadline: Optional[float], stage: str) -> AsyncIterator[None]:
+    """
+    Run the block with whatever time is left before deadline.
+
+    Raises:
+        DeadlineExceededError: If the deadline has passed on entry or passes
+            inside the block, which is then cancelled
+    """
+    left = remaining(deadline)
+    if left is None:
+        yield
+        return
+    if left <= 0:
+        record_abort("deadline_exceeded", stage)
+        raise DeadlineExceededError(f"Request deadline exceeded before {stage}")
+    try:
+        async with asyncio.timeout(left):
+            yield
+    except TimeoutError:
+        record_abort("deadline_exceeded", stage)
+        raise DeadlineExceededError(f"Request deadline exceeded during {stage}") from None
+
+async def _wait_for_disconnect(receive) -> None:
+    # The request body has already been read, so the next message the
+    # server delivers is the disconnect
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return
+
+async def cancel_on_disconnect(request, work: Awaitable[T], stage: str = "chat") -> T:
+    """
+    Await work, cancelling it if the client disconnects first.
+
+    Cancellation reaches whatever work is awaiting: an admission queue
+    slot is released, a single-flight call is only abandoned if nobody else
+    is waiting on it, and an upstream HTTP request is closed.
+
+    Raises:
+        ClientDisconnected: If the client went away before work finished
+    """
+    task = asyncio.ensure_future(work)
+    watcher = asyncio.ensure_future(_wait_for_disconnect(request.receive))
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        watcher.cancel()
+        raise
+    watcher.cancel()
+    if task.done():
+        return task.result()
+
+    task.cancel()
+    try:
+        await task
+    except (asyncio.CancelledError, Exception):
+        pass
+    record_abort("cancelled", stage)
+    logger.info("Client disconnected, cancelled in-flight %s work", stage)
+    raise ClientDisconnected("Client closed request")
@@ -0,0 +1,231 @@
+"""
+Conversation Store Module
+Keeps recent conversation turns and builds token-budgeted history for the LLM
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from database import Database, get_database
+from llm_gateway import summarize_conversation_async
+
+logger = logging.getLogger(__name__)
+
+# Rough per-message overhead added by the chat template (role markers etc.)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+Summarizer = Callable[[str, List[dict]], Awaitable[str]]
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) used for budgeting"""
+    return len(text) // 4 + MESSAGE_OVERHEAD_TOKENS
+
+@dataclass
+class Turn:
+    role: str
+    content: str
+    tokens: int
+
+@dataclass
+class Conversation:
+    turns: Deque[Turn]
+    summary: str = ""
+    last_access: float = field(default_factory=time.monotonic)
+    summarizing: bool = False
+
+class ConversationStore:
+    """
+    In-memory LRU of conversations with TTL eviction.
+
+    Each conversation keeps at most max_turns turns. build_history() walks the
+    turns newest to oldest and stops once token_budget is spent, so the prompt
+    size stays flat however long the conversation runs. With a summarizer,
+    turns that no longer fit are folded into a rolling summary in the
+    background after the reply has been sent. With a database, turns are
+    also written to conversation_messages and reloaded on a cache miss.
+    
+    In shared mode (several workers or replicas behind one database) the
+    database is the source of truth: history is reloaded on every request and
+    turns are written before append() returns, so the next message sees them
+    whichever worker it lands on. Rolling summaries are per-process and are
+    disabled in shared mode.
+    """
+
+    def __init__(
+        self,
+        max_conversations: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        max_turns: Optional[int] = None,
+        token_budget: Optional[int] = None,
+        summarizer: Optional[Summarizer] = None,
+        database: Optional[Database] = None,
+        shared: bool = False,
+    ):
+        self.max_conversations = max_conversations or int(os.getenv("CONVERSATION_MAX_CONVERSATIONS", "10000"))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("CONVERSATION_TTL_SECONDS", "3600"))
+        self.max_turns = max_turns or int(os.getenv("CONVERSATION_MAX_TURNS", "50"))
+        self.token_budget = token_budget or int(os.getenv("CONVERSATION_TOKEN_BUDGET", "2000"))
+        self.database = database
+        self.shared = shared and database is not None
+        if self.shared and summarizer is not None:
+            logger.warning("Conversation summarization is not supported in shared mode, disabling it")
+            summarizer = None
+        self.summarizer = summarizer
+        self._conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._tasks: Set[asyncio.Task] = set()
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(owner: str, conversation_id: str) -> str:
+        """Scope a conversation to its owner so ids cannot be used to read others' history"""
+        return f"{owner}:{conversation_id}"
+
+    def _evict(self) -> None:
+        """Drop expired conversations from the cold end, then enforce the size limit"""
+        now = time.monotonic()
+        while self._conversations:
+            key, conversation = next(iter(self._conversations.items()))
+            if now - conversation.last_access <= self.ttl_seconds and len(self._conversations) <= self.max_conversations:
+                break
+            del self._conversations[key]
+            self.evictions += 1
+
+    async def _get(self, key: str, reload: bool = False) -> Conversation:
+        conversation = self._conversations.get(key)
+        now = time.monotonic()
+        if conversation is not None and (reload or now - conversation.last_access > self.ttl_seconds):
+            del self._conversations[key]
+            if not reload:
+                self.evictions += 1
+            conversation = None
+
+        if conversation is None:
+            conversation = Conversation(turns=deque(maxlen=self.max_turns))
+            if self.database is not None and self.database.is_connected:
+                try:
+                    for row in await self.database.fetch_messages(key, self.max_turns):
+                        conversation.turns.append(Turn(row["role"], row["content"], estimate_tokens(row["content"])))
+                except Exception as e:
+                    logger.warning("Failed to load conversation history: %s", e)
+            self._conversations[key] = conversation
+
+        conversation.last_access = now
+        self._conversations.move_to_end(key)
+        self._evict()
+        return conversation
+
+    async def build_history(self, key: str, token_budget: Optional[int] = None) -> List[dict]:
+        """
+        Build the prior-turn messages that fit in the token budget.
+
+        Returns:
+            Chat messages, oldest first, optionally led by a summary message
+        """
+        budget = token_budget or self.token_budget
+        conversation = await self._get(key, reload=self.shared)
+
+        history: List[dict] = []
+        summary_message = None
+        if conversation.summary:
+            summary = SUMMARY_PREFIX + conversation.summary
+            if estimate_tokens(summary) <= budget:
+                budget -= estimate_tokens(summary)
+                summary_message = {"role": "system", "content": summary}
+
+        for turn in reversed(conversation.turns):
+            if turn.tokens > budget:
+                break
+            budget -= turn.tokens
+            history.append({"role": turn.role, "content": turn.content})
+        history.reverse()
+
+        if summary_message is not None:
+            history.insert(0, summary_message)
+        return history
+
+    async def append(self, key: str, user_message: str, assistant_message: str) -> None:
+        """Record a completed exchange and schedule any background persistence or summarization"""
+        conversation = await self._get(key)
+        new_turns = [
+            Turn("user", user_message, estimate_tokens(user_message)),
+            Turn("assistant", assistant_message, estimate_tokens(assistant_message)),
+        ]
+        conversation.turns.extend(new_turns)
+
+        if self.database is not None and self.database.is_connected:
+            rows = [(t.role, t.content) for t in new_turns]
+            if self.shared:
+                try:
+                    await self.database.save_messages(key, rows)
+                except Exception as e:
+                    logger.warning("Failed to save conversation turns: %s", e)
+            else:
+                self._spawn(self.database.save_messages(key, rows))
+
+        if self.summarizer is not None and not conversation.summarizing:
+            if sum(t.tokens for t in conversation.turns) > self.token_budget:
+                conversation.summarizing = True
+                self._spawn(self._summarize(conversation))
+
+    async def _summarize(self, conversation: Conversation) -> None:
+        """Fold the oldest half of the turns into the rolling summary"""
+        try:
+            count = max(2, len(conversation.turns) // 2)
+            folded = [conversation.turns[i] for i in range(min(count, len(conversation.turns)))]
+            summary = await self.summarizer(
+                conversation.summary,
+                [{"role": t.role, "content": t.content} for t in folded],
+            )
+            # Only drop the folded turns if nothing evicted them meanwhile
+            for turn in folded:
+                if conversation.turns and conversation.turns[0] is turn:
+                    conversation.turns.popleft()
+            conversation.summary = summary
+        except Exception as e:
+            logger.warning("Conversation summarization failed: %s", e)
+        finally:
+            conversation.summarizing = False
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def drain(self) -> None:
+        """Wait for pending background persistence and summarization"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "shared": self.shared,
+            "conversations": len(self._conversations),
+            "capacity": self.max_conversations,
+            "evictions": self.evictions,
+        }
+
+_conversation_store: Optional[ConversationStore] = None
+
+def get_conversation_store() -> ConversationStore:
+    """Get or create the shared ConversationStore instance."""
+    global _conversation_store
+    if _conversation_store is None:
+        database = get_database() if os.getenv("CONVERSATION_STORE_BACKEND", "memory").lower() == "postgres" else None
+        summarizer = None
+        if os.getenv("CONVERSATION_SUMMARIZE", "false").lower() == "true":
+            api_key = os.getenv("BASETEN_API_KEY", "")
+
+            async def summarizer(summary: str, turns: List[dict]) -> str:
+                return await summarize_conversation_async(summary, turns, api_key)
+
+        # Several workers share history through the database rather than memory
+        default_shared = "true" if int(os.getenv("WEB_CONCURRENCY", "1")) > 1 else "false"
+        shared = os.getenv("CONVERSATION_STORE_SHARED", default_shared).lower() == "true"
+        _conversation_store = ConversationStore(summarizer=summarizer, database=database, shared=shared)
+    return _conversation_store
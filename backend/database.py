@@ -0,0 +1,339 @@
+"""
+Database Module
+Handles pooled, asynchronous access to the Postgres database
+"""
+import asyncpg
+import os
+import logging
+import asyncio
+from typing import Awaitable, Callable, List, Optional
+
+from metrics import DB_WRITE_SECONDS, timed
+
+logger = logging.getLogger(__name__)
+
+# Queries are module constants so asyncpg's per-connection statement cache
+# prepares each one once and reuses it for every later call on that connection
+INSERT_INPUT_SQL = """
+    INSERT INTO input_table (input, conversation_id)
+    VALUES ($1, $2)
+    RETURNING id, created_at
+"""
+
+SELECT_INPUTS_SQL = """
+    SELECT id, input_uuid, input, conversation_id, created_at, processed
+    FROM input_table
+    ORDER BY created_at DESC
+    LIMIT $1
+"""
+
+SELECT_CONVERSATION_INPUTS_SQL = """
+    SELECT id, input_uuid, input, conversation_id, created_at, processed
+    FROM input_table
+    WHERE conversation_id = $1
+    ORDER BY created_at DESC
+    LIMIT $2
+"""
+
+INSERT_MESSAGES_SQL = """
+    INSERT INTO conversation_messages (conversation_key, role, content)
+    SELECT $1, role, content
+    FROM unnest($2::text[], $3::text[]) AS m(role, content)
+"""
+
+SELECT_MESSAGES_SQL = """
+    SELECT role, content
+    FROM (
+        SELECT id, role, content
+        FROM conversation_messages
+        WHERE conversation_key = $1
+        ORDER BY id DESC
+        LIMIT $2
+    ) recent
+    ORDER BY id
+"""
+
+SELECT_IDEMPOTENCY_KEY_SQL = """
+    SELECT fingerprint, response
+    FROM idempotency_keys
+    WHERE idempotency_key = $1 AND expires_at > now()
+"""
+
+UPSERT_IDEMPOTENCY_KEY_SQL = """
+    INSERT INTO idempotency_keys (idempotency_key, fingerprint, response, expires_at)
+    VALUES ($1, $2, $3::jsonb, now() + make_interval(secs => $4))
+    ON CONFLICT (idempotency_key) DO UPDATE
+    SET fingerprint = EXCLUDED.fingerprint, response = EXCLUDED.response, expires_at = EXCLUDED.expires_at
+"""
+
+DELETE_IDEMPOTENCY_KEY_SQL = "DELETE FROM idempotency_keys WHERE idempotency_key = $1"
+
+PURGE_IDEMPOTENCY_KEYS_SQL = "DELETE FROM idempotency_keys WHERE expires_at <= now()"
+
+# Columns written by the batched input log, in record order
+INPUT_COPY_COLUMNS = ["input_uuid", "input", "conversation_id", "created_at"]
+
+# Batches are COPYed into a transaction-local staging table and merged from
+# there, skipping inputs already stored, so a batch whose first write may
+# have committed can be written again without duplicating rows
+CREATE_INPUT_STAGING_SQL = """
+    CREATE TEMP TABLE input_staging (
+        input_uuid UUID,
+        input TEXT,
+        conversation_id VARCHAR(255),
+        created_at TIMESTAMP WITH TIME ZONE
+    ) ON COMMIT DROP
+"""
+
+MERGE_STAGED_INPUTS_SQL = """
+    INSERT INTO input_table (input_uuid, input, conversation_id, created_at)
+    SELECT input_uuid, input, conversation_id, created_at
+    FROM input_staging
+    ON CONFLICT (input_uuid, created_at) DO NOTHING
+"""
+
+# Errors that mean the pooled connection itself is dead; the query is retried
+# once on a fresh connection if it is idempotent or was never sent
+CONNECTION_ERRORS = (
+    asyncpg.ConnectionDoesNotExistError,
+    asyncpg.InterfaceError,
+    ConnectionError,
+    OSError,
+)
+
+class DatabaseUnavailable(RuntimeError):
+    """Raised when a query was not sent because no database connection could be had"""
+
+class Database:
+    """
+    Asyncpg connection pool with non-blocking connect retries.
+
+    Connections are opened once at startup and shared by every request, so
+    the chat path never pays a socket handshake or auth round-trip. If the
+    database is down at startup, the pool keeps being retried in the
+    background with capped backoff until it comes up. Idle connections are
+    recycled by the pool. A read that fails because its connection was
+    dropped is retried once on a fresh connection; a write is retried only
+    if it never reached the server, since it may otherwise have been applied.
+    """
+
+    def __init__(
+        self,
+        host: Optional[str] = None,
+        database: Optional[str] = None,
+        user: Optional[str] = None,
+        password: Optional[str] = None,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+    ):
+        self.host = host or os.getenv("DATABASE_HOST", "/var/run/postgresql")
+        self.database = database or os.getenv("DATABASE_NAME", "notatherapist_db")
+        self.user = user or os.getenv("DATABASE_USER", "notatherapist")
+        self.password = password or os.getenv("POSTGRES_PASSWORD", "secure_password_here")
+        self.min_size = min_size if min_size is not None else int(os.getenv("DB_POOL_MIN_SIZE", "1"))
+        self.max_size = max_size if max_size is not None else int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+        self.max_retries = int(os.getenv("DB_CONNECT_RETRIES", "5"))
+        self.retry_delay = float(os.getenv("DB_RETRY_DELAY", "0.5"))
+        self.max_retry_delay = float(os.getenv("DB_MAX_RETRY_DELAY", "30"))
+        self.max_idle_seconds = float(os.getenv("DB_MAX_IDLE_SECONDS", "300"))
+        self.command_timeout = float(os.getenv("DB_COMMAND_TIMEOUT", "5"))
+        self._pool: Optional[asyncpg.Pool] = None
+        self._connect_task: Optional[asyncio.Task] = None
+
+    @property
+    def is_connected(self) -> bool:
+        return self._pool is not None
+
+    async def connect(self, forever: bool = False) -> bool:
+        """
+        Create the connection pool, retrying with exponential backoff capped
+        at DB_MAX_RETRY_DELAY.
+
+        Args:
+            forever: Keep retrying until the pool is ready instead of giving
+                up after DB_CONNECT_RETRIES attempts
+
+        Returns:
+            True if the pool is ready, False if every attempt failed
+        """
+        if self._pool is not None:
+            return True
+
+        delay = self.retry_delay
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                self._pool = await asyncpg.create_pool(
+                    host=self.host,
+                    database=self.database,
+                    user=self.user,
+                    password=self.password,
+                    min_size=self.min_size,
+                    max_size=self.max_size,
+                    max_inactive_connection_lifetime=self.max_idle_seconds,
+                    command_timeout=self.command_timeout,
+                )
+                logger.info("Database pool ready (min=%s, max=%s)", self.min_size, self.max_size, extra={"sample_rate": 1.0})
+                return True
+            except (asyncpg.PostgresError, OSError, asyncio.TimeoutError) as e:
+                if not forever and attempt >= self.max_retries:
+                    logger.error("Failed to connect to database after %s attempts: %s", attempt, e)
+                    return False
+                logger.warning("Database connection attempt %s failed, retrying in %.1f seconds: %s", attempt, delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+
+    def start(self) -> None:
+        """Connect in the background, retrying until it succeeds, so application startup is not blocked"""
+        if self._pool is None and self._connect_task is None:
+            self._connect_task = asyncio.create_task(self.connect(forever=True))
+
+    async def connect_single(self) -> asyncpg.Connection:
+        """Open a dedicated connection outside the pool, for long-lived maintenance sessions"""
+        return await asyncpg.connect(
+            host=self.host,
+            database=self.database,
+            user=self.user,
+            password=self.password,
+        )
+
+    async def close(self) -> None:
+        """Cancel any pending connect and close the pool"""
+        if self._connect_task is not None and not self._connect_task.done():
+            self._connect_task.cancel()
+        self._connect_task = None
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    async def _run(self, method: str, query: str, *args, idempotent: bool = False, **kwargs):
+        """Run a single connection method, such as fetch or execute, through _with_connection"""
+        return await self._with_connection(lambda conn: getattr(conn, method)(query, *args, **kwargs), idempotent)
+
+    async def _with_connection(self, operation: Callable[[asyncpg.Connection], Awaitable], idempotent: bool = False):
+        """
+        Run operation on a pooled connection. If the connection turns out to
+        be dead, retry once on a fresh one when the operation is idempotent,
+        or when it failed before anything was sent.
+
+        Raises:
+            DatabaseUnavailable: If nothing was sent, because the pool is not
+                connected or no live connection could be opened
+        """
+        if self._pool is None:
+            raise DatabaseUnavailable("Database pool is not connected")
+
+        for attempt in range(2):
+            sent = False
+            try:
+                async with self._pool.acquire() as conn:
+                    if conn.is_closed():
+                        raise asyncpg.InterfaceError("connection is closed")
+                    sent = True
+                    return await operation(conn)
+            except CONNECTION_ERRORS as e:
+                if not sent and attempt == 1:
+                    raise DatabaseUnavailable(f"No database connection: {e}") from e
+                if attempt == 1 or (sent and not idempotent):
+                    raise
+                logger.warning("Database connection lost, retrying on a fresh connection")
+
+    async def save_input(self, input_text: str, conversation_id: Optional[str] = None) -> Optional[dict]:
+        """
+        Save user input to the database.
+
+        Returns:
+            Dict with the new row's id and created_at, or None if the save failed
+        """
+        try:
+            with timed(DB_WRITE_SECONDS, "save_input"):
+                row = await self._run("fetchrow", INSERT_INPUT_SQL, input_text, conversation_id)
+            logger.info("Saved input to database with ID: %s", row['id'])
+            return dict(row)
+        except Exception as e:
+            logger.error("Failed to save input to database: %s", e)
+            # Don't fail the request if database save fails
+            return None
+
+    async def copy_inputs(self, records: List[tuple]) -> None:
+        """
+        Bulk-load input rows with COPY, skipping any already stored, so the
+        same batch can safely be written again after an uncertain failure.
+
+        Args:
+            records: Tuples of (input_uuid, input, conversation_id, created_at)
+        """
+        async def copy(conn: asyncpg.Connection) -> None:
+            async with conn.transaction():
+                await conn.execute(CREATE_INPUT_STAGING_SQL)
+                await conn.copy_records_to_table("input_staging", records=records, columns=INPUT_COPY_COLUMNS)
+                await conn.execute(MERGE_STAGED_INPUTS_SQL)
+
+        with timed(DB_WRITE_SECONDS, "copy_inputs", span_name="db.copy_inputs"):
+            await self._with_connection(copy, idempotent=True)
+
+    async def fetch_inputs(self, limit: int = 10, conversation_id: Optional[str] = None) -> List[dict]:
+        """Retrieve recent inputs, optionally restricted to one conversation"""
+        if conversation_id:
+            rows = await self._run("fetch", SELECT_CONVERSATION_INPUTS_SQL, conversation_id, limit, idempotent=True)
+        else:
+            rows = await self._run("fetch", SELECT_INPUTS_SQL, limit, idempotent=True)
+        return [dict(row) for row in rows]
+
+    async def save_messages(self, conversation_key: str, messages: List[tuple]) -> None:
+        """
+        Append conversation turns in a single round-trip.
+
+        Args:
+            conversation_key: Owner-scoped conversation key
+            messages: Tuples of (role, content), oldest first
+        """
+        try:
+            with timed(DB_WRITE_SECONDS, "save_messages", span_name="db.save_messages"):
+                await self._run(
+                    "execute", INSERT_MESSAGES_SQL, conversation_key,
+                    [role for role, _ in messages], [content for _, content in messages]
+                )
+        except Exception as e:
+            logger.error("Failed to save conversation messages: %s", e)
+
+    async def fetch_messages(self, conversation_key: str, limit: int) -> List[dict]:
+        """Retrieve the most recent turns of a conversation, oldest first"""
+        rows = await self._run("fetch", SELECT_MESSAGES_SQL, conversation_key, limit, idempotent=True)
+        return [dict(row) for row in rows]
+
+    async def fetch_idempotency_key(self, key: str) -> Optional[dict]:
+        """The unexpired fingerprint and response JSON stored under an idempotency key"""
+        row = await self._run("fetchrow", SELECT_IDEMPOTENCY_KEY_SQL, key, idempotent=True)
+        return dict(row) if row is not None else None
+
+    async def save_idempotency_key(self, key: str, fingerprint: str, response: str, ttl: float) -> None:
+        """Store (or replace) the response JSON for an idempotency key for ttl seconds"""
+        with timed(DB_WRITE_SECONDS, "save_idempotency_key"):
+            await self._run("execute", UPSERT_IDEMPOTENCY_KEY_SQL, key, fingerprint, response, float(ttl), idempotent=True)
+
+    async def delete_idempotency_key(self, key: str) -> None:
+        await self._run("execute", DELETE_IDEMPOTENCY_KEY_SQL, key, idempotent=True)
+
+    async def purge_idempotency_keys(self) -> int:
+        """Delete expired idempotency keys; returns how many were removed"""
+        status = await self._run("execute", PURGE_IDEMPOTENCY_KEYS_SQL, idempotent=True)
+        return int(status.split()[-1])
+
+    async def ping(self) -> bool:
+        """Check that a pooled connection can run a trivial query"""
+        try:
+            return await self._run("fetchval", "SELECT 1", idempotent=True) == 1
+        except Exception as e:
+            logger.warning("Database ping failed: %s", e)
+            return False
+
+_database: Optional[Database] = None
+
+def get_database() -> Database:
+    """Get or create the shared Database instance."""
+    global _database
+    if _database is None:
+        _database = Database()
+    return _database
@@ -0,0 +1,41 @@
+"""
+Gunicorn configuration for multi-worker deployments of the FastAPI backend.
+
+Run with: gunicorn -c gunicorn.conf.py "app:create_app()"
+
+Each worker imports the app itself (no preload), so database pools, upstream
+clients and background tasks are created after the fork inside the worker's
+own event loop. Workers share session state through SECRET_KEY and the
+session store, and conversation history through Postgres.
+"""
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5004')}"
+# One worker unless WEB_CONCURRENCY asks for more: several workers need
+# SECRET_KEY and shared stores, which a plain deploy does not have
+workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Never build the app in the master: anything created there would be shared
+# by every forked worker
+preload_app = False
+
+# Long-running streams need time to finish; on SIGTERM workers stop accepting,
+# complete in-flight requests for up to graceful_timeout, then run the
+# lifespan shutdown that flushes queued writes
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "120"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "120"))
+
+# Recycle workers occasionally to bound memory growth; jitter avoids
+# restarting them all at once
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "0"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", "0"))
+
+def on_starting(server):
+    # The app reads WEB_CONCURRENCY to decide whether state must be shared
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    # Metrics restart from zero with the server rather than adding up
+    # snapshots left behind by a previous run
+    from metrics import Registry
+    Registry.clear_directory(os.getenv("METRICS_DIR"))
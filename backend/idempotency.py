@@ -0,0 +1,208 @@
+"""
+Idempotency Module
+Idempotency-Key handling for /chat: replay completed responses and attach retries to in-flight ones
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from database import Database, get_database
+from session_store import MemorySessionStore, SessionStore
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "idempotency-key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+class IdempotencyConflict(Exception):
+    """Raised when an idempotency key is reused for a different request"""
+
+def fingerprint(request: Any) -> str:
+    """Stable hash of a JSON-serializable request body"""
+    return hashlib.sha256(json.dumps(request, sort_keys=True, default=str).encode()).hexdigest()
+
+class PostgresIdempotencyStore(SessionStore):
+    """
+    Completed responses in the idempotency_keys table, shared by every worker
+    and replica. Expired rows are never returned and are purged periodically.
+    """
+
+    def __init__(self, database: Optional[Database] = None, purge_interval: Optional[float] = None):
+        self.database = database or get_database()
+        self.purge_interval = purge_interval or float(os.getenv("IDEMPOTENCY_PURGE_INTERVAL_SECONDS", "300"))
+        self._task: Optional[asyncio.Task] = None
+        self.purged = 0
+
+    async def get(self, key: str) -> Optional[dict]:
+        row = await self.database.fetch_idempotency_key(key)
+        if row is None:
+            return None
+        return {"fingerprint": row["fingerprint"], "response": json.loads(row["response"])}
+
+    async def set(self, key: str, value: dict, ttl: float) -> None:
+        await self.database.save_idempotency_key(key, value["fingerprint"], json.dumps(value["response"]), ttl)
+
+    async def delete(self, key: str) -> None:
+        await self.database.delete_idempotency_key(key)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.purge_interval)
+            if not self.database.is_connected:
+                continue
+            try:
+                self.purged += await self.database.purge_idempotency_keys()
+            except Exception as e:
+                logger.warning("Purging expired idempotency keys failed: %s", e)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, object]:
+        return {"backend": "postgres", "purged": self.purged}
+
+@dataclass
+class _Pending:
+    fingerprint: str
+    task: "asyncio.Task[Tuple[dict, bool]]"
+
+class IdempotentRequests:
+    """
+    Runs each idempotency key's request at most once per TTL.
+
+    The first request with a key runs in its own task. Retries that arrive
+    while it is running wait for the same task, and later retries get the
+    stored response. The task is shielded from its callers, so a client
+    that disconnects and retries picks up the generation it already started.
+    A request that fails stores nothing, so its retry runs again.
+
+    Completed responses are kept in a bounded in-process LRU, and also in
+    the shared store when one is configured, so a retry that lands on another
+    worker is answered from there. Only in-flight attachment is per-process.
+    """
+
+    def __init__(self, shared: Optional[SessionStore] = None, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl = ttl or float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+        self.local = MemorySessionStore(max_entries=max_entries or int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000")))
+        self.shared = shared
+        self._pending: Dict[str, _Pending] = {}
+        self.executed = 0
+        self.replayed = 0
+        self.attached = 0
+        self.conflicts = 0
+        self.store_errors = 0
+
+    async def run(self, key: str, request_fingerprint: str, compute: Callable[[], Awaitable[dict]]) -> Tuple[dict, bool]:
+        """
+        The response for key, computing it only if no earlier request with
+        the key has completed or is in flight.
+
+        Returns:
+            Tuple of (response, replayed) where replayed is True if the
+            response came from an earlier request
+
+        Raises:
+            IdempotencyConflict: If key was used for a request with a
+                different fingerprint
+        """
+        entry = self._pending.get(key)
+        if entry is None:
+            task = asyncio.create_task(self._execute(key, request_fingerprint, compute))
+            entry = self._pending[key] = _Pending(request_fingerprint, task)
+            task.add_done_callback(lambda done: self._finish(key, done))
+            owner = True
+        elif entry.fingerprint != request_fingerprint:
+            self.conflicts += 1
+            raise IdempotencyConflict("Idempotency-Key was already used for a different request")
+        else:
+            self.attached += 1
+            owner = False
+
+        response, replayed = await asyncio.shield(entry.task)
+        return response, replayed or not owner
+
+    def _finish(self, key: str, task: asyncio.Task) -> None:
+        if self._pending.get(key) is not None and self._pending[key].task is task:
+            del self._pending[key]
+        if not task.cancelled():
+            # Every waiter may have gone away; don't warn about an unretrieved error
+            task.exception()
+
+    async def _lookup(self, key: str) -> Optional[dict]:
+        stored = await self.local.get(key)
+        if stored is None and self.shared is not None:
+            try:
+                stored = await self.shared.get(key)
+            except Exception as e:
+                self.store_errors += 1
+                logger.warning("Idempotency key lookup failed, running the request: %s", e)
+        return stored
+
+    async def _execute(self, key: str, request_fingerprint: str, compute: Callable[[], Awaitable[dict]]) -> Tuple[dict, bool]:
+        stored = await self._lookup(key)
+        if stored is not None:
+            if stored["fingerprint"] != request_fingerprint:
+                self.conflicts += 1
+                raise IdempotencyConflict("Idempotency-Key was already used for a different request")
+            self.replayed += 1
+            return stored["response"], True
+
+        self.executed += 1
+        response = await compute()
+        value = {"fingerprint": request_fingerprint, "response": response}
+        await self.local.set(key, value, self.ttl)
+        if self.shared is not None:
+            try:
+                await self.shared.set(key, value, self.ttl)
+            except Exception as e:
+                self.store_errors += 1
+                logger.warning("Storing idempotency key failed: %s", e)
+        return response, False
+
+    def start(self) -> None:
+        self.local.start()
+        if self.shared is not None:
+            self.shared.start()
+
+    async def stop(self) -> None:
+        await self.local.stop()
+        if self.shared is not None:
+            await self.shared.stop()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "in_flight": len(self._pending),
+            "executed": self.executed,
+            "replayed": self.replayed,
+            "attached": self.attached,
+            "conflicts": self.conflicts,
+            "store_errors": self.store_errors,
+            "local": self.local.stats(),
+            "shared": self.shared.stats() if self.shared is not None else None,
+        }
+
+_idempotent_requests: Optional[IdempotentRequests] = None
+
+def get_idempotent_requests() -> IdempotentRequests:
+    """Get or create the shared IdempotentRequests configured by IDEMPOTENCY_BACKEND."""
+    global _idempotent_requests
+    if _idempotent_requests is None:
+        backend = os.getenv("IDEMPOTENCY_BACKEND", "memory").lower()
+        shared = PostgresIdempotencyStore() if backend == "postgres" else None
+        _idempotent_requests = IdempotentRequests(shared)
+    return _idempotent_requests
@@ -0,0 +1,109 @@
+"""
+Input Analysis Module
+Offline analysis stages (language, sentiment, safety tags) run on stored inputs
+"""
+import logging
+import re
+from typing import Any, Dict, List
+
+from pipeline import Pipeline, PipelineResult
+
+logger = logging.getLogger(__name__)
+
+# Stages registered here run in the background analysis worker, never on the
+# chat path. Register more with @analysis_pipeline.stage(...); each stage's
+# result is stored under its name in input_table.analysis.
+analysis_pipeline = Pipeline("analysis")
+
+_WORD = re.compile(r"[^\W\d_]+(?:'[^\W\d_]+)?")
+
+# Unicode ranges for scripts that identify a language (or family) on their own
+_SCRIPTS = (
+    ("ru", re.compile(r"[Ѐ-ӿ]")),
+    ("ar", re.compile(r"[؀-ۿ]")),
+    ("he", re.compile(r"[֐-׿]")),
+    ("el", re.compile(r"[Ͱ-Ͽ]")),
+    ("hi", re.compile(r"[ऀ-ॿ]")),
+    ("th", re.compile(r"[฀-๿]")),
+    ("ko", re.compile(r"[가-힯]")),
+    ("ja", re.compile(r"[぀-ヿ]")),
+    ("zh", re.compile(r"[一-鿿]")),
+)
+
+# Frequent function words for Latin-script languages
+_STOPWORDS = {
+    "en": {"the", "and", "is", "i", "you", "to", "it", "my", "of", "that", "a", "in", "me", "not", "have", "what", "this"},
+    "es": {"el", "la", "de", "que", "y", "en", "los", "es", "no", "me", "mi", "por", "una", "con", "pero", "lo"},
+    "fr": {"le", "la", "de", "et", "est", "je", "les", "des", "un", "une", "pas", "que", "mon", "ne", "pour", "il"},
+    "de": {"der", "die", "das", "und", "ist", "ich", "nicht", "ein", "eine", "zu", "mit", "mein", "es", "sie", "auch"},
+    "pt": {"o", "a", "de", "que", "e", "do", "da", "em", "um", "uma", "não", "eu", "meu", "com", "para", "se"},
+    "it": {"il", "di", "che", "e", "la", "non", "un", "una", "sono", "per", "mi", "mio", "con", "ma", "è", "io"},
+}
+
+_POSITIVE = {
+    "good", "great", "happy", "glad", "better", "love", "calm", "grateful", "thankful", "hopeful", "excited",
+    "relieved", "proud", "fine", "okay", "nice", "wonderful", "amazing", "joy", "peaceful", "thanks",
+}
+_NEGATIVE = {
+    "bad", "sad", "angry", "anxious", "anxiety", "depressed", "depression", "lonely", "alone", "tired", "stressed",
+    "stress", "worried", "afraid", "scared", "hate", "awful", "terrible", "hopeless", "worthless", "hurt", "cry",
+    "crying", "pain", "panic", "upset", "miserable", "exhausted", "overwhelmed",
+}
+_NEGATORS = {"not", "no", "never", "don't", "can't", "isn't", "wasn't", "didn't", "nothing"}
+
+# Tags that let reviewers find conversations needing attention
+_SAFETY_PATTERNS = {
+    "self_harm": re.compile(
+        r"\b(kill(ing)? myself|suicid\w*|end(ing)? (my|it) (life|all)|self[- ]harm\w*|cut(ting)? myself|"
+        r"want(ed)? to die|don'?t want to (live|be alive)|better off dead)\b", re.IGNORECASE),
+    "violence": re.compile(r"\b(kill (him|her|them|you|someone)|hurt (him|her|them|someone)|shoot\w*|stab\w*)\b", re.IGNORECASE),
+    "abuse": re.compile(r"\b(abus\w+|hits? me|beats? me|assault\w*)\b", re.IGNORECASE),
+    "substance": re.compile(r"\b(overdos\w*|relaps\w*|drunk|high on|pills)\b", re.IGNORECASE),
+}
+
+def _words(text: str) -> List[str]:
+    return [word.lower() for word in _WORD.findall(text)]
+
+@analysis_pipeline.stage("language")
+def detect_language(text: str, deps: Dict[str, Any]) -> str:
+    """Best-guess ISO 639-1 code from script, then function words; "und" when unsure"""
+    letters = sum(1 for char in text if char.isalpha())
+    if not letters:
+        return "und"
+    for code, pattern in _SCRIPTS:
+        if len(pattern.findall(text)) >= letters * 0.3:
+            return code
+    words = _words(text)
+    scores = {code: sum(1 for word in words if word in stopwords) for code, stopwords in _STOPWORDS.items()}
+    best = max(scores, key=scores.get)
+    return best if scores[best] > 0 else "und"
+
+@analysis_pipeline.stage("sentiment")
+def score_sentiment(text: str, deps: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Lexicon sentiment in [-1, 1]; a negator up to two words before a
+    sentiment word flips it ("not happy" counts as negative).
+    """
+    words = _words(text)
+    score = 0
+    hits = 0
+    for index, word in enumerate(words):
+        polarity = 1 if word in _POSITIVE else -1 if word in _NEGATIVE else 0
+        if not polarity:
+            continue
+        if any(previous in _NEGATORS for previous in words[max(0, index - 2):index]):
+            polarity = -polarity
+        score += polarity
+        hits += 1
+    value = round(score / hits, 3) if hits else 0.0
+    label = "positive" if value > 0.2 else "negative" if value < -0.2 else "neutral"
+    return {"score": value, "label": label}
+
+@analysis_pipeline.stage("safety")
+def tag_safety(text: str, deps: Dict[str, Any]) -> List[str]:
+    """Sorted safety tags whose patterns match the text"""
+    return sorted(tag for tag, pattern in _SAFETY_PATTERNS.items() if pattern.search(text))
+
+async def analyze_input(text: str) -> PipelineResult:
+    """Run every analysis stage on one stored input"""
+    return await analysis_pipeline.run(text)
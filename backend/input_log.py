@@ -0,0 +1,189 @@
+"""
+Input Log Module
+Write-behind queue that batches user inputs into the database off the chat path
+"""
+import asyncio
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from database import CONNECTION_ERRORS, Database, DatabaseUnavailable, get_database
+
+logger = logging.getLogger(__name__)
+
+class InputLogWriter:
+    """
+    Bounded asyncio write-behind queue for user inputs.
+
+    The chat handler calls enqueue() and carries on; a background task drains
+    the queue in batches (by size or time window) and bulk-loads each batch
+    with COPY. Every input gets a UUID at enqueue time, or keeps the one the
+    client supplied, so it can be referenced before it is written. When the
+    queue is full the input is dropped and counted rather than blocking.
+
+    While the database is unreachable the batch being flushed is held and
+    retried until the pool is back, and new inputs wait in the queue, so an
+    outage loses inputs only once the queue fills up. A write that lost its
+    connection may already have committed, so this relies on copy_inputs
+    skipping rows that are already stored. A batch the server rejected is
+    retried up to max_retries times before being dropped.
+    """
+
+    def __init__(
+        self,
+        database: Optional[Database] = None,
+        max_queue: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        max_retries: Optional[int] = None,
+    ):
+        self.database = database or get_database()
+        self.max_queue = max_queue or int(os.getenv("INPUT_LOG_MAX_QUEUE", "10000"))
+        self.batch_size = batch_size or int(os.getenv("INPUT_LOG_BATCH_SIZE", "500"))
+        self.flush_interval = flush_interval or float(os.getenv("INPUT_LOG_FLUSH_INTERVAL", "0.5"))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("INPUT_LOG_MAX_RETRIES", "3"))
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.held = 0
+        self.queue_high_water = 0
+        self.last_flush_seconds = 0.0
+
+    def start(self) -> None:
+        """Start the background flusher on the running event loop"""
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Flush whatever is queued and stop the background flusher"""
+        if self._task is None:
+            return
+        self._stopping = True
+        await self._task
+        self._task = None
+
+    def enqueue(self, input_text: str, conversation_id: Optional[str] = None, input_id: Optional[str] = None) -> Tuple[str, bool]:
+        """
+        Queue an input for writing.
+
+        Returns:
+            Tuple of (input_id, accepted). input_id is the UUID the row will be
+            stored under; accepted is False if the writer is not running or the
+            queue was full and the input was dropped.
+        """
+        input_id = str(input_id or uuid.uuid4())
+        if self._queue is None or self._stopping:
+            self.dropped += 1
+            return input_id, False
+
+        try:
+            self._queue.put_nowait((uuid.UUID(input_id), input_text, conversation_id, datetime.now(timezone.utc)))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Input log queue full (%s), dropping input %s", self.max_queue, input_id)
+            return input_id, False
+
+        self.enqueued += 1
+        depth = self._queue.qsize()
+        if depth > self.queue_high_water:
+            self.queue_high_water = depth
+        return input_id, True
+
+    def stats(self) -> dict:
+        """Return queue depth, backpressure and flush counters"""
+        return {
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queue_capacity": self.max_queue,
+            "queue_high_water": self.queue_high_water,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "held": self.held,
+            "last_flush_seconds": round(self.last_flush_seconds, 4),
+        }
+
+    async def _next_batch(self) -> List[tuple]:
+        """Wait for the first item, then collect more until the batch is full or the window closes"""
+        try:
+            first = await asyncio.wait_for(self._queue.get(), timeout=self.flush_interval)
+        except asyncio.TimeoutError:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            # Take what is already queued without waiting
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            remaining = deadline - time.monotonic()
+            if len(batch) >= self.batch_size or remaining <= 0 or self._stopping:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self) -> None:
+        while not self._stopping or not self._queue.empty():
+            batch = await self._next_batch()
+            if batch:
+                await self._flush_with_retry(batch)
+
+    async def _flush_with_retry(self, batch: List[tuple]) -> None:
+        delay = 0.5
+        attempt = 0
+        while True:
+            try:
+                await self._flush(batch)
+                self.held = 0
+                return
+            except (DatabaseUnavailable, *CONNECTION_ERRORS, asyncio.TimeoutError) as e:
+                # The database is unreachable: hold the batch until it comes back
+                if self._stopping:
+                    self.held = 0
+                    self.failed += len(batch)
+                    logger.error("Dropping %s inputs, database unavailable at shutdown: %s", len(batch), e)
+                    return
+                if not self.held:
+                    logger.warning("Database unavailable, holding %s inputs until it is back: %s", len(batch), e)
+                self.held = len(batch)
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries or self._stopping:
+                    self.held = 0
+                    self.failed += len(batch)
+                    logger.error("Dropping %s inputs after failed flush: %s", len(batch), e)
+                    return
+                logger.warning("Input log flush of %s rows failed, retrying in %.1f seconds: %s", len(batch), delay, e)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 10.0)
+
+    async def _flush(self, batch: List[tuple]) -> None:
+        start = time.perf_counter()
+        await self.database.copy_inputs(batch)
+        self.last_flush_seconds = time.perf_counter() - start
+        self.written += len(batch)
+        self.batches += 1
+        logger.info("Flushed %s inputs to database in %.1f ms", len(batch), self.last_flush_seconds * 1000)
+
+_input_log: Optional[InputLogWriter] = None
+
+def get_input_log() -> InputLogWriter:
+    """Get or create the shared InputLogWriter instance."""
+    global _input_log
+    if _input_log is None:
+        _input_log = InputLogWriter()
+    return _input_log
@@ -3,46 +3,65 @@ Input Processor Module
 Handles preprocessing of user messages before sending to LLM
 """
 import logging
-import asyncio
-from typing import Optional
+from typing import Any, Dict, Optional
+
+from admission import DeadlineExceededError
+from cancellation import deadline_scope
+from metrics import PROCESS_INPUT_SECONDS, timed
+from pipeline import Pipeline, PipelineResult
+from prompt_registry import DEFAULT_INPUT_SUFFIX, current_profile
+from sync_runner import get_loop_runner
 
 logger = logging.getLogger(__name__)
 
-async def process_input_async(message: str) -> str:
+JOKE_REQUEST_SUFFIX = DEFAULT_INPUT_SUFFIX
+
+# Stages registered here run on every chat message. Analysis stages
+# (moderation, language detection, validation) that do not depend on each
+# other run concurrently; see pipeline.Pipeline for the execution model.
+input_pipeline = Pipeline("input")
+
+@input_pipeline.stage("joke_request", transforms=True)
+def add_joke_request(message: str, deps: Dict[str, Any]) -> str:
+    """Append the request's prompt profile suffix (by default, ask for a joke in the same language)"""
+    return message + current_profile().input_suffix
+
+async def run_input_pipeline(message: str) -> PipelineResult:
+    """
+    Run the input pipeline and return the processed message together with
+    every stage's result, timing and error (if any).
+    """
+    return await input_pipeline.run(message)
+
+async def process_input_async(message: str, deadline: Optional[float] = None) -> str:
     """
     Process the input message before sending to LLM (async version).
     Adds a request for the AI to include a joke in the same language.
     
     Args:
         message: The original user message
+        deadline: Optional time.monotonic() deadline for the whole request
         
     Returns:
         The processed message with joke request appended
     """
     try:
-        # Simulate async processing if needed (e.g., content moderation API calls)
-        # await asyncio.sleep(0)  # Placeholder for actual async operations
-        
-        # Add joke request to the message
-        processed_message = f"{message}\n\n<<also tell a joke in whatever language the initial prompt was in>>"
-        
-        logger.info(f"Input processed - Added joke request to message")
-        
-        # Future async enhancements can be added here:
-        # - Async content moderation API
-        # - Async language detection service
-        # - Async input validation
-        # - Async rate limiting checks via Redis
-        
-        return processed_message
+        with timed(PROCESS_INPUT_SECONDS, span_name="process_input"):
+            async with deadline_scope(deadline, "process_input"):
+                result = await run_input_pipeline(message)
+        logger.debug("Input processed in %.2fms", result.elapsed * 1000)
+        return result.text
         
+    except DeadlineExceededError:
+        raise
     except Exception as e:
-        logger.error(f"Error processing input: {str(e)}")
+        logger.error("Error processing input: %s", e)
         # If processing fails, return original message
         return message
 
 def process_input(message: str) -> str:
     """
-    Synchronous version for backward compatibility.
+    Synchronous version for backward compatibility, run on the shared
+    background loop.
     """
-    return asyncio.run(process_input_async(message))
\ No newline at end of file
+    return get_loop_runner().run(process_input_async(message))
@@ -5,24 +5,31 @@ Handles communication with Baseten AI service
 from openai import AsyncOpenAI, OpenAI
 import os
 import logging
-import asyncio
-from typing import Optional
+import time
+from typing import AsyncIterator, List, Optional
+from response_cache import get_response_cache, request_key
+from singleflight import get_single_flight
+from admission import PRIORITY_INTERACTIVE, AdmissionRejected, get_admission_controller
+from cancellation import deadline_scope
+from llm_router import LoopLocal, get_router
+from metrics import LLM_REQUEST_SECONDS, LLM_TTFT_SECONDS, span
+from prompt_registry import DEFAULT_SYSTEM_PROMPT, PromptProfile, current_profile
+from sync_runner import get_loop_runner
 
 logger = logging.getLogger(__name__)
 
-# Initialize async Baseten client (lazy initialization)
-_async_client: Optional[AsyncOpenAI] = None
+# Lazily created clients; the async one is per event loop
+_async_clients: LoopLocal[AsyncOpenAI] = LoopLocal()
 _sync_client: Optional[OpenAI] = None
 
+SYSTEM_PROMPT = DEFAULT_SYSTEM_PROMPT
+
 def get_async_client(api_key: str) -> AsyncOpenAI:
-    """Get or create async OpenAI client."""
-    global _async_client
-    if _async_client is None:
-        _async_client = AsyncOpenAI(
-            api_key=api_key,
-            base_url="https://inference.baseten.co/v1"
-        )
-    return _async_client
+    """Get or create the async OpenAI client for the running event loop."""
+    return _async_clients.get(lambda: AsyncOpenAI(
+        api_key=api_key,
+        base_url="https://inference.baseten.co/v1"
+    ))
 
 def get_sync_client(api_key: str) -> OpenAI:
     """Get or create sync OpenAI client for backward compatibility."""
@@ -34,62 +41,239 @@ def get_sync_client(api_key: str) -> OpenAI:
         )
     return _sync_client
 
-async def get_ai_response_async(message: str, api_key: str) -> str:
+SUMMARY_PROMPT = "Summarize the conversation below in a few sentences for your own later reference. Keep names, feelings and facts the user shared; drop small talk."
+
+# Read once at import; per-request settings live on the prompt profile
+SINGLE_FLIGHT_ENABLED = os.getenv("LLM_SINGLE_FLIGHT", "true").lower() == "true"
+SUMMARY_MAX_TOKENS = int(os.getenv("CONVERSATION_SUMMARY_MAX_TOKENS", "200"))
+
+async def _create_completion(api_key: str, params: dict) -> str:
+    """Make one upstream completion call through the backend router and return its text."""
+    return await get_router(api_key).complete(params)
+
+def _stream_completion(api_key: str, params: dict) -> AsyncIterator[str]:
+    """Make one streaming upstream completion call through the backend router."""
+    return get_router(api_key).stream(params)
+
+def _coalescing_enabled(use_cache: bool) -> bool:
+    """Identical requests share one upstream call unless the caller asked for a fresh answer."""
+    return use_cache and SINGLE_FLIGHT_ENABLED
+
+async def get_ai_response_async(
+    message: str,
+    api_key: str,
+    history: Optional[List[dict]] = None,
+    use_cache: bool = True,
+    cache_text: Optional[str] = None,
+    priority: int = PRIORITY_INTERACTIVE,
+    deadline: Optional[float] = None,
+    profile: Optional[PromptProfile] = None
+) -> str:
     """
     Send message to Baseten AI and get response (async version).
     
+    Concurrent identical requests are coalesced into a single upstream call
+    whose result (or error) is shared by every waiter.
+    
     Args:
         message: The processed message to send to AI
         api_key: The Baseten API key
+        history: Optional prior conversation messages, oldest first
+        use_cache: Set to False to bypass the response cache and request
+            coalescing for this request
+        cache_text: Text used for similarity cache matching, typically the
+            user's original message before input processing
+        priority: Admission priority, lower values are sent upstream first
+        deadline: time.monotonic() value after which a queued request is
+            dropped instead of being sent upstream, and an upstream call
+            still waiting for its response is abandoned
+        profile: Prompt profile supplying the system prompt and sampling
+            parameters; defaults to the one selected for this request
         
     Returns:
         The AI-generated response text
         
     Raises:
+        AdmissionRejected: If the upstream queue is full or saturated, or
+            the deadline passed (DeadlineExceededError)
         Exception: If API call fails
     """
+    started = time.perf_counter()
     try:
-        logger.info(f"Sending to AI: {message[:100]}...")
+        profile = profile or current_profile()
+        params = profile.completion_params(message, history)
+        scope = profile.cache_scope
+        cache = get_response_cache() if use_cache else None
+        if cache is not None:
+            cached = cache.get(message, scope, history, cache_text)
+            if cached is not None:
+                logger.debug("Serving AI response from cache")
+                return cached
         
-        client = get_async_client(api_key)
+        coalesce = _coalescing_enabled(use_cache)
+        # A coalesced call serves every waiter, so it is admitted without any
+        # one waiter's deadline; each waiter's own deadline_scope bounds how
+        # long that waiter stays
+        slot_deadline = None if coalesce else deadline
         
-        response = await client.chat.completions.create(
-            model=os.getenv("LLM_MODEL", "openai/gpt-oss-120b"),
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are NotATherapist, a helpful AI assistant. Be friendly, empathetic, and supportive in your responses."
-                },
-                {
-                    "role": "user",
-                    "content": message
-                }
-            ],
-            max_tokens=int(os.getenv("LLM_MAX_TOKENS", "1000")),
-            temperature=float(os.getenv("LLM_TEMPERATURE", "0.7")),
-            top_p=1,
-            presence_penalty=0,
-            frequency_penalty=0,
-            timeout=int(os.getenv("LLM_TIMEOUT", "30"))
-        )
-        
-        response_text = response.choices[0].message.content
+        async def complete() -> str:
+            async with get_admission_controller().slot(priority, slot_deadline):
+                response_text = await _create_completion(api_key, params)
+            if cache is not None and response_text:
+                cache.set(message, scope, response_text, history, cache_text)
+            return response_text
         
-        logger.info(f"Received AI response: {response_text[:100]}...")
+        # Only this waiter gives up at its deadline; a coalesced call keeps
+        # running while other requests still wait on it
+        with span("get_ai_response"):
+            async with deadline_scope(deadline, "llm"):
+                if coalesce:
+                    response_text = await get_single_flight().do(request_key(message, scope, history), complete)
+                else:
+                    response_text = await complete()
         
         return response_text
         
+    except AdmissionRejected as e:
+        logger.warning("AI request rejected: %s", e)
+        raise
+    except Exception as e:
+        logger.error("Error communicating with AI: %s", e)
+        raise Exception(f"Failed to get AI response: {str(e)}")
+    finally:
+        LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, "complete")
+
+async def stream_ai_response_async(
+    message: str,
+    api_key: str,
+    history: Optional[List[dict]] = None,
+    use_cache: bool = True,
+    cache_text: Optional[str] = None,
+    priority: int = PRIORITY_INTERACTIVE,
+    deadline: Optional[float] = None,
+    profile: Optional[PromptProfile] = None
+) -> AsyncIterator[str]:
+    """
+    Send message to Baseten AI and yield the response as it is generated.
+    
+    Concurrent identical requests subscribe to one shared upstream stream;
+    late subscribers replay the deltas produced so far, then follow along.
+    
+    Args:
+        message: The processed message to send to AI
+        api_key: The Baseten API key
+        history: Optional prior conversation messages, oldest first
+        use_cache: Set to False to bypass the response cache and request
+            coalescing for this request
+        cache_text: Text used for similarity cache matching, typically the
+            user's original message before input processing
+        priority: Admission priority, lower values are sent upstream first
+        deadline: time.monotonic() value after which a queued request is
+            dropped instead of being sent upstream, and an upstream call
+            still waiting for its first token is abandoned
+        profile: Prompt profile supplying the system prompt and sampling
+            parameters; defaults to the one selected for this request
+        
+    Yields:
+        Text deltas in the order the model produces them
+        
+    Raises:
+        AdmissionRejected: If the upstream queue is full or the deadline passed
+        Exception: If API call fails before or during the stream
+    """
+    started = time.perf_counter()
+    try:
+        profile = profile or current_profile()
+        params = profile.completion_params(message, history)
+        scope = profile.cache_scope
+        cache = get_response_cache() if use_cache else None
+        if cache is not None:
+            cached = cache.get(message, scope, history, cache_text)
+            if cached is not None:
+                logger.debug("Serving AI response from cache")
+                LLM_TTFT_SECONDS.observe(time.perf_counter() - started)
+                yield cached
+                return
+        
+        coalesce = _coalescing_enabled(use_cache)
+        # As in get_ai_response_async, a shared stream is admitted without
+        # the first subscriber's deadline
+        slot_deadline = None if coalesce else deadline
+        
+        async def stream() -> AsyncIterator[str]:
+            parts = []
+            async with get_admission_controller().slot(priority, slot_deadline) as slot:
+                async for delta in _stream_completion(api_key, params):
+                    slot.first_token()
+                    parts.append(delta)
+                    yield delta
+            if cache is not None and parts:
+                cache.set(message, scope, "".join(parts), history, cache_text)
+        
+        if coalesce:
+            deltas = get_single_flight().stream(request_key(message, scope, history), stream)
+        else:
+            deltas = stream()
+        
+        # The deadline bounds the wait for the first delta; once tokens flow
+        # the client is seeing progress and the stream runs to completion
+        deltas = deltas.__aiter__()
+        try:
+            async with deadline_scope(deadline, "llm"):
+                delta = await deltas.__anext__()
+        except StopAsyncIteration:
+            return
+        LLM_TTFT_SECONDS.observe(time.perf_counter() - started)
+        yield delta
+        async for delta in deltas:
+            yield delta
+        
+    except AdmissionRejected as e:
+        logger.warning("AI request rejected: %s", e)
+        raise
     except Exception as e:
-        logger.error(f"Error communicating with AI: {str(e)}")
+        logger.error("Error streaming from AI: %s", e)
         raise Exception(f"Failed to get AI response: {str(e)}")
+    finally:
+        LLM_REQUEST_SECONDS.observe(time.perf_counter() - started, "stream")
+
+async def summarize_conversation_async(summary: str, turns: List[dict], api_key: str) -> str:
+    """
+    Fold older conversation turns into a short rolling summary.
+    
+    Args:
+        summary: The summary produced so far, possibly empty
+        turns: The turns to fold in, oldest first
+        api_key: The Baseten API key
+        
+    Returns:
+        The updated summary text
+    """
+    transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in turns)
+    if summary:
+        transcript = f"Earlier summary: {summary}\n{transcript}"
+    
+    profile = current_profile()
+    response_text = await get_router(api_key).complete({
+        "model": profile.model,
+        "messages": [
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": transcript}
+        ],
+        "max_tokens": SUMMARY_MAX_TOKENS,
+        "temperature": 0.2,
+        "timeout": profile.timeout
+    })
+    return response_text or summary
 
 def get_ai_response(message: str) -> str:
     """
     Synchronous version for backward compatibility.
-    Uses the API key from environment variable.
+    Uses the API key from environment variable, and the shared background
+    loop so upstream connections are reused across calls.
     """
     api_key = os.getenv("BASETEN_API_KEY")
     if not api_key:
         raise ValueError("BASETEN_API_KEY environment variable is required")
     
-    return asyncio.run(get_ai_response_async(message, api_key))
\ No newline at end of file
+    return get_loop_runner().run(get_ai_response_async(message, api_key))
\ No newline at end of file
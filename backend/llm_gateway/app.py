@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, jsonify, make_response, request
 from flask_cors import CORS
 from openai import OpenAI
 import os
@@ -6,7 +6,21 @@ import logging
 from datetime import datetime
 import psycopg2
 from psycopg2.extras import RealDictCursor
+from psycopg2.pool import ThreadedConnectionPool
+from contextlib import contextmanager
+from input_writer import InputWriter
+from input_query import InvalidCursor, check_admin, decode_cursor, export_rows, fetch_page
+from idempotency import (
+    IDEMPOTENCY_HEADER, MAX_KEY_LENGTH, REPLAYED_HEADER, Idempotency, IdempotencyConflict,
+    PostgresResponseStore, client_key, fingerprint
+)
+from rate_limit import RateLimiter, client_address
+import atexit
+import functools
+import itertools
+import threading
 import time
+import uuid
 
 app = Flask(__name__)
 CORS(app)
@@ -14,107 +28,171 @@ CORS(app)
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Read from the environment in both serving modes, like asgi_app.get_client()
+BASETEN_API_KEY = os.getenv('BASETEN_API_KEY')
+if not BASETEN_API_KEY:
+    raise RuntimeError('BASETEN_API_KEY environment variable is required')
+
 client = OpenAI(
-    api_key="jPodC7PX.km2yvG9icviCMGklMgyrbSyxcVdnr3iY",
-    base_url="https://inference.baseten.co/v1"
+    api_key=BASETEN_API_KEY,
+    base_url=os.getenv('LLM_BASE_URL', 'https://inference.baseten.co/v1')
 )
 
-def get_db_connection():
-    """Create database connection using Unix socket"""
-    max_retries = 5
-    retry_delay = 2
+# Shared connection pool, created on first use and reused by every request
+_db_pool = None
+_db_pool_lock = threading.Lock()
+_db_retry_delay = float(os.getenv('DB_RETRY_DELAY', '0.5'))
+_db_next_attempt = 0.0
+
+def get_db_pool():
+    """
+    Get or create the shared database connection pool using the Unix socket.
     
-    for attempt in range(max_retries):
+    A failed connect is not retried in a sleep loop; instead further attempts
+    fail fast until an exponentially growing backoff window has passed, so a
+    database outage never parks the worker threads.
+    """
+    global _db_pool, _db_retry_delay, _db_next_attempt
+    if _db_pool is not None:
+        return _db_pool
+    
+    with _db_pool_lock:
+        if _db_pool is not None:
+            return _db_pool
+        
+        now = time.monotonic()
+        if now < _db_next_attempt:
+            raise psycopg2.OperationalError(
+                f"Database unavailable, next connection attempt in {_db_next_attempt - now:.1f} seconds"
+            )
+        
         try:
-            conn = psycopg2.connect(
-                host='/var/run/postgresql',  # Unix socket directory
-                database='notatherapist_db',
-                user='notatherapist',
+            _db_pool = ThreadedConnectionPool(
+                minconn=int(os.getenv('DB_POOL_MIN_SIZE', '1')),
+                maxconn=int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+                host=os.getenv('DATABASE_HOST', '/var/run/postgresql'),  # Unix socket directory
+                database=os.getenv('DATABASE_NAME', 'notatherapist_db'),
+                user=os.getenv('DATABASE_USER', 'notatherapist'),
                 password=os.getenv('POSTGRES_PASSWORD', 'secure_password_here'),
                 cursor_factory=RealDictCursor
             )
-            return conn
+            _db_retry_delay = float(os.getenv('DB_RETRY_DELAY', '0.5'))
+            logger.info("Database connection pool created")
+            return _db_pool
         except psycopg2.OperationalError as e:
-            if attempt < max_retries - 1:
-                logger.warning(f"Database connection attempt {attempt + 1} failed, retrying in {retry_delay} seconds...")
-                time.sleep(retry_delay)
-            else:
-                logger.error(f"Failed to connect to database after {max_retries} attempts: {str(e)}")
-                raise
-
-def save_input_to_db(input_text, conversation_id=None):
-    """Save user input to the database"""
+            _db_next_attempt = now + _db_retry_delay
+            logger.warning(f"Database connection failed, next attempt in {_db_retry_delay:.1f} seconds: {str(e)}")
+            _db_retry_delay = min(_db_retry_delay * 2, 30.0)
+            raise
+
+@contextmanager
+def get_db_connection():
+    """Borrow a healthy pooled connection and return it when done"""
+    pool = get_db_pool()
+    conn = pool.getconn()
+    if conn.closed:
+        # Connection was dropped while idle in the pool, replace it
+        pool.putconn(conn, close=True)
+        conn = pool.getconn()
+    
+    broken = False
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        cur.execute(
-            """
-            INSERT INTO input_table (input, conversation_id) 
-            VALUES (%s, %s)
-            RETURNING id, created_at
-            """,
-            (input_text, conversation_id)
-        )
-        
-        result = cur.fetchone()
-        conn.commit()
-        cur.close()
-        conn.close()
-        
-        logger.info(f"Saved input to database with ID: {result['id']}")
-        return result
-        
-    except Exception as e:
-        logger.error(f"Failed to save input to database: {str(e)}")
-        # Don't fail the request if database save fails
-        return None
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        if not broken and not conn.closed:
+            # End any transaction left open so the next borrower starts clean
+            conn.rollback()
+        pool.putconn(conn, close=broken or bool(conn.closed))
+
+# Write-behind queue: inputs are written in batches off the request path
+input_writer = InputWriter(get_db_connection)
+atexit.register(input_writer.stop)
+
+def save_input_to_db(input_text, conversation_id=None, input_id=None):
+    """
+    Queue user input for a batched background write to the database.
+    
+    Returns:
+        Tuple of (input_id, accepted) where input_id is the UUID the row will
+        be stored under and accepted is False if the queue was full
+    """
+    return input_writer.enqueue(input_text, conversation_id, input_id)
+
+# Responses by Idempotency-Key, so a retried chat does not generate (or log) twice
+idempotency = Idempotency(
+    PostgresResponseStore(get_db_connection) if os.getenv('IDEMPOTENCY_BACKEND', 'memory') == 'postgres' else None
+)
+
+# Request and upstream token limits per client address, checked before /chat runs
+rate_limiter = RateLimiter()
+
+def request_client():
+    return client_address(request.headers.get('X-Forwarded-For'), request.remote_addr)
+
+def rate_limited(view):
+    """Refuse requests over the client's rate limit or token quota with a 429"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        error, headers = rate_limiter.check(request_client())
+        if error is not None:
+            logger.warning(f"Rate limited {request_client()} on {request.path}: {error}")
+            return jsonify({'error': error}), 429, headers
+        response = make_response(view(*args, **kwargs))
+        response.headers.update(headers)
+        return response
+    return wrapper
 
 @app.route('/chat', methods=['POST'])
+@rate_limited
 def chat():
+    """
+    Generate a reply to a message.
+    
+    With an Idempotency-Key header the chat runs at most once per key: a
+    retry gets the first attempt's response (marked Idempotent-Replayed),
+    waiting for it if it is still running. Reusing a key for a different
+    body is a 422.
+    """
     try:
         data = request.json
         message = data.get('message')
         conversation_id = data.get('conversation_id')
+        input_id = data.get('input_id')
         
         if not message:
             return jsonify({'error': 'No message provided'}), 400
         
-        logger.info(f"Received message: {message[:50]}... (conversation: {conversation_id})")
+        if input_id is not None:
+            try:
+                input_id = str(uuid.UUID(str(input_id)))
+            except ValueError:
+                return jsonify({'error': 'input_id must be a UUID'}), 400
         
-        # Save input to database before processing
-        db_result = save_input_to_db(message, conversation_id)
+        idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+        if idempotency_key is not None and not 0 < len(idempotency_key) <= MAX_KEY_LENGTH:
+            return jsonify({'error': f'Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters'}), 400
         
-        response = client.chat.completions.create(
-            model="openai/gpt-oss-120b",
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are NotATherapist, a helpful AI assistant. Be friendly, empathetic, and supportive in your responses."
-                },
-                {
-                    "role": "user",
-                    "content": message
-                }
-            ],
-            max_tokens=1000,
-            temperature=0.7,
-            top_p=1,
-            presence_penalty=0,
-            frequency_penalty=0
-        )
+        logger.info(f"Received message (conversation: {conversation_id}, {len(message)} chars)")
         
-        response_text = response.choices[0].message.content
+        address = request_client()
         
-        logger.info(f"Generated response: {response_text[:50]}...")
+        def respond():
+            return generate_reply(message, conversation_id, input_id, address)
         
-        return jsonify({
-            'response': response_text,
-            'conversation_id': conversation_id or f"conv_{datetime.now().timestamp()}",
-            'input_saved': db_result is not None,
-            'input_id': db_result['id'] if db_result else None
-        })
+        if idempotency_key is None:
+            return jsonify(respond())
         
+        result, replayed = idempotency.run(client_key(address, idempotency_key), fingerprint(data), respond)
+        response = jsonify(result)
+        if replayed:
+            response.headers[REPLAYED_HEADER] = 'true'
+        return response
+        
+    except IdempotencyConflict as e:
+        return jsonify({'error': str(e)}), 422
     except Exception as e:
         logger.error(f"Error processing chat request: {str(e)}")
         return jsonify({
@@ -122,6 +200,41 @@ def chat():
             'details': str(e)
         }), 500
 
+def generate_reply(message, conversation_id=None, input_id=None, address=None):
+    """Log the input and generate the /chat response body, charging its upstream tokens to address"""
+    # Queue input for the database; the write happens after we return
+    input_id, input_saved = save_input_to_db(message, conversation_id, input_id)
+    
+    response = client.chat.completions.create(
+        model="openai/gpt-oss-120b",
+        messages=[
+            {
+                "role": "system",
+                "content": "You are NotATherapist, a helpful AI assistant. Be friendly, empathetic, and supportive in your responses."
+            },
+            {
+                "role": "user",
+                "content": message
+            }
+        ],
+        max_tokens=1000,
+        temperature=0.7,
+        top_p=1,
+        presence_penalty=0,
+        frequency_penalty=0
+    )
+    
+    response_text = response.choices[0].message.content
+    if address is not None and response.usage is not None:
+        rate_limiter.charge(address, response.usage.total_tokens)
+    
+    return {
+        'response': response_text,
+        'conversation_id': conversation_id or f"conv_{datetime.now().timestamp()}",
+        'input_saved': input_saved,
+        'input_id': input_id
+    }
+
 @app.route('/health', methods=['GET'])
 def health():
     """Health check endpoint with database connectivity check"""
@@ -132,67 +245,109 @@ def health():
     }
     
     try:
-        conn = get_db_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT 1")
-        cur.close()
-        conn.close()
+        with get_db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
         health_status['database'] = 'connected'
     except Exception as e:
         health_status['database'] = f'disconnected: {str(e)}'
         health_status['status'] = 'degraded'
     
+    health_status['input_log'] = input_writer.stats()
+    health_status['idempotency'] = idempotency.stats()
+    health_status['rate_limit'] = rate_limiter.stats()
+    
     return jsonify(health_status), 200 if health_status['status'] == 'healthy' else 503
 
+def _parse_time_arg(name):
+    value = request.args.get(name)
+    return datetime.fromisoformat(value) if value else None
+
+def require_admin(view):
+    """Reject requests to view without the inputs admin token"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        denied = check_admin(request.headers.get('Authorization'))
+        if denied is not None:
+            error, status = denied
+            return jsonify({'error': error}), status, {'WWW-Authenticate': 'Bearer'}
+        return view(*args, **kwargs)
+    return wrapper
+
 @app.route('/inputs', methods=['GET'])
+@require_admin
 def get_inputs():
-    """Retrieve recent inputs from the database"""
+    """
+    Retrieve inputs newest first, one page at a time.
+    
+    Pass the returned next_cursor as ?cursor= to get the following page;
+    it is null on the last page.
+    """
     try:
-        limit = request.args.get('limit', 10, type=int)
+        limit = min(max(request.args.get('limit', 10, type=int), 1), int(os.getenv('INPUTS_MAX_LIMIT', '1000')))
         conversation_id = request.args.get('conversation_id')
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
         
-        conn = get_db_connection()
-        cur = conn.cursor()
-        
-        if conversation_id:
-            cur.execute(
-                """
-                SELECT id, input, conversation_id, created_at, processed
-                FROM input_table 
-                WHERE conversation_id = %s
-                ORDER BY created_at DESC 
-                LIMIT %s
-                """,
-                (conversation_id, limit)
-            )
-        else:
-            cur.execute(
-                """
-                SELECT id, input, conversation_id, created_at, processed
-                FROM input_table 
-                ORDER BY created_at DESC 
-                LIMIT %s
-                """,
-                (limit,)
-            )
-        
-        results = cur.fetchall()
-        cur.close()
-        conn.close()
-        
-        # Convert datetime objects to strings for JSON serialization
-        for result in results:
-            if result['created_at']:
-                result['created_at'] = result['created_at'].isoformat()
+        with get_db_connection() as conn:
+            results, next_cursor = fetch_page(conn, limit, conversation_id, after)
         
         return jsonify({
             'inputs': results,
-            'count': len(results)
+            'count': len(results),
+            'next_cursor': next_cursor
         })
         
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         logger.error(f"Failed to retrieve inputs: {str(e)}")
         return jsonify({'error': 'Failed to retrieve inputs', 'details': str(e)}), 500
 
+@app.route('/inputs/export', methods=['GET'])
+@require_admin
+def export_inputs():
+    """
+    Stream every matching input as NDJSON (default) or CSV.
+    
+    Optional filters: conversation_id, and since/until ISO 8601 timestamps
+    bounding created_at. Rows are read through a server-side cursor, so
+    memory use does not depend on how many rows are exported.
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'error': "format must be 'ndjson' or 'csv'"}), 400
+    try:
+        since = _parse_time_arg('since')
+        until = _parse_time_arg('until')
+    except ValueError:
+        return jsonify({'error': 'since and until must be ISO 8601 timestamps'}), 400
+    conversation_id = request.args.get('conversation_id')
+    batch_size = int(os.getenv('INPUTS_EXPORT_BATCH_SIZE', '2000'))
+    
+    def generate():
+        with get_db_connection() as conn:
+            yield from export_rows(conn, fmt, batch_size, conversation_id, since, until)
+    
+    stream = generate()
+    try:
+        # Open the connection and cursor now so failures get a proper status
+        first = next(stream)
+    except Exception as e:
+        logger.error(f"Failed to export inputs: {str(e)}")
+        return jsonify({'error': 'Failed to export inputs', 'details': str(e)}), 500
+    
+    if fmt == 'csv':
+        mimetype = 'text/csv'
+        filename = 'inputs.csv'
+    else:
+        mimetype = 'application/x-ndjson'
+        filename = 'inputs.ndjson'
+    return Response(
+        itertools.chain([first], stream),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5004, debug=os.getenv('DEBUG', 'False').lower() == 'true')
\ No newline at end of file
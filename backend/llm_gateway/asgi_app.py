@@ -0,0 +1,376 @@
+"""
+ASGI serving mode for the LLM gateway.
+
+Serves the same /chat, /health, /inputs and /inputs/export contract as the
+Flask app in app.py, but on an event loop: upstream calls go through
+AsyncOpenAI and database access through an asyncpg pool, so a waiting chat
+holds a coroutine instead of a thread and one worker can keep hundreds of
+upstream calls in flight. Run with:
+
+    gunicorn -k uvicorn.workers.UvicornWorker asgi_app:app
+"""
+from contextlib import asynccontextmanager
+from datetime import datetime
+import asyncio
+import functools
+import logging
+import os
+import time
+import uuid
+
+import asyncpg
+import httpx
+from openai import AsyncOpenAI
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from input_query import InvalidCursor, check_admin, decode_cursor, export_rows_async, fetch_page_async
+from input_writer import AsyncInputWriter
+from idempotency import (
+    IDEMPOTENCY_HEADER, MAX_KEY_LENGTH, REPLAYED_HEADER, AsyncIdempotency, AsyncPostgresResponseStore,
+    IdempotencyConflict, client_key, fingerprint
+)
+from rate_limit import RateLimiter, client_address
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SYSTEM_PROMPT = "You are NotATherapist, a helpful AI assistant. Be friendly, empathetic, and supportive in your responses."
+
+# Shared upstream client and connection pool, created in the worker's event loop
+_client = None
+_db_pool = None
+_db_pool_lock = None
+_db_retry_delay = float(os.getenv('DB_RETRY_DELAY', '0.5'))
+_db_next_attempt = 0.0
+
+def get_client():
+    """
+    Get or create the shared AsyncOpenAI client.
+
+    Its connection pool is sized for LLM_MAX_CONNECTIONS concurrent upstream
+    calls, so concurrency is bounded by upstream capacity rather than by
+    threads.
+    """
+    global _client
+    if _client is None:
+        api_key = os.getenv('BASETEN_API_KEY')
+        if not api_key:
+            raise RuntimeError('BASETEN_API_KEY environment variable is required')
+        max_connections = int(os.getenv('LLM_MAX_CONNECTIONS', '500'))
+        _client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=os.getenv('LLM_BASE_URL', 'https://inference.baseten.co/v1'),
+            timeout=float(os.getenv('LLM_TIMEOUT', '120')),
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+            )
+        )
+    return _client
+
+async def get_db_pool():
+    """
+    Get or create the shared asyncpg pool using the Unix socket.
+
+    Like the Flask app's pool, a failed connect is not retried in a loop;
+    further attempts fail fast until an exponentially growing backoff window
+    has passed.
+    """
+    global _db_pool, _db_pool_lock, _db_retry_delay, _db_next_attempt
+    if _db_pool is not None:
+        return _db_pool
+    if _db_pool_lock is None:
+        _db_pool_lock = asyncio.Lock()
+
+    async with _db_pool_lock:
+        if _db_pool is not None:
+            return _db_pool
+
+        now = time.monotonic()
+        if now < _db_next_attempt:
+            raise ConnectionError(
+                f"Database unavailable, next connection attempt in {_db_next_attempt - now:.1f} seconds"
+            )
+
+        try:
+            _db_pool = await asyncpg.create_pool(
+                min_size=int(os.getenv('DB_POOL_MIN_SIZE', '1')),
+                max_size=int(os.getenv('DB_POOL_MAX_SIZE', '10')),
+                host=os.getenv('DATABASE_HOST', '/var/run/postgresql'),  # Unix socket directory
+                database=os.getenv('DATABASE_NAME', 'notatherapist_db'),
+                user=os.getenv('DATABASE_USER', 'notatherapist'),
+                password=os.getenv('POSTGRES_PASSWORD', 'secure_password_here'),
+                command_timeout=float(os.getenv('DB_COMMAND_TIMEOUT', '30'))
+            )
+            _db_retry_delay = float(os.getenv('DB_RETRY_DELAY', '0.5'))
+            logger.info("Database connection pool created")
+            return _db_pool
+        except (OSError, asyncpg.PostgresError) as e:
+            _db_next_attempt = now + _db_retry_delay
+            logger.warning(f"Database connection failed, next attempt in {_db_retry_delay:.1f} seconds: {str(e)}")
+            _db_retry_delay = min(_db_retry_delay * 2, 30.0)
+            raise
+
+# Write-behind queue: inputs are written in batches off the request path
+input_writer = AsyncInputWriter(get_db_pool)
+
+# Responses by Idempotency-Key, so a retried chat does not generate (or log) twice
+idempotency = AsyncIdempotency(
+    AsyncPostgresResponseStore(get_db_pool) if os.getenv('IDEMPOTENCY_BACKEND', 'memory') == 'postgres' else None
+)
+
+# Request and upstream token limits per client address, checked before /chat runs
+rate_limiter = RateLimiter()
+
+def request_client(request):
+    return client_address(request.headers.get('x-forwarded-for'), request.client.host if request.client else None)
+
+def rate_limited(endpoint):
+    """Refuse requests over the client's rate limit or token quota with a 429"""
+    @functools.wraps(endpoint)
+    async def wrapper(request):
+        error, headers = rate_limiter.check(request_client(request))
+        if error is not None:
+            logger.warning(f"Rate limited {request_client(request)} on {request.url.path}: {error}")
+            return JSONResponse({'error': error}, status_code=429, headers=headers)
+        response = await endpoint(request)
+        response.headers.update(headers)
+        return response
+    return wrapper
+
+@rate_limited
+async def chat(request):
+    """Same contract as the Flask app's /chat, including Idempotency-Key and rate limits"""
+    try:
+        data = await request.json()
+        message = data.get('message')
+        conversation_id = data.get('conversation_id')
+        input_id = data.get('input_id')
+
+        if not message:
+            return JSONResponse({'error': 'No message provided'}, status_code=400)
+
+        if input_id is not None:
+            try:
+                input_id = str(uuid.UUID(str(input_id)))
+            except ValueError:
+                return JSONResponse({'error': 'input_id must be a UUID'}, status_code=400)
+
+        idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
+        if idempotency_key is not None and not 0 < len(idempotency_key) <= MAX_KEY_LENGTH:
+            return JSONResponse({'error': f'Idempotency-Key must be 1 to {MAX_KEY_LENGTH} characters'}, status_code=400)
+
+        logger.info(f"Received message (conversation: {conversation_id}, {len(message)} chars)")
+
+        address = request_client(request)
+
+        def respond():
+            return generate_reply(message, conversation_id, input_id, address)
+
+        if idempotency_key is None:
+            return JSONResponse(await respond())
+
+        result, replayed = await idempotency.run(client_key(address, idempotency_key), fingerprint(data), respond)
+        return JSONResponse(result, headers={REPLAYED_HEADER: 'true'} if replayed else None)
+
+    except IdempotencyConflict as e:
+        return JSONResponse({'error': str(e)}, status_code=422)
+    except Exception as e:
+        logger.error(f"Error processing chat request: {str(e)}")
+        return JSONResponse({
+            'error': 'Failed to process request',
+            'details': str(e)
+        }, status_code=500)
+
+async def generate_reply(message, conversation_id=None, input_id=None, address=None):
+    """Log the input and generate the /chat response body, charging its upstream tokens to address"""
+    # Queue input for the database; the write happens after we return
+    input_id, input_saved = input_writer.enqueue(message, conversation_id, input_id)
+
+    response = await get_client().chat.completions.create(
+        model="openai/gpt-oss-120b",
+        messages=[
+            {
+                "role": "system",
+                "content": SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": message
+            }
+        ],
+        max_tokens=1000,
+        temperature=0.7,
+        top_p=1,
+        presence_penalty=0,
+        frequency_penalty=0
+    )
+    if address is not None and response.usage is not None:
+        rate_limiter.charge(address, response.usage.total_tokens)
+
+    return {
+        'response': response.choices[0].message.content,
+        'conversation_id': conversation_id or f"conv_{datetime.now().timestamp()}",
+        'input_saved': input_saved,
+        'input_id': input_id
+    }
+
+async def health(request):
+    """Health check endpoint with database connectivity check"""
+    health_status = {
+        'status': 'healthy',
+        'service': 'llm_gateway',
+        'database': 'unknown'
+    }
+
+    try:
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            await conn.fetchval("SELECT 1")
+        health_status['database'] = 'connected'
+    except Exception as e:
+        health_status['database'] = f'disconnected: {str(e)}'
+        health_status['status'] = 'degraded'
+
+    health_status['input_log'] = input_writer.stats()
+    health_status['idempotency'] = idempotency.stats()
+    health_status['rate_limit'] = rate_limiter.stats()
+
+    return JSONResponse(health_status, status_code=200 if health_status['status'] == 'healthy' else 503)
+
+def _parse_time_arg(request, name):
+    value = request.query_params.get(name)
+    return datetime.fromisoformat(value) if value else None
+
+def _int_arg(request, name, default):
+    # Matches Flask's request.args.get(name, default, type=int)
+    try:
+        return int(request.query_params.get(name, default))
+    except ValueError:
+        return default
+
+def require_admin(endpoint):
+    """Reject requests to endpoint without the inputs admin token"""
+    @functools.wraps(endpoint)
+    async def wrapper(request):
+        denied = check_admin(request.headers.get('authorization'))
+        if denied is not None:
+            error, status = denied
+            return JSONResponse({'error': error}, status_code=status, headers={'WWW-Authenticate': 'Bearer'})
+        return await endpoint(request)
+    return wrapper
+
+@require_admin
+async def get_inputs(request):
+    """
+    Retrieve inputs newest first, one page at a time.
+
+    Pass the returned next_cursor as ?cursor= to get the following page;
+    it is null on the last page.
+    """
+    try:
+        limit = min(max(_int_arg(request, 'limit', 10), 1), int(os.getenv('INPUTS_MAX_LIMIT', '1000')))
+        conversation_id = request.query_params.get('conversation_id')
+        cursor = request.query_params.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            results, next_cursor = await fetch_page_async(conn, limit, conversation_id, after)
+
+        return JSONResponse({
+            'inputs': results,
+            'count': len(results),
+            'next_cursor': next_cursor
+        })
+
+    except InvalidCursor as e:
+        return JSONResponse({'error': str(e)}, status_code=400)
+    except Exception as e:
+        logger.error(f"Failed to retrieve inputs: {str(e)}")
+        return JSONResponse({'error': 'Failed to retrieve inputs', 'details': str(e)}, status_code=500)
+
+@require_admin
+async def export_inputs(request):
+    """
+    Stream every matching input as NDJSON (default) or CSV.
+
+    Optional filters: conversation_id, and since/until ISO 8601 timestamps
+    bounding created_at. Rows are read through a server-side cursor, so
+    memory use does not depend on how many rows are exported.
+    """
+    fmt = request.query_params.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return JSONResponse({'error': "format must be 'ndjson' or 'csv'"}, status_code=400)
+    try:
+        since = _parse_time_arg(request, 'since')
+        until = _parse_time_arg(request, 'until')
+    except ValueError:
+        return JSONResponse({'error': 'since and until must be ISO 8601 timestamps'}, status_code=400)
+    conversation_id = request.query_params.get('conversation_id')
+    batch_size = int(os.getenv('INPUTS_EXPORT_BATCH_SIZE', '2000'))
+
+    async def generate():
+        pool = await get_db_pool()
+        async with pool.acquire() as conn:
+            rows = export_rows_async(conn, fmt, batch_size, conversation_id, since, until)
+            try:
+                async for chunk in rows:
+                    yield chunk
+            finally:
+                # Ends the cursor's transaction before the connection is released
+                await rows.aclose()
+
+    stream = generate()
+    try:
+        # Open the connection and cursor now so failures get a proper status
+        first = await stream.__anext__()
+    except Exception as e:
+        await stream.aclose()
+        logger.error(f"Failed to export inputs: {str(e)}")
+        return JSONResponse({'error': 'Failed to export inputs', 'details': str(e)}, status_code=500)
+
+    async def body():
+        try:
+            yield first
+            async for chunk in stream:
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    if fmt == 'csv':
+        media_type = 'text/csv'
+        filename = 'inputs.csv'
+    else:
+        media_type = 'application/x-ndjson'
+        filename = 'inputs.ndjson'
+    return StreamingResponse(
+        body(),
+        media_type=media_type,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
+
+@asynccontextmanager
+async def lifespan(app):
+    """Create per-worker state in the worker's loop and flush queued inputs on shutdown"""
+    get_client()
+    input_writer.start()
+    yield
+    await input_writer.stop()
+    if _db_pool is not None:
+        await _db_pool.close()
+    await get_client().close()
+
+app = Starlette(
+    routes=[
+        Route('/chat', chat, methods=['POST']),
+        Route('/health', health, methods=['GET']),
+        Route('/inputs', get_inputs, methods=['GET']),
+        Route('/inputs/export', export_inputs, methods=['GET']),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=['*'], allow_methods=['*'], allow_headers=['*'])],
+    lifespan=lifespan
+)
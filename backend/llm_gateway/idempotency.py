@@ -0,0 +1,331 @@
+"""
+Idempotency-Key handling for the gateway's /chat.
+
+A client that retries a POST with the same Idempotency-Key gets the response
+of its first attempt instead of a new generation and a second input_table
+row: from the store if the first attempt completed, or by waiting for it if
+it is still running. Keys are scoped to the client address, so one client
+can neither replay another's response nor probe which keys are in use. Completed responses are kept in a bounded in-memory LRU
+with a TTL, and with IDEMPOTENCY_BACKEND=postgres also in the
+idempotency_keys table, so a retry that reaches another worker or replica is
+answered too. Waiting on an in-flight attempt only works within one worker.
+"""
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+
+SELECT_KEY_SQL = """
+    SELECT fingerprint, response FROM idempotency_keys
+    WHERE idempotency_key = %s AND expires_at > now()
+"""
+UPSERT_KEY_SQL = """
+    INSERT INTO idempotency_keys (idempotency_key, fingerprint, response, expires_at)
+    VALUES (%s, %s, %s::jsonb, now() + make_interval(secs => %s))
+    ON CONFLICT (idempotency_key) DO UPDATE
+    SET fingerprint = EXCLUDED.fingerprint, response = EXCLUDED.response, expires_at = EXCLUDED.expires_at
+"""
+PURGE_KEYS_SQL = "DELETE FROM idempotency_keys WHERE expires_at <= now()"
+
+# The same statements with asyncpg's numbered placeholders
+SELECT_KEY_SQL_ASYNC = SELECT_KEY_SQL.replace('%s', '$1')
+UPSERT_KEY_SQL_ASYNC = """
+    INSERT INTO idempotency_keys (idempotency_key, fingerprint, response, expires_at)
+    VALUES ($1, $2, $3::jsonb, now() + make_interval(secs => $4))
+    ON CONFLICT (idempotency_key) DO UPDATE
+    SET fingerprint = EXCLUDED.fingerprint, response = EXCLUDED.response, expires_at = EXCLUDED.expires_at
+"""
+
+class IdempotencyConflict(Exception):
+    """Raised when an idempotency key is reused for a different request"""
+
+def client_key(client, key):
+    """
+    The key a client's Idempotency-Key is stored under. Hashed, so an
+    address plus the longest allowed key fits idempotency_keys.
+    """
+    return hashlib.sha256(f"{client}\n{key}".encode()).hexdigest()
+
+def fingerprint(data):
+    """Stable hash of a JSON request body"""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+def _ttl():
+    return float(os.getenv('IDEMPOTENCY_TTL_SECONDS', '86400'))
+
+def _purge_interval():
+    return float(os.getenv('IDEMPOTENCY_PURGE_INTERVAL_SECONDS', '300'))
+
+def _stored(row):
+    # psycopg2 decodes jsonb, asyncpg returns the text
+    response = row['response']
+    return {
+        'fingerprint': row['fingerprint'],
+        'response': json.loads(response) if isinstance(response, str) else response,
+    }
+
+class MemoryResponseStore:
+    """Thread-safe LRU of completed responses with per-entry expiry"""
+
+    def __init__(self, max_entries=None, ttl=None):
+        self.max_entries = max_entries or int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', '10000'))
+        self.ttl = ttl or _ttl()
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        return {'entries': len(self._entries), 'capacity': self.max_entries, 'evictions': self.evictions}
+
+class PostgresResponseStore:
+    """Completed responses in idempotency_keys, through the Flask app's pooled connections"""
+
+    def __init__(self, get_connection, ttl=None):
+        self.get_connection = get_connection
+        self.ttl = ttl or _ttl()
+        self._next_purge = time.monotonic() + _purge_interval()
+
+    def get(self, key):
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(SELECT_KEY_SQL, (key,))
+                row = cur.fetchone()
+        return _stored(row) if row is not None else None
+
+    def set(self, key, value):
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(UPSERT_KEY_SQL, (key, value['fingerprint'], json.dumps(value['response']), self.ttl))
+                if time.monotonic() >= self._next_purge:
+                    self._next_purge = time.monotonic() + _purge_interval()
+                    cur.execute(PURGE_KEYS_SQL)
+            conn.commit()
+
+class AsyncPostgresResponseStore:
+    """PostgresResponseStore for the ASGI app, through its asyncpg pool"""
+
+    def __init__(self, get_pool, ttl=None):
+        self.get_pool = get_pool
+        self.ttl = ttl or _ttl()
+        self._next_purge = time.monotonic() + _purge_interval()
+
+    async def get(self, key):
+        pool = await self.get_pool()
+        row = await pool.fetchrow(SELECT_KEY_SQL_ASYNC, key)
+        return _stored(row) if row is not None else None
+
+    async def set(self, key, value):
+        pool = await self.get_pool()
+        await pool.execute(UPSERT_KEY_SQL_ASYNC, key, value['fingerprint'], json.dumps(value['response']), self.ttl)
+        if time.monotonic() >= self._next_purge:
+            self._next_purge = time.monotonic() + _purge_interval()
+            await pool.execute(PURGE_KEYS_SQL)
+
+class Idempotency:
+    """
+    Runs each idempotency key's /chat at most once per TTL, for the Flask app.
+
+    The first request with a key computes the response in its own thread;
+    concurrent retries block on its result, and later ones read it from the
+    store. A failed request stores nothing, so its retry runs again. Errors
+    from the shared store are logged and the request runs as if it had no key.
+    """
+
+    def __init__(self, shared=None, wait_timeout=None):
+        self.local = MemoryResponseStore()
+        self.shared = shared
+        self.wait_timeout = wait_timeout or float(os.getenv('IDEMPOTENCY_WAIT_TIMEOUT', '120'))
+        self._pending = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.replayed = 0
+        self.attached = 0
+        self.conflicts = 0
+        self.store_errors = 0
+
+    def run(self, key, request_fingerprint, compute):
+        """
+        The response for key, calling compute() only if no earlier request
+        with the key has completed or is in flight.
+
+        Returns:
+            Tuple of (response, replayed)
+
+        Raises:
+            IdempotencyConflict: If key was used for a different request
+        """
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is None:
+                future = concurrent.futures.Future()
+                self._pending[key] = (request_fingerprint, future)
+            elif pending[0] != request_fingerprint:
+                self.conflicts += 1
+                raise IdempotencyConflict('Idempotency-Key was already used for a different request')
+            else:
+                self.attached += 1
+
+        if pending is not None:
+            response, _ = pending[1].result(self.wait_timeout)
+            return response, True
+
+        try:
+            result = self._execute(key, request_fingerprint, compute)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _lookup(self, key):
+        stored = self.local.get(key)
+        if stored is None and self.shared is not None:
+            try:
+                stored = self.shared.get(key)
+            except Exception as e:
+                self.store_errors += 1
+                logger.warning(f"Idempotency key lookup failed, running the request: {str(e)}")
+        return stored
+
+    def _check(self, stored, request_fingerprint):
+        if stored['fingerprint'] != request_fingerprint:
+            self.conflicts += 1
+            raise IdempotencyConflict('Idempotency-Key was already used for a different request')
+        self.replayed += 1
+        return stored['response'], True
+
+    def _execute(self, key, request_fingerprint, compute):
+        stored = self._lookup(key)
+        if stored is not None:
+            return self._check(stored, request_fingerprint)
+
+        self.executed += 1
+        response = compute()
+        value = {'fingerprint': request_fingerprint, 'response': response}
+        self.local.set(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.set(key, value)
+            except Exception as e:
+                self.store_errors += 1
+                logger.warning(f"Storing idempotency key failed: {str(e)}")
+        return response, False
+
+    def stats(self):
+        """Return replay and attachment counters"""
+        return {
+            'backend': 'postgres' if self.shared is not None else 'memory',
+            'in_flight': len(self._pending),
+            'executed': self.executed,
+            'replayed': self.replayed,
+            'attached': self.attached,
+            'conflicts': self.conflicts,
+            'store_errors': self.store_errors,
+            'local': self.local.stats(),
+        }
+
+class AsyncIdempotency:
+    """
+    Idempotency for the ASGI app: the same contract, with the first request's
+    work running as a task that retries await. The task is shielded from its
+    callers, so it finishes and is stored even if the first client is gone.
+    """
+
+    def __init__(self, shared=None):
+        self.local = MemoryResponseStore()
+        self.shared = shared
+        self._pending = {}
+        self.executed = 0
+        self.replayed = 0
+        self.attached = 0
+        self.conflicts = 0
+        self.store_errors = 0
+
+    async def run(self, key, request_fingerprint, compute):
+        """Same contract as Idempotency.run; compute is a coroutine function"""
+        pending = self._pending.get(key)
+        if pending is None:
+            task = asyncio.get_running_loop().create_task(self._execute(key, request_fingerprint, compute))
+            self._pending[key] = (request_fingerprint, task)
+            task.add_done_callback(lambda done: self._finish(key, done))
+            response, replayed = await asyncio.shield(task)
+            return response, replayed
+
+        if pending[0] != request_fingerprint:
+            self.conflicts += 1
+            raise IdempotencyConflict('Idempotency-Key was already used for a different request')
+        self.attached += 1
+        response, _ = await asyncio.shield(pending[1])
+        return response, True
+
+    def _finish(self, key, task):
+        if key in self._pending and self._pending[key][1] is task:
+            del self._pending[key]
+        if not task.cancelled():
+            # Nobody may be waiting any more; don't warn about an unretrieved error
+            task.exception()
+
+    async def _lookup(self, key):
+        stored = self.local.get(key)
+        if stored is None and self.shared is not None:
+            try:
+                stored = await self.shared.get(key)
+            except Exception as e:
+                self.store_errors += 1
+                logger.warning(f"Idempotency key lookup failed, running the request: {str(e)}")
+        return stored
+
+    _check = Idempotency._check
+
+    async def _execute(self, key, request_fingerprint, compute):
+        stored = await self._lookup(key)
+        if stored is not None:
+            return self._check(stored, request_fingerprint)
+
+        self.executed += 1
+        response = await compute()
+        value = {'fingerprint': request_fingerprint, 'response': response}
+        self.local.set(key, value)
+        if self.shared is not None:
+            try:
+                await self.shared.set(key, value)
+            except Exception as e:
+                self.store_errors += 1
+                logger.warning(f"Storing idempotency key failed: {str(e)}")
+        return response, False
+
+    stats = Idempotency.stats
@@ -0,0 +1,198 @@
+"""
+Keyset pagination and streaming export of input_table for the LLM gateway.
+
+Rows are ordered newest first by (created_at, id). A page ends with an
+opaque cursor holding the position of its last row, and the next page
+starts strictly after it, so every page costs one index range scan however
+deep into the history it is. Exports read through a server-side cursor in
+fixed-size batches and never hold the full result.
+
+The blocking helpers take a psycopg2 connection; the *_async ones take an
+asyncpg connection and are used by the ASGI app.
+
+Both endpoints return every user's raw input, so they only answer requests
+carrying INPUTS_ADMIN_TOKEN as a bearer token, and are disabled when it is
+not set.
+"""
+import base64
+import csv
+import hmac
+import io
+import json
+import os
+from datetime import datetime
+
+INPUT_COLUMNS = ('id', 'input_uuid', 'input', 'conversation_id', 'created_at', 'processed')
+CHUNK_BYTES = 64 * 1024
+
+class InvalidCursor(ValueError):
+    """Raised for a pagination cursor this server did not issue"""
+
+def check_admin(authorization):
+    """
+    Check an Authorization header against INPUTS_ADMIN_TOKEN.
+
+    Returns:
+        None if the request may read inputs, otherwise an (error, status)
+        tuple: 403 when no token is configured, 401 when it doesn't match
+    """
+    token = os.getenv('INPUTS_ADMIN_TOKEN')
+    if not token:
+        return 'Input access is disabled; set INPUTS_ADMIN_TOKEN to enable it', 403
+    scheme, _, supplied = (authorization or '').partition(' ')
+    if scheme.lower() != 'bearer' or not hmac.compare_digest(supplied.strip().encode(), token.encode()):
+        return 'Admin token required', 401
+    return None
+
+def encode_cursor(created_at, row_id):
+    raw = json.dumps([created_at.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    """Return the (created_at, id) position encoded in a cursor"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError) as e:
+        raise InvalidCursor('Invalid cursor') from e
+
+def build_query(conversation_id=None, after=None, since=None, until=None, limit=None, numbered=False):
+    """
+    SELECT for input rows newest first, optionally within one conversation,
+    strictly after a (created_at, id) position and within a time range.
+
+    The row comparison and ORDER BY match the (created_at DESC, id DESC)
+    indexes, so Postgres walks the index from the cursor position instead of
+    sorting or skipping rows. Placeholders are %s for psycopg2, or $1, $2...
+    for asyncpg when numbered is set.
+    """
+    conditions = []
+    params = []
+
+    def placeholder(value):
+        params.append(value)
+        return f'${len(params)}' if numbered else '%s'
+
+    if conversation_id:
+        conditions.append(f'conversation_id = {placeholder(conversation_id)}')
+    if after is not None:
+        conditions.append(f'(created_at, id) < ({placeholder(after[0])}, {placeholder(after[1])})')
+    if since is not None:
+        conditions.append(f'created_at >= {placeholder(since)}')
+    if until is not None:
+        conditions.append(f'created_at < {placeholder(until)}')
+
+    sql = f"SELECT {', '.join(INPUT_COLUMNS)} FROM input_table"
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY created_at DESC, id DESC'
+    if limit is not None:
+        sql += f' LIMIT {placeholder(limit)}'
+    return sql, params
+
+def serialize_row(row):
+    """JSON-ready copy of an input row"""
+    return {
+        'id': row['id'],
+        'input_uuid': str(row['input_uuid']) if row['input_uuid'] else None,
+        'input': row['input'],
+        'conversation_id': row['conversation_id'],
+        'created_at': row['created_at'].isoformat() if row['created_at'] else None,
+        'processed': row['processed'],
+    }
+
+def fetch_page(conn, limit, conversation_id=None, after=None):
+    """
+    One page of inputs after a decoded cursor position, and the cursor for
+    the next page (None on the last).
+
+    Fetches one row beyond the page to learn whether another page exists
+    without a separate COUNT.
+    """
+    sql, params = build_query(conversation_id, after=after, limit=limit + 1)
+    with conn.cursor() as cur:
+        cur.execute(sql, params)
+        rows = cur.fetchall()
+    return _page(rows, limit)
+
+async def fetch_page_async(conn, limit, conversation_id=None, after=None):
+    """fetch_page for an asyncpg connection"""
+    sql, params = build_query(conversation_id, after=after, limit=limit + 1, numbered=True)
+    rows = await conn.fetch(sql, *params)
+    return _page(rows, limit)
+
+def _page(rows, limit):
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last['created_at'], last['id'])
+    return [serialize_row(row) for row in rows], next_cursor
+
+def _csv_line(values):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerow(values)
+    return buffer.getvalue()
+
+def _format_row(row, fmt):
+    item = serialize_row(row)
+    if fmt == 'csv':
+        return _csv_line([item[column] for column in INPUT_COLUMNS])
+    return json.dumps(item) + '\n'
+
+def _header(fmt):
+    return _csv_line(INPUT_COLUMNS) if fmt == 'csv' else ''
+
+def export_rows(conn, fmt, batch_size, conversation_id=None, since=None, until=None):
+    """
+    Generator of NDJSON or CSV text for every matching input.
+
+    The query runs on a named (server-side) cursor that fetches batch_size
+    rows per round trip. The first item is produced as soon as the query has
+    been opened (the CSV header, or an empty string for NDJSON), so callers
+    can prime the generator to surface database errors before streaming.
+    """
+    sql, params = build_query(conversation_id, since=since, until=until)
+    with conn.cursor(name='input_export') as cur:
+        cur.itersize = batch_size
+        cur.execute(sql, params)
+        yield _header(fmt)
+        # Group lines into chunks of about CHUNK_BYTES so the server makes
+        # one write per chunk rather than one per row
+        chunk = []
+        size = 0
+        for row in cur:
+            line = _format_row(row, fmt)
+            chunk.append(line)
+            size += len(line)
+            if size >= CHUNK_BYTES:
+                yield ''.join(chunk)
+                chunk = []
+                size = 0
+        if chunk:
+            yield ''.join(chunk)
+
+async def export_rows_async(conn, fmt, batch_size, conversation_id=None, since=None, until=None):
+    """
+    export_rows for an asyncpg connection. The statement is prepared before
+    the first item is produced, so priming still surfaces database errors.
+    The cursor needs a transaction, which stays open until the generator is
+    exhausted or closed.
+    """
+    sql, params = build_query(conversation_id, since=since, until=until, numbered=True)
+    async with conn.transaction():
+        statement = await conn.prepare(sql)
+        yield _header(fmt)
+        chunk = []
+        size = 0
+        async for row in statement.cursor(*params, prefetch=batch_size):
+            line = _format_row(row, fmt)
+            chunk.append(line)
+            size += len(line)
+            if size >= CHUNK_BYTES:
+                yield ''.join(chunk)
+                chunk = []
+                size = 0
+        if chunk:
+            yield ''.join(chunk)
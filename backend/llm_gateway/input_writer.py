@@ -0,0 +1,302 @@
+"""
+Write-behind input logging for the LLM gateway.
+
+Chat handlers enqueue inputs and return immediately; a background thread
+(or, for the ASGI app, a background task) drains the queue in batches and
+bulk-loads them into input_table with COPY.
+"""
+import asyncio
+import io
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+COPY_INPUTS_SQL = "COPY input_table (input_uuid, input, conversation_id, created_at) FROM STDIN"
+COPY_COLUMNS = ['input_uuid', 'input', 'conversation_id', 'created_at']
+
+def _copy_field(value):
+    """Escape a value for COPY text format"""
+    if value is None:
+        return "\\N"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+class InputWriter:
+    """
+    Bounded write-behind queue for user inputs.
+
+    Every input gets a UUID when it is enqueued (or keeps the one the client
+    supplied), so callers can reference the row before it is written. Batches
+    are flushed when they reach batch_size or when flush_interval seconds have
+    passed since the first queued item. When the queue is full new inputs are
+    dropped and counted instead of blocking the request.
+    """
+
+    def __init__(self, get_connection, max_queue=None, batch_size=None, flush_interval=None, max_retries=None):
+        self.get_connection = get_connection
+        self.max_queue = max_queue or int(os.getenv('INPUT_LOG_MAX_QUEUE', '10000'))
+        self.batch_size = batch_size or int(os.getenv('INPUT_LOG_BATCH_SIZE', '500'))
+        self.flush_interval = flush_interval or float(os.getenv('INPUT_LOG_FLUSH_INTERVAL', '0.5'))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('INPUT_LOG_MAX_RETRIES', '3'))
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+        # Request threads and the flusher thread both update the counters
+        self._counter_lock = threading.Lock()
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.queue_high_water = 0
+        self.last_flush_seconds = 0.0
+
+    def start(self):
+        """Start the flusher thread if it is not already running"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name='input-writer', daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Flush whatever is queued and stop the flusher thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def enqueue(self, input_text, conversation_id=None, input_id=None):
+        """
+        Queue an input for writing.
+
+        Returns:
+            Tuple of (input_id, accepted). input_id is a UUID string that will
+            be stored in input_table.input_uuid; accepted is False if the queue
+            was full and the input was dropped.
+        """
+        input_id = str(input_id or uuid.uuid4())
+        self.start()
+        try:
+            self._queue.put_nowait((input_id, input_text, conversation_id, datetime.now(timezone.utc)))
+        except queue.Full:
+            with self._counter_lock:
+                self.dropped += 1
+            logger.warning(f"Input log queue full ({self.max_queue}), dropping input {input_id}")
+            return input_id, False
+
+        with self._counter_lock:
+            self.enqueued += 1
+            depth = self._queue.qsize()
+            if depth > self.queue_high_water:
+                self.queue_high_water = depth
+        return input_id, True
+
+    def stats(self):
+        """Return queue depth, backpressure and flush counters"""
+        with self._counter_lock:
+            return self._counters()
+
+    def _counters(self):
+        return {
+            'queue_depth': self._queue.qsize(),
+            'queue_capacity': self.max_queue,
+            'queue_high_water': self.queue_high_water,
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'batches': self.batches,
+            'last_flush_seconds': round(self.last_flush_seconds, 4),
+        }
+
+    def _next_batch(self):
+        """Block for the first item, then collect more until the batch is full or the window closes"""
+        try:
+            first = self._queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set() or not self._queue.empty():
+            batch = self._next_batch()
+            if batch:
+                self._flush_with_retry(batch)
+
+    def _flush_with_retry(self, batch):
+        delay = 0.5
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._flush(batch)
+                return
+            except Exception as e:
+                if attempt < self.max_retries and not self._stop.is_set():
+                    logger.warning(f"Input log flush of {len(batch)} rows failed, retrying in {delay:.1f} seconds: {str(e)}")
+                    time.sleep(delay)
+                    delay = min(delay * 2, 10.0)
+                else:
+                    with self._counter_lock:
+                        self.failed += len(batch)
+                    logger.error(f"Dropping {len(batch)} inputs after failed flush: {str(e)}")
+                    return
+
+    def _flush(self, batch):
+        start = time.perf_counter()
+        buffer = io.StringIO()
+        for row in batch:
+            buffer.write("\t".join(_copy_field(value) for value in row))
+            buffer.write("\n")
+        buffer.seek(0)
+
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.copy_expert(COPY_INPUTS_SQL, buffer)
+            conn.commit()
+
+        with self._counter_lock:
+            self.last_flush_seconds = time.perf_counter() - start
+            self.written += len(batch)
+            self.batches += 1
+        logger.info(f"Flushed {len(batch)} inputs to database in {self.last_flush_seconds * 1000:.1f} ms")
+
+class AsyncInputWriter:
+    """
+    InputWriter for an event loop: the same bounded queue, batching, retry
+    and counters, with a flusher task that bulk-loads through an asyncpg
+    pool with copy_records_to_table.
+
+    get_pool is a coroutine function returning the pool, so a database that
+    is down at startup only fails flushes, which are retried.
+    """
+
+    def __init__(self, get_pool, max_queue=None, batch_size=None, flush_interval=None, max_retries=None):
+        self.get_pool = get_pool
+        self.max_queue = max_queue or int(os.getenv('INPUT_LOG_MAX_QUEUE', '10000'))
+        self.batch_size = batch_size or int(os.getenv('INPUT_LOG_BATCH_SIZE', '500'))
+        self.flush_interval = flush_interval or float(os.getenv('INPUT_LOG_FLUSH_INTERVAL', '0.5'))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('INPUT_LOG_MAX_RETRIES', '3'))
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._stopping = False
+        self._task = None
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.queue_high_water = 0
+        self.last_flush_seconds = 0.0
+
+    def start(self):
+        """Start the flusher task on the running loop"""
+        if self._task is None or self._task.done():
+            self._stopping = False
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self, timeout=5.0):
+        """Flush whatever is queued and stop the flusher task"""
+        self._stopping = True
+        if self._task is not None:
+            try:
+                await asyncio.wait_for(self._task, timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Input log flush did not finish in {timeout:.0f} seconds, {self._queue.qsize()} inputs lost")
+
+    def enqueue(self, input_text, conversation_id=None, input_id=None):
+        """Queue an input for writing; same contract as InputWriter.enqueue"""
+        input_id = str(input_id or uuid.uuid4())
+        self.start()
+        try:
+            self._queue.put_nowait((uuid.UUID(input_id), input_text, conversation_id, datetime.now(timezone.utc)))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f"Input log queue full ({self.max_queue}), dropping input {input_id}")
+            return input_id, False
+
+        self.enqueued += 1
+        depth = self._queue.qsize()
+        if depth > self.queue_high_water:
+            self.queue_high_water = depth
+        return input_id, True
+
+    def stats(self):
+        """Return queue depth, backpressure and flush counters"""
+        return self._counters()
+
+    _counters = InputWriter._counters
+
+    async def _next_batch(self):
+        try:
+            first = await asyncio.wait_for(self._queue.get(), timeout=self.flush_interval)
+        except asyncio.TimeoutError:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while not self._stopping or not self._queue.empty():
+            batch = await self._next_batch()
+            if batch:
+                await self._flush_with_retry(batch)
+
+    async def _flush_with_retry(self, batch):
+        delay = 0.5
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self._flush(batch)
+                return
+            except Exception as e:
+                if attempt < self.max_retries and not self._stopping:
+                    logger.warning(f"Input log flush of {len(batch)} rows failed, retrying in {delay:.1f} seconds: {str(e)}")
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, 10.0)
+                else:
+                    self.failed += len(batch)
+                    logger.error(f"Dropping {len(batch)} inputs after failed flush: {str(e)}")
+                    return
+
+    async def _flush(self, batch):
+        start = time.perf_counter()
+        pool = await self.get_pool()
+        async with pool.acquire() as conn:
+            await conn.copy_records_to_table('input_table', records=batch, columns=COPY_COLUMNS)
+
+        self.last_flush_seconds = time.perf_counter() - start
+        self.written += len(batch)
+        self.batches += 1
+        logger.info(f"Flushed {len(batch)} inputs to database in {self.last_flush_seconds * 1000:.1f} ms")
@@ -0,0 +1,153 @@
+"""
+Per-client rate limiting for the gateway's /chat.
+
+The gateway has no sign-in, so clients are keyed by address: the first
+X-Forwarded-For hop when RATE_LIMIT_TRUST_FORWARDED=true, which must only be
+set behind a proxy that overwrites that header (the bundled Caddy does), or
+the peer address otherwise. Each address draws one request from a token
+bucket refilled at RATE_LIMIT_REQUESTS_PER_SECOND up to RATE_LIMIT_BURST, and
+is refused while its upstream tokens over the last
+RATE_LIMIT_TOKEN_WINDOW_SECONDS exceed RATE_LIMIT_TOKENS_PER_WINDOW (0
+disables the quota). Token usage is read from the completion response and
+charged once it is known, so a request is refused before it costs an
+upstream call. State is per worker, in LRUs bounded by RATE_LIMIT_MAX_KEYS.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+def client_address(forwarded_for, peer):
+    """The address to key a request on, from its X-Forwarded-For header and peer address"""
+    if forwarded_for and os.getenv('RATE_LIMIT_TRUST_FORWARDED', 'false').lower() == 'true':
+        return forwarded_for.split(',')[0].strip()
+    return peer or 'unknown'
+
+def _sliding_estimate(current, previous, window, now):
+    # Weight the previous fixed window by how much of it still overlaps the sliding one
+    elapsed = (now % window) / window
+    return current + previous * (1.0 - elapsed)
+
+class RateLimiter:
+    """
+    Thread-safe request token buckets and token quota windows per client.
+
+    An evicted client starts over with a full bucket, which only ever errs
+    on the side of allowing a request.
+    """
+
+    def __init__(self, rate=None, burst=None, token_quota=None, quota_window=None, max_keys=None):
+        self.enabled = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+        self.rate = rate or float(os.getenv('RATE_LIMIT_REQUESTS_PER_SECOND', '1'))
+        self.burst = burst or float(os.getenv('RATE_LIMIT_BURST', '10'))
+        self.token_quota = token_quota if token_quota is not None else int(os.getenv('RATE_LIMIT_TOKENS_PER_WINDOW', '100000'))
+        self.quota_window = quota_window or float(os.getenv('RATE_LIMIT_TOKEN_WINDOW_SECONDS', '3600'))
+        self.max_keys = max_keys or int(os.getenv('RATE_LIMIT_MAX_KEYS', '100000'))
+        policies = [f"{int(self.burst)};w={math.ceil(self.burst / self.rate)}"]
+        if self.token_quota:
+            policies.append(f'{self.token_quota};w={int(self.quota_window)};comment="llm tokens"')
+        self.policy = ', '.join(policies)
+        self._buckets = OrderedDict()
+        self._windows = OrderedDict()
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.rejected_requests = 0
+        self.rejected_tokens = 0
+        self.tokens_charged = 0
+        self.evictions = 0
+
+    def _touch(self, entries, key):
+        entries.move_to_end(key)
+        if len(entries) > self.max_keys:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def _window(self, key, now):
+        index = math.floor(now / self.quota_window)
+        entry = self._windows.get(key)
+        if entry is None:
+            entry = self._windows[key] = [index, 0.0, 0.0]
+        elif entry[0] != index:
+            # Roll forward; anything older than the previous window no longer counts
+            entry[2] = entry[1] if entry[0] == index - 1 else 0.0
+            entry[1] = 0.0
+            entry[0] = index
+        self._touch(self._windows, key)
+        return entry
+
+    def _headers(self, limit, remaining, reset):
+        return {
+            'RateLimit-Limit': str(limit),
+            'RateLimit-Remaining': str(remaining),
+            'RateLimit-Reset': str(reset),
+            'RateLimit-Policy': self.policy,
+        }
+
+    def check(self, key):
+        """
+        Spend one request from key's bucket, then check its token quota.
+
+        Returns:
+            Tuple of (error, headers). error is None if the request may go
+            ahead, otherwise the reason for refusing it; headers are the
+            RateLimit headers, plus Retry-After when refused.
+        """
+        if not self.enabled:
+            return None, {}
+
+        with self._lock:
+            now = time.monotonic()
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+            tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            allowed = tokens >= 1.0
+            if allowed:
+                tokens -= 1.0
+            bucket[0] = tokens
+            bucket[1] = now
+            self._touch(self._buckets, key)
+
+            if not allowed:
+                self.rejected_requests += 1
+                reset = max(1, math.ceil((1.0 - tokens) / self.rate))
+                return 'Too many requests', {**self._headers(int(self.burst), 0, reset), 'Retry-After': str(reset)}
+
+            if self.token_quota:
+                wall = time.time()
+                _, current, previous = self._window(key, wall)
+                if _sliding_estimate(current, previous, self.quota_window, wall) >= self.token_quota:
+                    self.rejected_tokens += 1
+                    # The sliding estimate falls below the quota within one window at the latest
+                    reset = max(1, math.ceil(self.quota_window - wall % self.quota_window))
+                    return 'Token quota exceeded', {**self._headers(self.token_quota, 0, reset), 'Retry-After': str(reset)}
+
+            self.allowed += 1
+            return None, self._headers(int(self.burst), int(tokens), math.ceil((self.burst - tokens) / self.rate))
+
+    def charge(self, key, tokens):
+        """Add upstream tokens to key's quota window"""
+        if not self.enabled or not self.token_quota or not tokens:
+            return
+        with self._lock:
+            self._window(key, time.time())[1] += tokens
+            self.tokens_charged += tokens
+
+    def stats(self):
+        """Return the policy, refusal counters and state size"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'policy': self.policy,
+                'allowed': self.allowed,
+                'rejected_requests': self.rejected_requests,
+                'rejected_tokens': self.rejected_tokens,
+                'tokens_charged': self.tokens_charged,
+                'clients': len(self._buckets),
+                'capacity': self.max_keys,
+                'evictions': self.evictions,
+            }
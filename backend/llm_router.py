@@ -0,0 +1,436 @@
+"""
+LLM Router Module
+Routes completions across OpenAI-compatible backends by observed latency and errors,
+with hedged requests and per-backend circuit breakers
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import weakref
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Generic, List, Optional, Set, TypeVar
+
+from openai import AsyncOpenAI
+
+from metrics import LLM_TOKENS, LLM_UPSTREAM_ERRORS, error_status
+from rate_limit import record_llm_tokens
+from upstream_transport import create_http_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE_URL = "https://inference.baseten.co/v1"
+
+class NoBackendAvailableError(Exception):
+    """Raised when every backend is ejected by its circuit breaker."""
+
+@dataclass
+class BackendConfig:
+    name: str
+    base_url: str
+    api_key: str
+    model: str
+    weight: float = 1.0
+
+class Backend:
+    """
+    One upstream endpoint with its latency/error statistics and circuit breaker.
+
+    Latency is tracked separately for time-to-first-token (streams) and full
+    completions, each as an EWMA plus a window of recent samples for p95.
+    """
+
+    def __init__(self, config: BackendConfig, failure_threshold: int, cooldown: float, alpha: float = 0.2):
+        self.config = config
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.alpha = alpha
+        self.http_client, self.connections = create_http_client(config.name)
+        self.client = AsyncOpenAI(
+            api_key=config.api_key, base_url=config.base_url,
+            http_client=self.http_client, timeout=self.http_client.timeout
+        )
+        self.ewma: Dict[str, Optional[float]] = {"stream": None, "complete": None}
+        self.samples: Dict[str, Deque[float]] = {"stream": deque(maxlen=200), "complete": deque(maxlen=200)}
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.half_open_probe = False
+        self.requests = 0
+        self.failures = 0
+
+    @property
+    def name(self) -> str:
+        return self.config.name
+
+    @property
+    def state(self) -> str:
+        if self.consecutive_failures < self.failure_threshold:
+            return "closed"
+        return "half_open" if time.monotonic() >= self.open_until else "open"
+
+    def available(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        # After the cooldown a single probe request is let through
+        return state == "half_open" and not self.half_open_probe
+
+    def score(self, kind: str) -> float:
+        """Lower is better: latency EWMA inflated by error rate, divided by weight"""
+        latency = self.ewma[kind]
+        if latency is None:
+            return 0.0
+        return latency * (1.0 + 4.0 * self.error_rate) / self.config.weight
+
+    def p95(self, kind: str) -> Optional[float]:
+        samples = self.samples[kind]
+        if len(samples) < 20:
+            return None
+        ordered = sorted(samples)
+        return ordered[int(len(ordered) * 0.95) - 1]
+
+    def record_latency(self, kind: str, latency: float) -> None:
+        previous = self.ewma[kind]
+        self.ewma[kind] = latency if previous is None else previous + self.alpha * (latency - previous)
+        self.samples[kind].append(latency)
+
+    def record_cancelled(self, kind: str, elapsed: float) -> None:
+        """A hedge loser was cancelled: count how long it had taken so far, but not as an error"""
+        self.record_latency(kind, elapsed)
+        self.half_open_probe = False
+
+    def record_success(self) -> None:
+        self.requests += 1
+        self.error_rate *= 1.0 - self.alpha
+        self.consecutive_failures = 0
+        self.cooldown = self.base_cooldown
+        self.half_open_probe = False
+
+    def record_usage(self, usage) -> None:
+        """Count the tokens reported in a completion's usage field, if any"""
+        if usage is not None:
+            LLM_TOKENS.inc(usage.prompt_tokens or 0, "input")
+            LLM_TOKENS.inc(usage.completion_tokens or 0, "output")
+            record_llm_tokens((usage.prompt_tokens or 0) + (usage.completion_tokens or 0))
+
+    def record_failure(self, error: Optional[BaseException] = None) -> None:
+        if error is not None:
+            LLM_UPSTREAM_ERRORS.inc(1, self.name, error_status(error))
+        self.requests += 1
+        self.failures += 1
+        self.error_rate += self.alpha * (1.0 - self.error_rate)
+        was_half_open = self.state == "half_open"
+        self.consecutive_failures += 1
+        self.half_open_probe = False
+        if self.consecutive_failures >= self.failure_threshold:
+            if was_half_open:
+                self.cooldown = min(self.cooldown * 2, 300.0)
+            self.open_until = time.monotonic() + self.cooldown
+            logger.warning("Circuit open for LLM backend %s for %.0f seconds", self.name, self.cooldown)
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "model": self.config.model,
+            "weight": self.config.weight,
+            "ttft_ewma_ms": round(self.ewma["stream"] * 1000, 1) if self.ewma["stream"] is not None else None,
+            "latency_ewma_ms": round(self.ewma["complete"] * 1000, 1) if self.ewma["complete"] is not None else None,
+            "error_rate": round(self.error_rate, 4),
+            "requests": self.requests,
+            "failures": self.failures,
+            "connections": self.connections.stats(),
+        }
+
+class LLMRouter:
+    """
+    Picks a backend per request and optionally hedges slow ones.
+
+    Selection takes the available backend with the lowest score, exploring a
+    weighted random backend a small fraction of the time so every backend's
+    statistics stay fresh. With hedging on, if the chosen backend has not
+    produced its first token (or, for non-streaming calls, its response)
+    within its own p95 latency, the request is also sent to the next best
+    backend; the first to answer wins and the other is cancelled.
+    """
+
+    def __init__(
+        self,
+        configs: List[BackendConfig],
+        hedging: Optional[bool] = None,
+        hedge_min_delay: Optional[float] = None,
+        explore: Optional[float] = None,
+        failure_threshold: Optional[int] = None,
+        cooldown: Optional[float] = None,
+    ):
+        if not configs:
+            raise ValueError("At least one LLM backend is required")
+        failure_threshold = failure_threshold or int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+        cooldown = cooldown or float(os.getenv("LLM_BREAKER_COOLDOWN_SECONDS", "30"))
+        self.backends = [Backend(config, failure_threshold, cooldown) for config in configs]
+        if hedging is None:
+            hedging = os.getenv("LLM_HEDGING", "true").lower() == "true"
+        self.hedging = hedging and len(self.backends) > 1
+        self.hedge_min_delay = hedge_min_delay if hedge_min_delay is not None else float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+        self.hedge_default_delay = float(os.getenv("LLM_HEDGE_DEFAULT_DELAY", "2.0"))
+        self.explore = explore if explore is not None else float(os.getenv("LLM_ROUTER_EXPLORE", "0.05"))
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        # Ask streams for a final usage chunk so output tokens can be counted
+        self.stream_usage = os.getenv("LLM_STREAM_USAGE", "true").lower() == "true"
+
+    def select(self, kind: str, exclude: Set[str] = frozenset()) -> Optional[Backend]:
+        candidates = [b for b in self.backends if b.name not in exclude and b.available()]
+        if not candidates:
+            return None
+        if len(candidates) > 1 and random.random() < self.explore:
+            return random.choices(candidates, weights=[b.config.weight for b in candidates])[0]
+        best = min(b.score(kind) for b in candidates)
+        tied = [b for b in candidates if b.score(kind) == best]
+        return random.choices(tied, weights=[b.config.weight for b in tied])[0]
+
+    def hedge_delay(self, backend: Backend, kind: str) -> float:
+        p95 = backend.p95(kind)
+        return max(self.hedge_min_delay, p95 if p95 is not None else self.hedge_default_delay)
+
+    def _claim(self, backend: Backend) -> None:
+        if backend.state == "half_open":
+            backend.half_open_probe = True
+
+    async def complete(self, params: dict) -> str:
+        """Run a non-streaming completion on the best backend, hedging if it is slow"""
+
+        async def attempt(backend: Backend) -> str:
+            started = time.monotonic()
+            try:
+                response = await backend.client.chat.completions.create(**{**params, "model": backend.config.model})
+            except asyncio.CancelledError:
+                # Lost a hedge race; the time spent is still a latency signal
+                backend.record_cancelled("complete", time.monotonic() - started)
+                raise
+            except Exception as e:
+                backend.record_failure(e)
+                raise
+            backend.record_latency("complete", time.monotonic() - started)
+            backend.record_success()
+            backend.record_usage(response.usage)
+            return response.choices[0].message.content
+
+        return await self._race("complete", attempt)
+
+    async def _race(
+        self,
+        kind: str,
+        attempt: Callable[[Backend], Awaitable],
+        discard: Optional[Callable[[object], Awaitable]] = None,
+    ):
+        """
+        Run attempt() on the best backend, adding a hedge or failover backend as needed.
+
+        discard() is awaited for any other attempt that also succeeded, so
+        resources such as open streams are released.
+        """
+        tried: Set[str] = set()
+        pending: Dict[asyncio.Task, Backend] = {}
+        hedged = False
+        hedge: Optional[Backend] = None
+
+        def launch() -> Optional[Backend]:
+            backend = self.select(kind, exclude=tried)
+            if backend is None:
+                return None
+            tried.add(backend.name)
+            self._claim(backend)
+            pending[asyncio.create_task(attempt(backend))] = backend
+            return backend
+
+        primary = launch()
+        if primary is None:
+            raise NoBackendAvailableError("All LLM backends are unavailable")
+
+        last_error: Optional[BaseException] = None
+        try:
+            while pending:
+                timeout = self.hedge_delay(primary, kind) if self.hedging and not hedged else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    hedged = True
+                    hedge = launch()
+                    if hedge is not None:
+                        self.hedges += 1
+                    continue
+                winner = None
+                for task in done:
+                    backend = pending.pop(task)
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        logger.warning("LLM backend %s failed: %s", backend.name, last_error)
+                    elif winner is None:
+                        winner = task
+                        if backend is hedge:
+                            self.hedge_wins += 1
+                    elif discard is not None:
+                        await discard(task.result())
+                if winner is not None:
+                    return winner.result()
+                if not pending and launch() is not None:
+                    # Failed over to the next backend
+                    self.failovers += 1
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def stream(self, params: dict) -> AsyncIterator[str]:
+        """Stream a completion from the best backend, hedging if its first token is slow"""
+
+        if self.stream_usage:
+            params = {**params, "stream_options": {"include_usage": True}}
+
+        async def open_stream(backend: Backend):
+            """Start a stream and return (backend, first_delta, stream) once it produces text"""
+            started = time.monotonic()
+            stream = None
+            try:
+                stream = await backend.client.chat.completions.create(
+                    stream=True, **{**params, "model": backend.config.model}
+                )
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        backend.record_latency("stream", time.monotonic() - started)
+                        return backend, chunk.choices[0].delta.content, stream
+                    backend.record_usage(chunk.usage)
+                # Stream ended without any text
+                backend.record_latency("stream", time.monotonic() - started)
+                backend.record_success()
+                return backend, None, stream
+            except asyncio.CancelledError:
+                backend.record_cancelled("stream", time.monotonic() - started)
+                if stream is not None:
+                    await stream.close()
+                raise
+            except Exception as e:
+                backend.record_failure(e)
+                raise
+
+        async def discard(result) -> None:
+            await result[2].close()
+
+        backend, first, stream = await self._race("stream", open_stream, discard)
+        try:
+            if first is None:
+                return
+            yield first
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                elif chunk.usage is not None:
+                    backend.record_usage(chunk.usage)
+            backend.record_success()
+        except (asyncio.CancelledError, GeneratorExit):
+            raise
+        except Exception as e:
+            backend.record_failure(e)
+            raise
+        finally:
+            await stream.close()
+
+    def stats(self) -> dict:
+        return {
+            "hedging": self.hedging,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "backends": {b.name: b.stats() for b in self.backends},
+        }
+
+    async def close(self) -> None:
+        """Close every backend's HTTP connection pool"""
+        for backend in self.backends:
+            await backend.client.close()
+
+def load_backend_configs(api_key: str) -> List[BackendConfig]:
+    """
+    Read backend definitions from LLM_BACKENDS (JSON) or LLM_BACKENDS_FILE.
+
+    Each entry has name, base_url, model, optional weight, and either api_key
+    or api_key_env naming the environment variable that holds the key.
+    Without either setting a single Baseten backend is used.
+    """
+    raw = os.getenv("LLM_BACKENDS")
+    path = os.getenv("LLM_BACKENDS_FILE")
+    if not raw and path:
+        with open(path) as f:
+            raw = f.read()
+    if not raw:
+        return [BackendConfig(
+            name="baseten",
+            base_url=os.getenv("LLM_BASE_URL", DEFAULT_BASE_URL),
+            api_key=api_key,
+            model=os.getenv("LLM_MODEL", "openai/gpt-oss-120b"),
+        )]
+
+    configs = []
+    for index, entry in enumerate(json.loads(raw)):
+        key = entry.get("api_key") or os.getenv(entry.get("api_key_env", ""), "") or api_key
+        configs.append(BackendConfig(
+            name=entry.get("name", f"backend{index}"),
+            base_url=entry.get("base_url", DEFAULT_BASE_URL),
+            api_key=key,
+            model=entry.get("model", os.getenv("LLM_MODEL", "openai/gpt-oss-120b")),
+            weight=float(entry.get("weight", 1.0)),
+        ))
+    return configs
+
+T = TypeVar("T")
+
+class LoopLocal(Generic[T]):
+    """
+    One instance of something per event loop.
+
+    Async HTTP clients keep their pooled connections bound to the loop that
+    opened them; a module-level client reused from a second loop (e.g. a
+    later asyncio.run call) fails or silently reconnects every time. get()
+    returns the instance belonging to the running loop, creating it there on
+    first use; entries go away with their loop.
+    """
+
+    def __init__(self):
+        self._instances: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, T]" = weakref.WeakKeyDictionary()
+        # For callers outside any loop, e.g. reading stats from sync code
+        self._outside_loop: Optional[T] = None
+
+    def get(self, factory: Callable[[], T]) -> T:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            if self._outside_loop is None:
+                self._outside_loop = factory()
+            return self._outside_loop
+        instance = self._instances.get(loop)
+        if instance is None:
+            instance = self._instances[loop] = factory()
+        return instance
+
+    def pop(self) -> Optional[T]:
+        """Forget and return the running loop's instance, if it has one"""
+        return self._instances.pop(asyncio.get_running_loop(), None)
+
+_routers: LoopLocal[LLMRouter] = LoopLocal()
+
+def get_router(api_key: str) -> LLMRouter:
+    """Get or create the LLMRouter for the running event loop."""
+    return _routers.get(lambda: LLMRouter(load_backend_configs(api_key)))
+
+async def close_router() -> None:
+    """Close the running loop's router, if one was created, before the loop goes away"""
+    router = _routers.pop()
+    if router is not None:
+        await router.close()
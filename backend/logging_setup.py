@@ -0,0 +1,200 @@
+"""
+Logging Setup Module
+Non-blocking structured JSON logging with request correlation and sampling
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import uuid
+import zlib
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+# Correlates every log line of one request, including those from background
+# tasks it spawned (tasks copy the context they were created in)
+request_id_var: ContextVar[Optional[str]] = ContextVar("request_id", default=None)
+
+# LogRecord attributes that are not user-supplied extra fields
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "request_id", "sample_rate"}
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex
+
+class RequestContextFilter(logging.Filter):
+    """Stamp the current request ID onto the record while still in the caller's context"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not hasattr(record, "request_id"):
+            record.request_id = request_id_var.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep only a fraction of INFO-and-below records.
+
+    The rate comes from the record's sample_rate extra field, else the
+    default. Records carrying a request ID are kept or dropped per request
+    (by hashing the ID), so a sampled request keeps all of its lines.
+    Warnings and errors are never sampled out.
+    """
+
+    def __init__(self, default_rate: float = 1.0):
+        super().__init__()
+        self.default_rate = default_rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.INFO:
+            return True
+        rate = getattr(record, "sample_rate", self.default_rate)
+        if rate >= 1.0:
+            return True
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            return zlib.crc32(request_id.encode()) % 10000 < rate * 10000
+        return random.random() < rate
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with timestamp, level, logger, message, request ID and extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            entry["request_id"] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Hands records to the listener thread without ever blocking the caller.
+
+    Formatting and I/O happen on the listener thread. Only the %-merge of
+    the message runs here, so arguments are captured at call time. If the
+    queue is full the record is dropped and counted instead of waiting.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+_listener: Optional[QueueListener] = None
+_handler: Optional[NonBlockingQueueHandler] = None
+_output: Optional[logging.Handler] = None
+
+def configure_logging(level: str = "INFO") -> None:
+    """
+    Route all logging through a bounded queue drained by a background thread.
+
+    LOG_FORMAT=json (default) or text picks the output format,
+    LOG_INFO_SAMPLE_RATE keeps that fraction of INFO lines and LOG_QUEUE_SIZE
+    bounds memory when the output cannot keep up. Safe to call more than once.
+    """
+    global _listener, _handler, _output
+    shutdown_logging()
+
+    if os.getenv("LOG_FORMAT", "json").lower() == "json":
+        formatter: logging.Formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message)s")
+    _output = logging.StreamHandler(sys.stdout)
+    _output.setFormatter(formatter)
+    _output.addFilter(RequestContextFilter())
+
+    log_queue: queue.Queue = queue.Queue(maxsize=int(os.getenv("LOG_QUEUE_SIZE", "10000")))
+    _handler = NonBlockingQueueHandler(log_queue)
+    _handler.addFilter(RequestContextFilter())
+    _handler.addFilter(SamplingFilter(float(os.getenv("LOG_INFO_SAMPLE_RATE", "1.0"))))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(_handler)
+    # Level gating happens before any record is built, so disabled lines cost one comparison
+    root.setLevel(getattr(logging, level.upper(), logging.INFO))
+
+    _listener = QueueListener(log_queue, _output, respect_handler_level=True)
+    _listener.start()
+
+def shutdown_logging() -> None:
+    """
+    Flush queued records and stop the listener thread. Anything logged
+    afterwards (e.g. by the server on its way out) is written directly.
+    """
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    _listener = None
+    root = logging.getLogger()
+    root.removeHandler(_handler)
+    root.addHandler(_output)
+
+def dropped_records() -> int:
+    return _handler.dropped if _handler is not None else 0
+
+atexit.register(shutdown_logging)
+
+class RequestIdMiddleware:
+    """
+    ASGI middleware that sets the request ID for the whole request, streamed
+    bodies included, and echoes it in the X-Request-ID response header. A
+    well-formed incoming X-Request-ID is reused so IDs follow the request
+    across services.
+    """
+
+    header = b"x-request-id"
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope.get("headers", []):
+            if name == self.header:
+                candidate = value.decode("latin-1")
+                if 0 < len(candidate) <= 128 and candidate.isprintable():
+                    request_id = candidate
+                break
+        request_id = request_id or new_request_id()
+        token = request_id_var.set(request_id)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(self.header, request_id.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
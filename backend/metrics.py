@@ -0,0 +1,393 @@
+"""
+Metrics Module
+Low-overhead counters and histograms with Prometheus exposition and optional tracing spans
+"""
+import asyncio
+import fcntl
+import glob
+import json
+import logging
+import math
+import os
+import socket
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # Tracing is optional
+    otel_trace = None
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from sub-millisecond processing stages up to
+# long LLM generations
+DEFAULT_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _label_text(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _series_key(labels: Tuple[str, ...]) -> str:
+    # Snapshot files are JSON objects, so label values are stored as a JSON
+    # list; label values may contain any character
+    return json.dumps(labels)
+
+def _series_labels(key: str) -> Tuple[str, ...]:
+    return tuple(json.loads(key))
+
+def _format(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+class Counter:
+    """Monotonic counter, optionally split by label values"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, *labels: str) -> None:
+        self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def snapshot(self) -> dict:
+        return {_series_key(labels): value for labels, value in self._values.items()}
+
+    def render(self, series: Dict[str, float]) -> List[str]:
+        lines = []
+        for key, value in sorted(series.items()):
+            labels = _series_labels(key)
+            lines.append(f"{self.name}{_label_text(self.labelnames, labels)} {_format(value)}")
+        return lines
+
+class Histogram:
+    """
+    Fixed-bucket histogram.
+
+    observe() is a bisect over the bucket bounds and two additions on plain
+    lists; cumulative counts are only computed at exposition time.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            # [per-bucket counts, sum]
+            series = self._series[labels] = [[0] * len(self.buckets), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def snapshot(self) -> dict:
+        return {_series_key(labels): [list(counts), total] for labels, (counts, total) in self._series.items()}
+
+    def render(self, series: Dict[str, list]) -> List[str]:
+        lines = []
+        for key, (counts, total) in sorted(series.items()):
+            labels = _series_labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = 'le="' + _format(bound) + '"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, labels)} {_format(total)}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, labels)} {cumulative}")
+        return lines
+
+class Registry:
+    """
+    The metrics of one worker process.
+
+    Metrics are only updated from the worker's event loop thread, so there
+    are no locks on the hot path. With METRICS_DIR set, every worker writes
+    a snapshot file there periodically and /metrics on any worker merges all
+    of them, so a scrape sees the whole server rather than one worker.
+
+    Snapshots of workers that have exited (their pid is gone, or for another
+    host their file is older than METRICS_STALE_SECONDS) are folded into one
+    archive file and deleted, so recycled workers don't pile up files. Only
+    counters and histograms are folded: their totals must not drop when a
+    worker exits. Any other kind of metric describes a live process and is
+    discarded with it.
+    """
+
+    ARCHIVE = "archive.json"
+    LOCK = ".lock"
+    CUMULATIVE_KINDS = ("counter", "histogram")
+
+    def __init__(self, directory: Optional[str] = None, flush_interval: Optional[float] = None):
+        self.directory = directory if directory is not None else os.getenv("METRICS_DIR")
+        self.flush_interval = flush_interval or float(os.getenv("METRICS_FLUSH_INTERVAL_SECONDS", "5"))
+        self.stale_after = float(os.getenv("METRICS_STALE_SECONDS", "600"))
+        self.hostname = socket.gethostname()
+        self._metrics: Dict[str, object] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics[name] = metric
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics[name] = metric
+        return metric
+
+    def snapshot(self) -> Dict[str, dict]:
+        return {name: metric.snapshot() for name, metric in self._metrics.items()}
+
+    def _snapshot_path(self) -> str:
+        return os.path.join(self.directory, f"worker-{self.hostname}-{os.getpid()}.json")
+
+    def flush(self) -> None:
+        """Write this worker's snapshot atomically into METRICS_DIR"""
+        if not self.directory:
+            return
+        path = self._snapshot_path()
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _add(merged: Dict[str, dict], snapshot: Dict[str, dict]) -> None:
+        for name, series in snapshot.items():
+            target = merged.setdefault(name, {})
+            for key, value in series.items():
+                if isinstance(value, list):
+                    if key in target:
+                        counts, total = target[key]
+                        target[key] = [[a + b for a, b in zip(counts, value[0])], total + value[1]]
+                    else:
+                        target[key] = value
+                else:
+                    target[key] = target.get(key, 0.0) + value
+
+    @staticmethod
+    def _load(path: str) -> Optional[Dict[str, dict]]:
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _exited(self, path: str, now: float) -> bool:
+        """Whether the worker that wrote a snapshot file is gone"""
+        host, _, pid = os.path.basename(path)[len("worker-"):-len(".json")].rpartition("-")
+        if host == self.hostname and pid.isdigit():
+            try:
+                os.kill(int(pid), 0)
+            except ProcessLookupError:
+                return True
+            except PermissionError:
+                pass
+            return False
+        try:
+            return now - os.path.getmtime(path) > self.stale_after
+        except OSError:
+            return False
+
+    def _fold_exited(self) -> None:
+        """Move the cumulative series of exited workers into the archive; caller holds the lock exclusively"""
+        now = time.time()
+        exited = [path for path in glob.glob(os.path.join(self.directory, "worker-*.json")) if self._exited(path, now)]
+        if not exited:
+            return
+        archive_path = os.path.join(self.directory, self.ARCHIVE)
+        archive = self._load(archive_path) or {}
+        for path in exited:
+            snapshot = self._load(path) or {}
+            metrics = self._metrics
+            self._add(archive, {
+                name: series for name, series in snapshot.items()
+                if name not in metrics or metrics[name].kind in self.CUMULATIVE_KINDS
+            })
+        tmp_path = archive_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(archive, f)
+        os.replace(tmp_path, archive_path)
+        for path in exited:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _merged(self) -> Dict[str, dict]:
+        if not self.directory:
+            return self.snapshot()
+        self.flush()
+        # Readers share the lock; folding takes it exclusively so no scrape
+        # counts a worker both in its own file and in the archive
+        with open(os.path.join(self.directory, self.LOCK), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._fold_exited()
+            except OSError as e:
+                logger.warning("Failed to fold exited workers' metrics: %s", e)
+            fcntl.flock(lock, fcntl.LOCK_SH)
+            merged: Dict[str, dict] = {}
+            paths = glob.glob(os.path.join(self.directory, "worker-*.json"))
+            for path in paths + [os.path.join(self.directory, self.ARCHIVE)]:
+                snapshot = self._load(path)
+                if snapshot is not None:
+                    self._add(merged, snapshot)
+        return merged
+
+    @classmethod
+    def clear_directory(cls, directory: Optional[str]) -> None:
+        """Remove every snapshot from directory; call before any worker starts"""
+        if not directory:
+            return
+        for path in glob.glob(os.path.join(directory, "worker-*.json*")) + glob.glob(os.path.join(directory, cls.ARCHIVE + "*")):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def render(self) -> str:
+        """Prometheus text exposition of every metric"""
+        merged = self._merged()
+        lines = []
+        for name, metric in self._metrics.items():
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render(merged.get(name, {})))
+        return "\n".join(lines) + "\n"
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                logger.warning("Failed to write metrics snapshot: %s", e)
+
+    def start(self) -> None:
+        """Start periodic snapshot flushing when METRICS_DIR is set"""
+        if self.directory and (self._task is None or self._task.done()):
+            os.makedirs(self.directory, exist_ok=True)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            self.flush()
+        except OSError:
+            pass
+
+REGISTRY = Registry()
+
+PROCESS_INPUT_SECONDS = REGISTRY.histogram(
+    "process_input_seconds", "Time spent in the input processing pipeline")
+PROCESS_RESPONSE_SECONDS = REGISTRY.histogram(
+    "process_response_seconds", "Time spent in the response processing pipeline")
+PIPELINE_STAGE_SECONDS = REGISTRY.histogram(
+    "pipeline_stage_seconds", "Time spent in each processing pipeline stage", ("pipeline", "stage"))
+LLM_REQUEST_SECONDS = REGISTRY.histogram(
+    "llm_request_seconds", "Total time to get an AI response, including cache and queueing", ("mode",))
+LLM_TTFT_SECONDS = REGISTRY.histogram(
+    "llm_ttft_seconds", "Time from request to the first streamed AI token")
+DB_WRITE_SECONDS = REGISTRY.histogram(
+    "db_write_seconds", "Database write latency", ("operation",))
+AUTH_VERIFY_SECONDS = REGISTRY.histogram(
+    "auth_verify_seconds", "Session token verification latency", ("result",),
+    buckets=(0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05))
+LLM_TOKENS = REGISTRY.counter(
+    "llm_tokens_total", "Tokens reported by the upstream usage field", ("direction",))
+RESPONSE_CACHE_LOOKUPS = REGISTRY.counter(
+    "response_cache_lookups_total", "Response cache lookups by result", ("result",))
+LLM_UPSTREAM_ERRORS = REGISTRY.counter(
+    "llm_upstream_errors_total", "Failed upstream LLM calls by backend and status", ("backend", "status"))
+ANALYSIS_ROWS = REGISTRY.counter(
+    "analysis_rows_total", "Stored inputs analyzed and marked processed by the analysis worker")
+ANALYSIS_FAILURES = REGISTRY.counter(
+    "analysis_failures_total", "Analysis runs with a failed stage; the input stays unprocessed for retry")
+ANALYSIS_BATCH_SECONDS = REGISTRY.histogram(
+    "analysis_batch_seconds", "Time to claim, analyze and write back one batch of stored inputs")
+ANALYSIS_LAG_SECONDS = REGISTRY.histogram(
+    "analysis_lag_seconds", "Time from an input being stored to it being analyzed",
+    buckets=(1.0, 5.0, 15.0, 30.0, 60.0, 300.0, 900.0, 1800.0, 3600.0, 21600.0, 86400.0))
+RATE_LIMITED = REGISTRY.counter(
+    "rate_limited_total", "Requests refused by the rate limiter by exhausted limit", ("limit",))
+CHAT_ABORTED = REGISTRY.counter(
+    "chat_requests_aborted_total", "Chat requests abandoned before completion by reason and stage", ("reason", "stage"))
+LLM_UPSTREAM_CONNECTIONS = REGISTRY.counter(
+    "llm_upstream_connections_total", "New connections opened to each LLM backend", ("backend",))
+LLM_UPSTREAM_CONNECT_SECONDS = REGISTRY.histogram(
+    "llm_upstream_connect_seconds", "TCP connect plus TLS handshake time for new LLM backend connections", ("backend",))
+
+_tracer = None
+_tracing = os.getenv("METRICS_TRACING", "false").lower() == "true"
+if _tracing and otel_trace is None:
+    logger.warning("METRICS_TRACING is set but opentelemetry is not installed, spans disabled")
+    _tracing = False
+
+def span(name: str, **attributes):
+    """
+    OpenTelemetry span around a block when METRICS_TRACING=true and the SDK
+    is installed, otherwise a no-op context manager.
+    """
+    global _tracer
+    if not _tracing:
+        return nullcontext()
+    if _tracer is None:
+        _tracer = otel_trace.get_tracer("notatherapist.backend")
+    return _tracer.start_as_current_span(name, attributes=attributes or None)
+
+@contextmanager
+def timed(histogram: Histogram, *labels: str, span_name: Optional[str] = None) -> Iterator[None]:
+    """Observe the block's duration in histogram, inside a tracing span if enabled"""
+    with span(span_name) if span_name else nullcontext():
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            histogram.observe(time.perf_counter() - start, *labels)
+
+def error_status(error: BaseException) -> str:
+    """Label for an upstream failure: the HTTP status if there was one, else the error kind"""
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return str(status)
+    name = type(error).__name__
+    if "Timeout" in name:
+        return "timeout"
+    if "Connection" in name:
+        return "connection"
+    return "other"
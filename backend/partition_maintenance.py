@@ -0,0 +1,221 @@
+"""
+Partition Maintenance Module
+Creates future input_table partitions and retires expired ones to compressed archives
+"""
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+import re
+import sys
+from dataclasses import dataclass, field
+from datetime import date, datetime, timezone
+from typing import List, Optional
+
+import asyncpg
+
+from database import Database
+
+logger = logging.getLogger(__name__)
+
+PARTITION_PATTERN = re.compile(r"^input_table_p(\d{4})(\d{2})$")
+
+# Only one maintenance run at a time across every host pointing at the database
+ADVISORY_LOCK_SQL = "SELECT pg_try_advisory_lock(hashtext('input_table_partition_maintenance'))"
+ADVISORY_UNLOCK_SQL = "SELECT pg_advisory_unlock(hashtext('input_table_partition_maintenance'))"
+
+ENSURE_PARTITIONS_SQL = "SELECT ensure_input_partitions((now() AT TIME ZONE 'UTC')::date, $1)"
+
+ATTACHED_PARTITIONS_SQL = """
+    SELECT c.relname
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'input_table'::regclass
+"""
+
+# Monthly tables that are no longer attached: detached by an earlier run
+# whose archive or drop did not complete
+DETACHED_PARTITIONS_SQL = """
+    SELECT c.relname
+    FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE c.relkind = 'r'
+      AND n.nspname = current_schema()
+      AND c.relname ~ '^input_table_p[0-9]{6}$'
+      AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid)
+"""
+
+DEFAULT_PARTITION_ROWS_SQL = "SELECT count(*) FROM (SELECT 1 FROM input_table_default LIMIT 1000) rows"
+
+def partition_month(name: str) -> Optional[date]:
+    """First day of the month a partition covers, or None for non-monthly tables"""
+    match = PARTITION_PATTERN.match(name)
+    if match is None:
+        return None
+    return date(int(match.group(1)), int(match.group(2)), 1)
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+@dataclass
+class MaintenanceReport:
+    created: int = 0
+    detached: List[str] = field(default_factory=list)
+    archived: List[str] = field(default_factory=list)
+    dropped: List[str] = field(default_factory=list)
+    default_rows: int = 0
+    skipped: bool = False
+
+class PartitionMaintainer:
+    """
+    Keeps input_table's monthly partitions in shape.
+
+    Each run creates partitions PARTITION_MONTHS_AHEAD months into the
+    future, so inserts never land in the default partition, and detaches
+    every partition older than PARTITION_RETENTION_MONTHS full months.
+    Detached partitions are written as gzipped CSV to PARTITION_ARCHIVE_DIR
+    and dropped when that is set, dropped without an archive when
+    PARTITION_DROP_EXPIRED=true, and otherwise left as standalone tables.
+    Runs are serialized with an advisory lock, and a run that finds work
+    left over by an interrupted one picks it up.
+    """
+
+    def __init__(
+        self,
+        database: Optional[Database] = None,
+        months_ahead: Optional[int] = None,
+        retention_months: Optional[int] = None,
+        archive_dir: Optional[str] = None,
+        drop_expired: Optional[bool] = None,
+        lock_timeout: Optional[str] = None,
+    ):
+        self.database = database or Database()
+        self.months_ahead = months_ahead if months_ahead is not None else int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+        self.retention_months = retention_months if retention_months is not None else int(os.getenv("PARTITION_RETENTION_MONTHS", "12"))
+        self.archive_dir = archive_dir if archive_dir is not None else os.getenv("PARTITION_ARCHIVE_DIR")
+        self.drop_expired = drop_expired if drop_expired is not None else os.getenv("PARTITION_DROP_EXPIRED", "false").lower() == "true"
+        # DETACH briefly takes an exclusive lock on input_table; give up rather
+        # than queue behind a long query and stall every writer behind us
+        self.lock_timeout = lock_timeout or os.getenv("PARTITION_LOCK_TIMEOUT", "5s")
+
+    def cutoff(self, today: Optional[date] = None) -> date:
+        """Partitions for months before this one are expired"""
+        today = today or datetime.now(timezone.utc).date()
+        return add_months(today.replace(day=1), -self.retention_months)
+
+    async def run(self, dry_run: bool = False) -> MaintenanceReport:
+        report = MaintenanceReport()
+        conn = await self.database.connect_single()
+        try:
+            if not await conn.fetchval(ADVISORY_LOCK_SQL):
+                logger.info("Another partition maintenance run holds the lock, skipping")
+                report.skipped = True
+                return report
+            try:
+                await self._run_locked(conn, report, dry_run)
+            finally:
+                await conn.fetchval(ADVISORY_UNLOCK_SQL)
+        finally:
+            await conn.close()
+        return report
+
+    async def _run_locked(self, conn: asyncpg.Connection, report: MaintenanceReport, dry_run: bool) -> None:
+        await conn.execute(f"SET lock_timeout = '{self.lock_timeout}'")
+
+        if not dry_run:
+            report.created = await conn.fetchval(ENSURE_PARTITIONS_SQL, self.months_ahead)
+
+        cutoff = self.cutoff()
+        attached = [row["relname"] for row in await conn.fetch(ATTACHED_PARTITIONS_SQL)]
+        for name in sorted(attached):
+            month = partition_month(name)
+            if month is not None and month < cutoff:
+                report.detached.append(name)
+                if not dry_run:
+                    await conn.execute(f'ALTER TABLE input_table DETACH PARTITION "{name}"')
+                    logger.info("Detached expired partition %s", name)
+
+        detached = sorted(row["relname"] for row in await conn.fetch(DETACHED_PARTITIONS_SQL))
+        if dry_run:
+            detached = sorted(set(detached) | set(report.detached))
+        for name in detached:
+            month = partition_month(name)
+            if month is None or month >= cutoff:
+                continue
+            if self.archive_dir:
+                if not dry_run:
+                    path = await self.archive(conn, name)
+                    logger.info("Archived partition %s to %s", name, path)
+                report.archived.append(name)
+            if self.archive_dir or self.drop_expired:
+                if not dry_run:
+                    await conn.execute(f'DROP TABLE "{name}"')
+                    logger.info("Dropped partition %s", name)
+                report.dropped.append(name)
+
+        # ensure_input_partitions moves rows out of the default partition, so
+        # anything left here arrived after it ran
+        report.default_rows = await conn.fetchval(DEFAULT_PARTITION_ROWS_SQL)
+        if report.default_rows:
+            logger.warning(
+                "input_table_default holds %s%s rows outside the monthly partitions; "
+                "the next run moves them into partitions for their months",
+                report.default_rows, "+" if report.default_rows >= 1000 else ""
+            )
+
+    async def archive(self, conn: asyncpg.Connection, name: str) -> str:
+        """
+        Stream a table to <archive_dir>/<name>.csv.gz with COPY.
+
+        The file only appears under its final name once it is complete and
+        synced, so a crash mid-archive never leaves a truncated archive that
+        looks finished, and the table is only dropped after that.
+        """
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, f"{name}.csv.gz")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as raw:
+            with gzip.GzipFile(filename=f"{name}.csv", mode="wb", fileobj=raw) as compressed:
+                async def write(chunk: bytes) -> None:
+                    compressed.write(chunk)
+                await conn.copy_from_table(name, output=write, format="csv", header=True)
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp_path, path)
+        return path
+
+async def _main(args: argparse.Namespace) -> int:
+    maintainer = PartitionMaintainer()
+    # A failed run (say, the database is still starting) is retried well
+    # before the next scheduled one
+    retry_delay = float(os.getenv("PARTITION_RETRY_SECONDS", "300"))
+    while True:
+        delay = args.interval
+        try:
+            report = await maintainer.run(dry_run=args.dry_run)
+            logger.info(
+                "Partition maintenance%s: created %s, detached %s, archived %s, dropped %s",
+                " (dry run)" if args.dry_run else "", report.created,
+                report.detached, report.archived, report.dropped
+            )
+        except (asyncpg.PostgresError, OSError) as e:
+            logger.error("Partition maintenance failed: %s", e)
+            if not args.interval:
+                return 1
+            delay = min(args.interval, retry_delay)
+        if not args.interval:
+            return 0
+        await asyncio.sleep(delay)
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Create upcoming input_table partitions and retire expired ones")
+    parser.add_argument("--dry-run", action="store_true", help="report what would change without changing anything")
+    parser.add_argument("--interval", type=float, help="keep running, once every INTERVAL seconds")
+    args = parser.parse_args()
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper(), format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    return asyncio.run(_main(args))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""
+Pipeline Module
+Dependency-aware async stage engine used by the input and response processors
+"""
+import asyncio
+import contextvars
+import functools
+import inspect
+import logging
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from metrics import PIPELINE_STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Where a stage runs: awaited on the loop, called inline on the loop,
+# offloaded to the shared thread pool, or to the shared process pool
+MODE_ASYNC = "async"
+MODE_INLINE = "inline"
+MODE_THREAD = "thread"
+MODE_PROCESS = "process"
+
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+class PipelineError(Exception):
+    """Raised for invalid pipeline definitions"""
+
+class StageFailedError(Exception):
+    """Raised when a fail-closed stage errors or times out"""
+
+    def __init__(self, stage: str, error: BaseException):
+        super().__init__(f"Pipeline stage '{stage}' failed: {error!r}")
+        self.stage = stage
+        self.error = error
+
+@dataclass
+class Stage:
+    """
+    One pipeline step.
+
+    fn is called as fn(text, deps) where deps maps each declared dependency
+    to its result. Its return value becomes the stage result; for a
+    transforming stage it must be the new text. Process-mode functions and
+    their inputs must be picklable.
+    """
+    name: str
+    fn: Callable[[str, Dict[str, Any]], Any]
+    depends_on: Tuple[str, ...] = ()
+    transforms: bool = False
+    mode: Optional[str] = None
+    timeout: Optional[float] = None
+    fail_open: bool = True
+    default: Any = None
+
+@dataclass
+class StageStats:
+    calls: int = 0
+    failures: int = 0
+    timeouts: int = 0
+    total_seconds: float = 0.0
+    max_seconds: float = 0.0
+
+@dataclass
+class PipelineResult:
+    text: str
+    results: Dict[str, Any] = field(default_factory=dict)
+    timings: Dict[str, float] = field(default_factory=dict)
+    errors: Dict[str, str] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+def _executor(mode: str) -> Executor:
+    global _thread_pool, _process_pool
+    if mode == MODE_THREAD:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(
+                max_workers=int(os.getenv("PIPELINE_THREAD_WORKERS", "4")),
+                thread_name_prefix="pipeline"
+            )
+        return _thread_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=int(os.getenv("PIPELINE_PROCESS_WORKERS", "2")))
+    return _process_pool
+
+def shutdown_executors() -> None:
+    """Stop the shared stage pools; called on application shutdown"""
+    global _thread_pool, _process_pool
+    for pool in (_thread_pool, _process_pool):
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+    _thread_pool = None
+    _process_pool = None
+
+class Pipeline:
+    """
+    Runs registered stages as a dependency graph.
+
+    Every stage starts as soon as the stages it depends on have finished, so
+    independent stages overlap and a request pays for the slowest path
+    through the graph rather than the sum of all stages. Each stage has its
+    own timeout; a fail-open stage that errors or times out records the
+    error, yields its default and lets the rest of the pipeline continue,
+    while a fail-closed stage aborts the run with StageFailedError.
+
+    Transforming stages rewrite the text and must be totally ordered by
+    their dependencies. A stage sees the text produced by the latest
+    transforming stage among its ancestors, or the original text if it has
+    none, so analysis stages can run on the raw input alongside transforms.
+    """
+
+    def __init__(self, name: str, default_timeout: Optional[float] = None):
+        self.name = name
+        self.default_timeout = default_timeout or float(os.getenv("PIPELINE_STAGE_TIMEOUT", "2.0"))
+        self._stages: Dict[str, Stage] = {}
+        self._order: List[str] = []
+        self._text_source: Dict[str, Optional[str]] = {}
+        self._final_transform: Optional[str] = None
+        self._stats: Dict[str, StageStats] = {}
+        self.runs = 0
+        self.total_seconds = 0.0
+
+    def add_stage(self, stage: Stage) -> Stage:
+        """Register a stage; dependencies must already be registered"""
+        if stage.name in self._stages:
+            raise PipelineError(f"Stage '{stage.name}' is already registered in pipeline '{self.name}'")
+        for dependency in stage.depends_on:
+            if dependency not in self._stages:
+                raise PipelineError(f"Stage '{stage.name}' depends on unknown stage '{dependency}'")
+        if stage.mode is None:
+            stage.mode = MODE_ASYNC if inspect.iscoroutinefunction(stage.fn) else MODE_INLINE
+        if stage.mode not in (MODE_ASYNC, MODE_INLINE, MODE_THREAD, MODE_PROCESS):
+            raise PipelineError(f"Stage '{stage.name}' has unknown mode '{stage.mode}'")
+
+        ancestors = self._ancestors(stage.depends_on)
+        if stage.transforms and self._final_transform is not None and self._final_transform not in ancestors:
+            raise PipelineError(
+                f"Transforming stage '{stage.name}' must depend on '{self._final_transform}'"
+            )
+
+        # Registration order is a topological order, so the latest transform
+        # among a stage's ancestors is the one whose output it reads
+        source = None
+        for name in self._order:
+            if name in ancestors and self._stages[name].transforms:
+                source = name
+
+        self._stages[stage.name] = stage
+        self._order.append(stage.name)
+        self._text_source[stage.name] = source
+        self._stats[stage.name] = StageStats()
+        if stage.transforms:
+            self._final_transform = stage.name
+        return stage
+
+    def stage(self, name: str, **options) -> Callable:
+        """Decorator form of add_stage"""
+        def register(fn: Callable) -> Callable:
+            self.add_stage(Stage(name=name, fn=fn, **options))
+            return fn
+        return register
+
+    def _ancestors(self, names: Tuple[str, ...]) -> set:
+        seen = set()
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name not in seen:
+                seen.add(name)
+                pending.extend(self._stages[name].depends_on)
+        return seen
+
+    async def _call(self, stage: Stage, text: str, deps: Dict[str, Any]) -> Any:
+        if stage.mode == MODE_ASYNC:
+            return await stage.fn(text, deps)
+        if stage.mode == MODE_INLINE:
+            return stage.fn(text, deps)
+        # A timed-out pool call stops being awaited but still runs to completion
+        loop = asyncio.get_running_loop()
+        if stage.mode == MODE_THREAD:
+            # Carry context variables (e.g. the request ID) into the worker thread
+            call = functools.partial(contextvars.copy_context().run, stage.fn, text, deps)
+            return await loop.run_in_executor(_executor(stage.mode), call)
+        return await loop.run_in_executor(_executor(stage.mode), stage.fn, text, deps)
+
+    async def _run_stage(self, stage: Stage, tasks: Dict[str, asyncio.Task], result: PipelineResult, texts: Dict[str, str]) -> None:
+        if stage.depends_on:
+            await asyncio.gather(*(tasks[name] for name in stage.depends_on))
+
+        source = self._text_source[stage.name]
+        text = texts[source] if source is not None else result.text
+        deps = {name: result.results.get(name) for name in stage.depends_on}
+        stats = self._stats[stage.name]
+        timeout = stage.timeout or self.default_timeout
+
+        start = time.perf_counter()
+        try:
+            value = await asyncio.wait_for(self._call(stage, text, deps), timeout=timeout)
+        except Exception as e:
+            if isinstance(e, asyncio.TimeoutError):
+                stats.timeouts += 1
+                e = asyncio.TimeoutError(f"timed out after {timeout}s")
+            stats.failures += 1
+            result.errors[stage.name] = str(e) or type(e).__name__
+            if not stage.fail_open:
+                raise StageFailedError(stage.name, e) from e
+            logger.warning("Pipeline %s stage %s failed open: %r", self.name, stage.name, e)
+            value = text if stage.transforms else stage.default
+        finally:
+            elapsed = time.perf_counter() - start
+            stats.calls += 1
+            stats.total_seconds += elapsed
+            stats.max_seconds = max(stats.max_seconds, elapsed)
+            result.timings[stage.name] = elapsed
+            PIPELINE_STAGE_SECONDS.observe(elapsed, self.name, stage.name)
+
+        result.results[stage.name] = value
+        if stage.transforms:
+            texts[stage.name] = value
+
+    async def run(self, text: str) -> PipelineResult:
+        """Run all stages on text and return the final text with per-stage results"""
+        start = time.perf_counter()
+        result = PipelineResult(text=text)
+        texts: Dict[str, str] = {}
+        tasks: Dict[str, asyncio.Task] = {}
+        for name in self._order:
+            tasks[name] = asyncio.ensure_future(self._run_stage(self._stages[name], tasks, result, texts))
+
+        try:
+            await asyncio.gather(*tasks.values())
+        finally:
+            for task in tasks.values():
+                if not task.done():
+                    task.cancel()
+
+        if self._final_transform is not None:
+            result.text = texts[self._final_transform]
+        result.elapsed = time.perf_counter() - start
+        self.runs += 1
+        self.total_seconds += result.elapsed
+        return result
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "runs": self.runs,
+            "avg_ms": round(self.total_seconds * 1000 / self.runs, 3) if self.runs else 0.0,
+            "stages": {
+                name: {
+                    "mode": self._stages[name].mode,
+                    "depends_on": list(self._stages[name].depends_on),
+                    "calls": stats.calls,
+                    "failures": stats.failures,
+                    "timeouts": stats.timeouts,
+                    "avg_ms": round(stats.total_seconds * 1000 / stats.calls, 3) if stats.calls else 0.0,
+                    "max_ms": round(stats.max_seconds * 1000, 3),
+                }
+                for name, stats in self._stats.items()
+            },
+        }
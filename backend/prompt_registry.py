@@ -0,0 +1,281 @@
+"""
+Prompt Registry Module
+Named, versioned prompt profiles with A/B selection and hot reload
+"""
+import json
+import logging
+import os
+import signal
+import zlib
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SYSTEM_PROMPT = "You are NotATherapist, a helpful AI assistant. Be friendly, empathetic, and supportive in your responses."
+DEFAULT_INPUT_SUFFIX = "\n\n<<also tell a joke in whatever language the initial prompt was in>>"
+DEFAULT_RESPONSE_SUFFIX = "\n\nI hope you liked the joke!"
+
+class PromptConfigError(ValueError):
+    """Raised for an invalid prompt profile file"""
+
+@dataclass(frozen=True)
+class PromptProfile:
+    """
+    Everything that shapes one kind of model request.
+
+    The system message, sampling parameters and cache scope are built once
+    when the profile is loaded, so assembling a request is a dict merge.
+    """
+    name: str
+    version: str
+    system_prompt: str
+    input_suffix: str
+    response_suffix: str
+    model: str
+    max_tokens: int
+    temperature: float
+    top_p: float = 1.0
+    presence_penalty: float = 0.0
+    frequency_penalty: float = 0.0
+    timeout: float = 30.0
+    _system_message: Dict[str, str] = field(init=False, repr=False, compare=False)
+    _sampling: Dict[str, Any] = field(init=False, repr=False, compare=False)
+    _cache_scope: Dict[str, Any] = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        sampling = {
+            "model": self.model,
+            "max_tokens": self.max_tokens,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "presence_penalty": self.presence_penalty,
+            "frequency_penalty": self.frequency_penalty,
+        }
+        object.__setattr__(self, "_system_message", {"role": "system", "content": self.system_prompt})
+        object.__setattr__(self, "_sampling", {**sampling, "timeout": self.timeout})
+        # Responses generated under another prompt version must not be served from cache
+        object.__setattr__(self, "_cache_scope", {**sampling, "profile": self.label})
+
+    @property
+    def label(self) -> str:
+        return f"{self.name}@{self.version}"
+
+    @property
+    def cache_scope(self) -> Dict[str, Any]:
+        return self._cache_scope
+
+    def completion_params(self, message: str, history: Optional[List[dict]] = None) -> dict:
+        """Chat completion arguments for a user message and optional prior turns"""
+        return {
+            **self._sampling,
+            "messages": [self._system_message, *(history or []), {"role": "user", "content": message}],
+        }
+
+def _env_profile() -> PromptProfile:
+    """The built-in profile, configured by the LLM_* environment variables"""
+    return PromptProfile(
+        name="default",
+        version=os.getenv("PROMPT_DEFAULT_VERSION", "1"),
+        system_prompt=DEFAULT_SYSTEM_PROMPT,
+        input_suffix=DEFAULT_INPUT_SUFFIX,
+        response_suffix=DEFAULT_RESPONSE_SUFFIX,
+        model=os.getenv("LLM_MODEL", "openai/gpt-oss-120b"),
+        max_tokens=int(os.getenv("LLM_MAX_TOKENS", "1000")),
+        temperature=float(os.getenv("LLM_TEMPERATURE", "0.7")),
+        timeout=float(os.getenv("LLM_TIMEOUT", "30")),
+    )
+
+_FIELD_TYPES = {
+    "version": (str, int),
+    "system_prompt": str,
+    "input_suffix": str,
+    "response_suffix": str,
+    "model": str,
+    "max_tokens": int,
+    "temperature": (int, float),
+    "top_p": (int, float),
+    "presence_penalty": (int, float),
+    "frequency_penalty": (int, float),
+    "timeout": (int, float),
+}
+
+def _parse_profile(name: str, entry: Any, base: PromptProfile) -> PromptProfile:
+    if not isinstance(entry, dict):
+        raise PromptConfigError(f"Profile '{name}' must be an object")
+    unknown = set(entry) - set(_FIELD_TYPES)
+    if unknown:
+        raise PromptConfigError(f"Profile '{name}' has unknown fields: {', '.join(sorted(unknown))}")
+    if "version" not in entry:
+        raise PromptConfigError(f"Profile '{name}' needs a version")
+    for key, value in entry.items():
+        if isinstance(value, bool) or not isinstance(value, _FIELD_TYPES[key]):
+            raise PromptConfigError(f"Profile '{name}' field '{key}' has the wrong type")
+    # Unset fields fall back to the built-in profile
+    values = {key: getattr(base, key) for key in _FIELD_TYPES}
+    values.update(entry)
+    values["version"] = str(values["version"])
+    if values["max_tokens"] <= 0 or values["timeout"] <= 0:
+        raise PromptConfigError(f"Profile '{name}' needs positive max_tokens and timeout")
+    if not 0 <= values["temperature"] <= 2 or not 0 < values["top_p"] <= 1:
+        raise PromptConfigError(f"Profile '{name}' has temperature or top_p out of range")
+    return PromptProfile(name=name, **values)
+
+@dataclass(frozen=True)
+class _Config:
+    profiles: Dict[str, PromptProfile]
+    default: str
+    experiment: Optional[str] = None
+    variants: Tuple[Tuple[str, int], ...] = ()
+
+def parse_config(raw: Any) -> _Config:
+    """
+    Validate a profile file:
+
+        {
+          "default": "standard",
+          "profiles": {"standard": {"version": "3", "system_prompt": "...", ...}, ...},
+          "experiment": {"name": "shorter-replies", "variants": {"standard": 90, "concise": 10}}
+        }
+
+    Profile fields left out take the built-in defaults. The experiment is
+    optional; its variants are profile names with integer weights.
+    """
+    if not isinstance(raw, dict) or not isinstance(raw.get("profiles"), dict) or not raw["profiles"]:
+        raise PromptConfigError("Prompt config needs a non-empty 'profiles' object")
+    base = _env_profile()
+    profiles = {name: _parse_profile(name, entry, base) for name, entry in raw["profiles"].items()}
+
+    default = raw.get("default", next(iter(profiles)))
+    if default not in profiles:
+        raise PromptConfigError(f"Default profile '{default}' is not defined")
+
+    experiment = raw.get("experiment")
+    if experiment is None:
+        return _Config(profiles, default)
+    if not isinstance(experiment, dict) or not isinstance(experiment.get("name"), str) or not isinstance(experiment.get("variants"), dict):
+        raise PromptConfigError("Experiment needs a 'name' and a 'variants' object")
+    variants = []
+    for name, weight in experiment["variants"].items():
+        if name not in profiles:
+            raise PromptConfigError(f"Experiment variant '{name}' is not a defined profile")
+        if isinstance(weight, bool) or not isinstance(weight, int) or weight < 0:
+            raise PromptConfigError(f"Experiment variant '{name}' needs a non-negative integer weight")
+        if weight:
+            variants.append((name, weight))
+    if not variants:
+        raise PromptConfigError("Experiment needs at least one variant with a positive weight")
+    return _Config(profiles, default, experiment["name"], tuple(variants))
+
+class PromptRegistry:
+    """
+    Prompt profiles loaded from PROMPT_PROFILES_FILE, or the built-in profile
+    when it is unset.
+
+    The file is validated when the registry is created, so a bad file stops
+    startup. reload() (wired to SIGHUP) re-reads it and swaps the whole
+    configuration at once; a file that fails validation is logged and the
+    previous configuration stays in use. select() picks a profile by name,
+    else by the client's stable A/B bucket, else the default.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path if path is not None else os.getenv("PROMPT_PROFILES_FILE")
+        self.reloads = 0
+        self.reload_failures = 0
+        self._config = self._load()
+
+    def _load(self) -> _Config:
+        if not self.path:
+            profile = _env_profile()
+            return _Config({profile.name: profile}, profile.name)
+        try:
+            with open(self.path) as f:
+                raw = json.load(f)
+        except (OSError, ValueError) as e:
+            raise PromptConfigError(f"Cannot read prompt profiles from {self.path}: {e}") from e
+        return parse_config(raw)
+
+    def reload(self) -> bool:
+        """Re-read the profile file; returns False and keeps the old profiles if it is invalid"""
+        try:
+            config = self._load()
+        except PromptConfigError as e:
+            self.reload_failures += 1
+            logger.error("Prompt profile reload failed, keeping the current profiles: %s", e)
+            return False
+        self._config = config
+        self.reloads += 1
+        logger.info("Reloaded prompt profiles: %s", ", ".join(p.label for p in config.profiles.values()), extra={"sample_rate": 1.0})
+        return True
+
+    def install_reload_signal(self, loop) -> None:
+        """Reload on SIGHUP delivered to this process"""
+        if not self.path:
+            return
+        try:
+            loop.add_signal_handler(signal.SIGHUP, self.reload)
+        except (RuntimeError, NotImplementedError) as e:
+            # Signal handlers need the main thread of a Unix process
+            logger.warning("Prompt profile reload on SIGHUP unavailable: %s", e)
+
+    @property
+    def default(self) -> PromptProfile:
+        config = self._config
+        return config.profiles[config.default]
+
+    def get(self, name: str) -> Optional[PromptProfile]:
+        return self._config.profiles.get(name)
+
+    def select(self, name: Optional[str] = None, bucket_key: Optional[str] = None) -> PromptProfile:
+        """
+        The named profile, or the experiment variant for bucket_key (a stable
+        hash, so a client keeps its variant), or the default.
+
+        Raises:
+            KeyError: If name is given but not defined
+        """
+        config = self._config
+        if name:
+            return config.profiles[name]
+        if config.experiment and bucket_key:
+            total = sum(weight for _, weight in config.variants)
+            point = zlib.crc32(f"{config.experiment}:{bucket_key}".encode()) % total
+            for variant, weight in config.variants:
+                if point < weight:
+                    return config.profiles[variant]
+                point -= weight
+        return config.profiles[config.default]
+
+    def stats(self) -> Dict[str, object]:
+        config = self._config
+        return {
+            "source": self.path or "environment",
+            "default": config.profiles[config.default].label,
+            "profiles": sorted(profile.label for profile in config.profiles.values()),
+            "experiment": {"name": config.experiment, "variants": dict(config.variants)} if config.experiment else None,
+            "reloads": self.reloads,
+            "reload_failures": self.reload_failures,
+        }
+
+_registry: Optional[PromptRegistry] = None
+
+def get_prompt_registry() -> PromptRegistry:
+    """Get or create the shared PromptRegistry instance."""
+    global _registry
+    if _registry is None:
+        _registry = PromptRegistry()
+    return _registry
+
+# The profile chosen for the request being served; read by the processing
+# stages, which only receive the text
+_current_profile: ContextVar[Optional[PromptProfile]] = ContextVar("prompt_profile", default=None)
+
+def use_profile(profile: PromptProfile) -> None:
+    """Make profile the current one for the rest of this request's context"""
+    _current_profile.set(profile)
+
+def current_profile() -> PromptProfile:
+    """The profile chosen for this request, or the registry default"""
+    return _current_profile.get() or get_prompt_registry().default
@@ -0,0 +1,436 @@
+"""
+Rate Limit Module
+Per-user and per-address request token buckets and sliding-window LLM token quotas
+"""
+import abc
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from dataclasses import dataclass
+from http.cookies import SimpleCookie
+from typing import Dict, List, Optional, Tuple
+
+from auth import get_session
+from metrics import RATE_LIMITED
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # Redis backend is optional
+    redis_asyncio = None
+
+logger = logging.getLogger(__name__)
+
+class RequestUsage:
+    """Upstream tokens consumed while serving one request"""
+
+    __slots__ = ("tokens",)
+
+    def __init__(self):
+        self.tokens = 0
+
+# Set by the middleware for each limited request; tasks spawned while serving
+# it (hedged attempts, single-flight leaders) share the same object
+_request_usage: ContextVar[Optional[RequestUsage]] = ContextVar("request_usage", default=None)
+
+def record_llm_tokens(tokens: int) -> None:
+    """Charge upstream tokens to the request being served, if it is rate limited"""
+    usage = _request_usage.get()
+    if usage is not None:
+        usage.tokens += tokens
+
+class RateLimitStore(abc.ABC):
+    """Interface for rate limit state. Every operation is O(1) per key."""
+
+    @abc.abstractmethod
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> Tuple[bool, float]:
+        """Take cost from the key's token bucket; returns (allowed, tokens left)"""
+
+    @abc.abstractmethod
+    async def window_usage(self, key: str, window: float) -> float:
+        """Usage over the last window seconds, estimated from two fixed windows"""
+
+    @abc.abstractmethod
+    async def add_usage(self, key: str, amount: float, window: float) -> None:
+        ...
+
+    async def stop(self) -> None:
+        """Release connections"""
+
+    def stats(self) -> dict:
+        return {}
+
+def _sliding_estimate(current: float, previous: float, window: float, now: float) -> float:
+    # Weight the previous fixed window by how much of it still overlaps the sliding one
+    elapsed = (now % window) / window
+    return current + previous * (1.0 - elapsed)
+
+class MemoryRateLimitStore(RateLimitStore):
+    """
+    In-process state: one [tokens, updated_at] bucket and one
+    [window_index, current, previous] counter per key, each in an LRU
+    bounded by RATE_LIMIT_MAX_KEYS. An evicted key starts over with a full
+    bucket, which only ever errs on the side of allowing a request.
+    """
+
+    def __init__(self, max_keys: Optional[int] = None):
+        self.max_keys = max_keys or int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._windows: "OrderedDict[str, List[float]]" = OrderedDict()
+        self.evictions = 0
+
+    def _touch(self, entries: OrderedDict, key: str) -> None:
+        entries.move_to_end(key)
+        if len(entries) > self.max_keys:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> Tuple[bool, float]:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [burst, now]
+        tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        bucket[0] = tokens
+        bucket[1] = now
+        self._touch(self._buckets, key)
+        return allowed, tokens
+
+    def _window(self, key: str, window: float, now: float) -> List[float]:
+        index = math.floor(now / window)
+        entry = self._windows.get(key)
+        if entry is None:
+            entry = self._windows[key] = [index, 0.0, 0.0]
+        elif entry[0] != index:
+            # Roll forward; anything older than the previous window no longer counts
+            entry[2] = entry[1] if entry[0] == index - 1 else 0.0
+            entry[1] = 0.0
+            entry[0] = index
+        self._touch(self._windows, key)
+        return entry
+
+    async def window_usage(self, key: str, window: float) -> float:
+        now = time.time()
+        _, current, previous = self._window(key, window, now)
+        return _sliding_estimate(current, previous, window, now)
+
+    async def add_usage(self, key: str, amount: float, window: float) -> None:
+        self._window(key, window, time.time())[1] += amount
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "backend": "memory",
+            "buckets": len(self._buckets),
+            "windows": len(self._windows),
+            "capacity": self.max_keys,
+            "evictions": self.evictions,
+        }
+
+# Refill and take in one round trip so workers sharing a key cannot race
+_TAKE_SCRIPT = """
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local tokens = tonumber(state[1]) or burst
+local updated_at = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+class RedisRateLimitStore(RateLimitStore):
+    """
+    State shared by every worker and replica using the same Redis server.
+
+    Buckets are hashes updated by a Lua script; quota windows are plain
+    counters keyed by window index that expire after two windows.
+    """
+
+    def __init__(self, client, prefix: str = "ratelimit:"):
+        self.client = client
+        self.prefix = prefix
+
+    async def take(self, key: str, rate: float, burst: float, cost: float = 1.0) -> Tuple[bool, float]:
+        allowed, tokens = await self.client.eval(_TAKE_SCRIPT, 1, self.prefix + "bucket:" + key, rate, burst, cost, time.time())
+        return bool(allowed), float(tokens)
+
+    def _window_key(self, key: str, index: int) -> str:
+        return f"{self.prefix}window:{key}:{index}"
+
+    async def window_usage(self, key: str, window: float) -> float:
+        now = time.time()
+        index = math.floor(now / window)
+        current, previous = await self.client.mget(self._window_key(key, index), self._window_key(key, index - 1))
+        return _sliding_estimate(float(current or 0), float(previous or 0), window, now)
+
+    async def add_usage(self, key: str, amount: float, window: float) -> None:
+        window_key = self._window_key(key, math.floor(time.time() / window))
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.incrbyfloat(window_key, amount)
+            pipe.expire(window_key, math.ceil(window * 2))
+            await pipe.execute()
+
+    async def stop(self) -> None:
+        close = getattr(self.client, "aclose", None) or getattr(self.client, "close", None)
+        if close is not None:
+            await close()
+
+    def stats(self) -> Dict[str, object]:
+        return {"backend": "redis", "prefix": self.prefix}
+
+@dataclass
+class Decision:
+    """Outcome of a rate limit check, with the values for the RateLimit headers"""
+    allowed: bool
+    limit: int
+    remaining: int
+    reset: int
+    policy: str
+    reason: Optional[str] = None
+
+class RateLimiter:
+    """
+    Two limits per client key.
+
+    Requests draw from a token bucket refilled at RATE_LIMIT_REQUESTS_PER_SECOND
+    up to RATE_LIMIT_BURST. Requests that call the model are also refused
+    while the client's upstream tokens over the last
+    RATE_LIMIT_TOKEN_WINDOW_SECONDS exceed RATE_LIMIT_TOKENS_PER_WINDOW
+    (0 disables the quota). Token usage comes from the completion usage
+    field and is charged once the request finishes, so a request is only
+    refused on usage that has already happened, and always before it costs
+    an upstream call.
+    """
+
+    def __init__(
+        self,
+        store: Optional[RateLimitStore] = None,
+        rate: Optional[float] = None,
+        burst: Optional[float] = None,
+        token_quota: Optional[int] = None,
+        quota_window: Optional[float] = None,
+        key_prefix: str = "",
+    ):
+        self.store = store or MemoryRateLimitStore()
+        self.rate = rate or float(os.getenv("RATE_LIMIT_REQUESTS_PER_SECOND", "1"))
+        self.burst = burst or float(os.getenv("RATE_LIMIT_BURST", "10"))
+        self.token_quota = token_quota if token_quota is not None else int(os.getenv("RATE_LIMIT_TOKENS_PER_WINDOW", "100000"))
+        self.quota_window = quota_window or float(os.getenv("RATE_LIMIT_TOKEN_WINDOW_SECONDS", "3600"))
+        policies = [f"{int(self.burst)};w={math.ceil(self.burst / self.rate)}"]
+        if self.token_quota:
+            policies.append(f'{self.token_quota};w={int(self.quota_window)};comment="llm tokens"')
+        self.policy = ", ".join(policies)
+        # Keeps limiters that share a store from sharing buckets
+        self.key_prefix = key_prefix
+        self.allowed = 0
+        self.rejected_requests = 0
+        self.rejected_tokens = 0
+        self.tokens_charged = 0
+
+    async def check(self, key: str, uses_llm: bool) -> Decision:
+        """Spend one request from the key's bucket, then check its token quota"""
+        key = self.key_prefix + key
+        allowed, tokens = await self.store.take(key, self.rate, self.burst)
+        if not allowed:
+            self.rejected_requests += 1
+            RATE_LIMITED.inc(1, "requests")
+            return Decision(False, int(self.burst), 0, max(1, math.ceil((1.0 - tokens) / self.rate)), self.policy, "Too many requests")
+
+        if uses_llm and self.token_quota:
+            used = await self.store.window_usage(key, self.quota_window)
+            if used >= self.token_quota:
+                self.rejected_tokens += 1
+                RATE_LIMITED.inc(1, "tokens")
+                # The sliding estimate falls below the quota within one window at the latest
+                reset = max(1, math.ceil(self.quota_window - time.time() % self.quota_window))
+                return Decision(False, self.token_quota, 0, reset, self.policy, "Token quota exceeded")
+
+        self.allowed += 1
+        return Decision(True, int(self.burst), int(tokens), math.ceil((self.burst - tokens) / self.rate), self.policy)
+
+    async def charge(self, key: str, tokens: int) -> None:
+        """Add upstream tokens to the key's quota window"""
+        if self.token_quota and tokens > 0:
+            await self.store.add_usage(self.key_prefix + key, tokens, self.quota_window)
+            self.tokens_charged += tokens
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "policy": self.policy,
+            "allowed": self.allowed,
+            "rejected_requests": self.rejected_requests,
+            "rejected_tokens": self.rejected_tokens,
+            "tokens_charged": self.tokens_charged,
+            "store": self.store.stats(),
+        }
+
+_rate_limit_store: Optional[RateLimitStore] = None
+_rate_limiter: Optional[RateLimiter] = None
+_address_rate_limiter: Optional[RateLimiter] = None
+
+def get_rate_limit_store() -> RateLimitStore:
+    """Get or create the shared RateLimitStore configured by RATE_LIMIT_BACKEND."""
+    global _rate_limit_store
+    if _rate_limit_store is None:
+        backend = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+        if backend == "redis":
+            if redis_asyncio is None:
+                raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the redis package")
+            _rate_limit_store = RedisRateLimitStore(redis_asyncio.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0")))
+        else:
+            _rate_limit_store = MemoryRateLimitStore()
+    return _rate_limit_store
+
+def get_rate_limiter() -> RateLimiter:
+    """Get or create the per-client RateLimiter."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter(get_rate_limit_store())
+    return _rate_limiter
+
+def get_address_rate_limiter() -> RateLimiter:
+    """
+    Get or create the per-address RateLimiter that signed-in requests also
+    pass, so that signing in under new names does not earn fresh buckets.
+    Its limits are looser than the per-client ones because several users can
+    share an address.
+    """
+    global _address_rate_limiter
+    if _address_rate_limiter is None:
+        _address_rate_limiter = RateLimiter(
+            get_rate_limiter().store,
+            rate=float(os.getenv("RATE_LIMIT_IP_REQUESTS_PER_SECOND", "5")),
+            burst=float(os.getenv("RATE_LIMIT_IP_BURST", "50")),
+            token_quota=int(os.getenv("RATE_LIMIT_IP_TOKENS_PER_WINDOW", "500000")),
+            key_prefix="address:",
+        )
+    return _address_rate_limiter
+
+def set_rate_limiter(limiter: RateLimiter, address_limiter: Optional[RateLimiter] = None) -> None:
+    """Install different limiters (e.g. with a shared or test store)."""
+    global _rate_limiter, _address_rate_limiter
+    _rate_limiter = limiter
+    _address_rate_limiter = address_limiter
+
+class RateLimitMiddleware:
+    """
+    ASGI middleware applying the shared RateLimiter to RATE_LIMIT_PATHS.
+
+    Clients are keyed by the session's user name when the request carries a
+    valid auth_token cookie, otherwise by client IP (the first
+    X-Forwarded-For hop when RATE_LIMIT_TRUST_FORWARDED=true, which must only
+    be set behind a proxy that overwrites that header). Signed-in requests
+    must also pass the per-address limiter for their IP. Refused requests
+    get a 429 before reaching any handler; every limited response carries
+    RateLimit-Limit, RateLimit-Remaining, RateLimit-Reset and
+    RateLimit-Policy headers for the client's own limit. Requests under
+    /chat are the ones checked against, and charged to, the token quotas.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+        self.paths = tuple(path.strip() for path in os.getenv("RATE_LIMIT_PATHS", "/chat,/auth/login").split(",") if path.strip())
+        self.trust_forwarded = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true"
+
+    def client_address(self, headers: Dict[bytes, bytes], scope) -> str:
+        forwarded = headers.get(b"x-forwarded-for")
+        if self.trust_forwarded and forwarded:
+            return forwarded.decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def client_keys(self, scope) -> Tuple[str, Optional[str]]:
+        """
+        The client's key, and the address key to also check when the client
+        is a signed-in user (None otherwise, the client key already is one)
+        """
+        headers = dict(scope.get("headers", []))
+        address = "ip:" + self.client_address(headers, scope)
+        cookie_header = headers.get(b"cookie")
+        if cookie_header:
+            cookie = SimpleCookie()
+            try:
+                cookie.load(cookie_header.decode("latin-1"))
+            except Exception:
+                cookie = SimpleCookie()
+            if "auth_token" in cookie:
+                session = await get_session(cookie["auth_token"].value)
+                if session and session.get("name"):
+                    return "user:" + session["name"], address
+        return address, None
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http" or not scope["path"].startswith(self.paths):
+            await self.app(scope, receive, send)
+            return
+
+        limiter = get_rate_limiter()
+        address_limiter = get_address_rate_limiter()
+        uses_llm = scope["path"].startswith("/chat")
+        try:
+            key, address = await self.client_keys(scope)
+            decision = await limiter.check(key, uses_llm)
+            if decision.allowed and address is not None:
+                address_decision = await address_limiter.check(address, uses_llm)
+                if not address_decision.allowed:
+                    decision = address_decision
+        except Exception as e:
+            # A broken shared store must not take the API down with it
+            logger.warning("Rate limit check failed, allowing request: %s", e)
+            await self.app(scope, receive, send)
+            return
+
+        headers = [
+            (b"ratelimit-limit", str(decision.limit).encode()),
+            (b"ratelimit-remaining", str(decision.remaining).encode()),
+            (b"ratelimit-reset", str(decision.reset).encode()),
+            (b"ratelimit-policy", decision.policy.encode()),
+        ]
+        if not decision.allowed:
+            logger.warning("Rate limited %s on %s: %s", key, scope["path"], decision.reason)
+            body = json.dumps({"detail": decision.reason}).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 429,
+                "headers": headers + [
+                    (b"retry-after", str(decision.reset).encode()),
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + headers
+            await send(message)
+
+        usage = RequestUsage()
+        token = _request_usage.set(usage if uses_llm else None)
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            _request_usage.reset(token)
+            if usage.tokens:
+                try:
+                    await limiter.charge(key, usage.tokens)
+                    if address is not None:
+                        await address_limiter.charge(address, usage.tokens)
+                except Exception as e:
+                    logger.warning("Failed to charge %s upstream tokens to %s: %s", usage.tokens, key, e)
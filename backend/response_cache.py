@@ -0,0 +1,235 @@
+"""
+Response Cache Module
+Exact and similarity caching of LLM responses in front of the upstream call
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # Similarity tier is optional
+    np = None
+
+from metrics import RESPONSE_CACHE_LOOKUPS
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s.!?,;:]+$")
+
+def normalize_prompt(text: str) -> str:
+    """Case-fold, collapse whitespace and drop trailing punctuation"""
+    text = _WHITESPACE.sub(" ", text.strip().lower())
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+def params_fingerprint(params: dict) -> str:
+    """Stable fingerprint of the model and sampling parameters"""
+    return json.dumps(params, sort_keys=True, separators=(",", ":"))
+
+def request_key(prompt: str, params: dict, history: Optional[List[dict]] = None) -> str:
+    """Hash identifying requests that the model would answer the same way"""
+    material = json.dumps([normalize_prompt(prompt), params_fingerprint(params), history or []], separators=(",", ":"))
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+class ResponseCache:
+    """Interface for response caches; the base implementation caches nothing."""
+
+    def get(self, prompt: str, params: dict, history: Optional[List[dict]] = None, similarity_text: Optional[str] = None) -> Optional[str]:
+        return None
+
+    def set(self, prompt: str, params: dict, response: str, history: Optional[List[dict]] = None, similarity_text: Optional[str] = None) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"enabled": False}
+
+class HashedNgramIndex:
+    """
+    Fixed-capacity vector index of hashed character n-gram embeddings.
+
+    Vectors live in a preallocated matrix used as a ring buffer, so a lookup
+    is one matrix-vector product with no allocation beyond the query vector.
+    """
+
+    def __init__(self, capacity: int, dim: int = 512, ngram: int = 3):
+        self.capacity = capacity
+        self.dim = dim
+        self.ngram = ngram
+        self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+        self.keys: List[Optional[str]] = [None] * capacity
+        self.scopes: List[Optional[str]] = [None] * capacity
+        self.slots: Dict[str, int] = {}
+        self.next_slot = 0
+
+    def embed(self, text: str):
+        padded = f" {text} "
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for i in range(max(1, len(padded) - self.ngram + 1)):
+            gram = padded[i:i + self.ngram].encode("utf-8")
+            bucket = int.from_bytes(hashlib.blake2b(gram, digest_size=4).digest(), "little")
+            vector[bucket % self.dim] += 1.0 if bucket & 0x80000000 else -1.0
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def add(self, key: str, scope: str, text: str) -> None:
+        self.remove(key)
+        slot = self.next_slot
+        if self.keys[slot] is not None:
+            del self.slots[self.keys[slot]]
+        self.vectors[slot] = self.embed(text)
+        self.keys[slot] = key
+        self.scopes[slot] = scope
+        self.slots[key] = slot
+        self.next_slot = (slot + 1) % self.capacity
+
+    def remove(self, key: str) -> None:
+        """Forget key's vector, e.g. once its cache entry has been evicted"""
+        slot = self.slots.pop(key, None)
+        if slot is not None:
+            self.vectors[slot] = 0.0
+            self.keys[slot] = None
+            self.scopes[slot] = None
+
+    def nearest(self, scope: str, text: str) -> Iterator[Tuple[str, float]]:
+        """Yield keys of the most similar entries with the same scope and their cosine scores, best first"""
+        scores = self.vectors @ self.embed(text)
+        top = min(8, self.capacity)
+        candidates = np.argpartition(scores, -top)[-top:]
+        for slot in candidates[np.argsort(scores[candidates])[::-1]]:
+            if self.scopes[slot] == scope and self.keys[slot] is not None:
+                yield self.keys[slot], float(scores[slot])
+
+class MemoryResponseCache(ResponseCache):
+    """
+    In-process LRU + TTL response cache.
+
+    The exact tier is keyed on a hash of the normalized prompt, conversation
+    history and sampling parameters. When a similarity threshold is set and
+    NumPy is available, first-turn prompts that miss the exact tier are also
+    matched against a hashed n-gram index and served from the closest entry
+    scoring at or above the threshold. similarity_text lets callers match on
+    the user's own words rather than a prompt padded with fixed instructions.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl_seconds: Optional[float] = None,
+        similarity_threshold: Optional[float] = None,
+    ):
+        self.max_entries = max_entries or int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+        self.ttl_seconds = ttl_seconds or float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600"))
+        if similarity_threshold is None:
+            similarity_threshold = float(os.getenv("RESPONSE_CACHE_SIMILARITY_THRESHOLD", "0"))
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._index: Optional[HashedNgramIndex] = None
+        if similarity_threshold > 0:
+            if np is None:
+                logger.warning("NumPy is not installed, similarity response cache disabled")
+            else:
+                self._index = HashedNgramIndex(self.max_entries, dim=int(os.getenv("RESPONSE_CACHE_DIM", "512")))
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lookup_seconds = 0.0
+
+    def _lookup(self, key: str, now: float) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        response, expires_at = entry
+        if now >= expires_at:
+            self._evict(key)
+            return None
+        self._entries.move_to_end(key)
+        return response
+
+    def _evict(self, key: str) -> None:
+        del self._entries[key]
+        self.evictions += 1
+        if self._index is not None:
+            self._index.remove(key)
+
+    def get(self, prompt: str, params: dict, history: Optional[List[dict]] = None, similarity_text: Optional[str] = None) -> Optional[str]:
+        start = time.perf_counter()
+        now = time.monotonic()
+        scope = params_fingerprint(params)
+
+        response = self._lookup(request_key(prompt, params, history), now)
+        if response is not None:
+            self.exact_hits += 1
+            RESPONSE_CACHE_LOOKUPS.inc(1, "exact")
+        elif self._index is not None and not history:
+            # Skip close matches whose entry has expired since it was indexed
+            for similar_key, score in self._index.nearest(scope, normalize_prompt(similarity_text or prompt)):
+                if score < self.similarity_threshold:
+                    break
+                response = self._lookup(similar_key, now)
+                if response is not None:
+                    self.similar_hits += 1
+                    RESPONSE_CACHE_LOOKUPS.inc(1, "similar")
+                    break
+
+        if response is None:
+            self.misses += 1
+            RESPONSE_CACHE_LOOKUPS.inc(1, "miss")
+        self.lookup_seconds += time.perf_counter() - start
+        return response
+
+    def set(self, prompt: str, params: dict, response: str, history: Optional[List[dict]] = None, similarity_text: Optional[str] = None) -> None:
+        scope = params_fingerprint(params)
+        key = request_key(prompt, params, history)
+
+        self._entries[key] = (response, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._evict(next(iter(self._entries)))
+
+        if self._index is not None and not history:
+            self._index.add(key, scope, normalize_prompt(similarity_text or prompt))
+
+    def stats(self) -> Dict[str, object]:
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        return {
+            "enabled": True,
+            "entries": len(self._entries),
+            "capacity": self.max_entries,
+            "similarity_enabled": self._index is not None,
+            "exact_hits": self.exact_hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round((self.exact_hits + self.similar_hits) / lookups, 4) if lookups else 0.0,
+            "avg_lookup_ms": round(self.lookup_seconds * 1000 / lookups, 4) if lookups else 0.0,
+        }
+
+_response_cache: Optional[ResponseCache] = None
+
+def get_response_cache() -> ResponseCache:
+    """
+    Get or create the shared response cache configured by RESPONSE_CACHE_ENABLED.
+
+    The similarity tier stays off unless RESPONSE_CACHE_SIMILARITY_THRESHOLD is
+    set: it answers a different message with an earlier reply, which may be
+    another user's.
+    """
+    global _response_cache
+    if _response_cache is None:
+        if os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true":
+            _response_cache = MemoryResponseCache()
+        else:
+            _response_cache = ResponseCache()
+    return _response_cache
+
+def set_response_cache(cache: ResponseCache) -> None:
+    """Install a different cache implementation (e.g. a shared or test cache)."""
+    global _response_cache
+    _response_cache = cache
@@ -3,47 +3,93 @@ Response Processor Module
 Handles post-processing of AI responses before sending to frontend
 """
 import logging
-import asyncio
-from typing import Optional
+from typing import Any, AsyncIterator, Dict, Optional
+
+from admission import DeadlineExceededError
+from cancellation import deadline_scope
+from metrics import PROCESS_RESPONSE_SECONDS, timed
+from pipeline import Pipeline, PipelineResult
+from prompt_registry import DEFAULT_RESPONSE_SUFFIX, current_profile
+from sync_runner import get_loop_runner
 
 logger = logging.getLogger(__name__)
 
-async def process_response_async(response: str) -> str:
+RESPONSE_SUFFIX = DEFAULT_RESPONSE_SUFFIX
+
+# Stages registered here run on every AI response. Filtering, formatting
+# and sentiment stages that do not depend on each other run concurrently;
+# see pipeline.Pipeline for the execution model.
+response_pipeline = Pipeline("response")
+
+@response_pipeline.stage("joke_acknowledgment", transforms=True)
+def add_joke_acknowledgment(response: str, deps: Dict[str, Any]) -> str:
+    """Append the request's prompt profile suffix (by default, a friendly acknowledgment about the joke)"""
+    return response + current_profile().response_suffix
+
+async def run_response_pipeline(response: str) -> PipelineResult:
+    """
+    Run the response pipeline and return the processed response together
+    with every stage's result, timing and error (if any).
+    """
+    return await response_pipeline.run(response)
+
+async def process_response_async(response: str, deadline: Optional[float] = None) -> str:
     """
     Process the AI response before sending to frontend (async version).
     Adds a friendly acknowledgment about the joke.
     
     Args:
         response: The AI-generated response
+        deadline: Optional time.monotonic() deadline for the whole request
         
     Returns:
         The processed response with joke acknowledgment
     """
     try:
-        # Simulate async processing if needed (e.g., content filtering API)
-        # await asyncio.sleep(0)  # Placeholder for actual async operations
-        
-        # Add joke acknowledgment to the response
-        processed_response = f"{response}\n\nI hope you liked the joke!"
-        
-        logger.info(f"Response processed - Added joke acknowledgment")
-        
-        # Future async enhancements can be added here:
-        # - Async response filtering services
-        # - Async profanity filtering API
-        # - Async response formatting
-        # - Async sentiment analysis service
-        # - Async response caching via Redis
-        
-        return processed_response
+        with timed(PROCESS_RESPONSE_SECONDS, span_name="process_response"):
+            async with deadline_scope(deadline, "process_response"):
+                result = await run_response_pipeline(response)
+        logger.debug("Response processed in %.2fms", result.elapsed * 1000)
+        return result.text
         
+    except DeadlineExceededError:
+        raise
     except Exception as e:
-        logger.error(f"Error processing response: {str(e)}")
+        logger.error("Error processing response: %s", e)
         # If processing fails, return original response
         return response
 
 def process_response(response: str) -> str:
     """
-    Synchronous version for backward compatibility.
+    Synchronous version for backward compatibility, run on the shared
+    background loop.
     """
-    return asyncio.run(process_response_async(response))
\ No newline at end of file
+    return get_loop_runner().run(process_response_async(response))
+
+async def process_response_stream(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    Process a streamed AI response before sending to frontend.
+    Deltas are forwarded untouched as they arrive; once the upstream stream
+    ends the full response goes through the response pipeline and whatever
+    the pipeline appended is sent as the final delta.
+    
+    Args:
+        chunks: Async iterator of response text deltas
+        
+    Yields:
+        The response deltas followed by the joke acknowledgment
+    """
+    received = []
+    async for chunk in chunks:
+        received.append(chunk)
+        yield chunk
+    
+    response = "".join(received)
+    processed = await process_response_async(response)
+    if processed.startswith(response):
+        tail = processed[len(response):]
+        if tail:
+            yield tail
+    else:
+        # Already-sent deltas cannot be rewritten
+        logger.warning("Response pipeline rewrote a streamed response; only appended text can be streamed")
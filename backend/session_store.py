@@ -0,0 +1,237 @@
+"""
+Session Store Module
+Bounded TTL key-value store for session state, in-process or Redis-backed
+"""
+import asyncio
+import abc
+import fnmatch
+import json
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # Redis backend is optional
+    redis_asyncio = None
+
+logger = logging.getLogger(__name__)
+
+class SessionStoreFull(RuntimeError):
+    """Raised when a store that must not evict live entries has no room left"""
+
+class SessionStore(abc.ABC):
+    """Interface for session stores. Values are JSON-serializable dicts with a TTL."""
+
+    @abc.abstractmethod
+    async def get(self, key: str) -> Optional[dict]:
+        ...
+
+    @abc.abstractmethod
+    async def set(self, key: str, value: dict, ttl: float) -> None:
+        ...
+
+    @abc.abstractmethod
+    async def delete(self, key: str) -> None:
+        ...
+
+    def start(self) -> None:
+        """Start background maintenance on the running event loop"""
+
+    async def stop(self) -> None:
+        """Stop background maintenance and release connections"""
+
+    def stats(self) -> dict:
+        return {}
+
+class MemorySessionStore(SessionStore):
+    """
+    In-process LRU store with per-entry expiry.
+
+    Reads treat expired entries as missing, and a background task
+    periodically sweeps expired entries so memory is returned even for keys
+    that are never read again. At the size limit the least recently used
+    entry is evicted, which suits caches. With evict=False, for entries that
+    must hold until they expire (such as revocations), a full store sweeps
+    expired entries and raises SessionStoreFull if that frees nothing.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, sweep_interval: Optional[float] = None, evict: bool = True):
+        self.max_entries = max_entries or int(os.getenv("SESSION_STORE_MAX_ENTRIES", "100000"))
+        self.sweep_interval = sweep_interval or float(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", "60"))
+        self.evict = evict
+        self._entries: "OrderedDict[str, Tuple[dict, float]]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        self.expired = 0
+        self.evictions = 0
+        self.refused = 0
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            self.expired += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: dict, ttl: float) -> None:
+        if not self.evict and key not in self._entries and len(self._entries) >= self.max_entries and not self.sweep():
+            self.refused += 1
+            logger.error("Session store is full (%d live entries); refusing to store %s", len(self._entries), key.split(":", 1)[0])
+            raise SessionStoreFull(f"Session store is full ({self.max_entries} entries)")
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+
+    def sweep(self) -> int:
+        """Remove every expired entry; returns how many were removed"""
+        now = time.monotonic()
+        expired = [key for key, (_, expires_at) in self._entries.items() if now >= expires_at]
+        for key in expired:
+            del self._entries[key]
+        self.expired += len(expired)
+        return len(expired)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            removed = self.sweep()
+            if removed:
+                logger.debug("Swept %d expired session entries", removed)
+
+    def start(self) -> None:
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "backend": "memory",
+            "entries": len(self._entries),
+            "capacity": self.max_entries,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "refused": self.refused,
+        }
+
+class RedisSessionStore(SessionStore):
+    """
+    Store backed by any client with the redis.asyncio get/set/delete API.
+
+    Expiry is delegated to Redis (SET with EX), so entries are shared by
+    every worker and replica pointing at the same server.
+    """
+
+    def __init__(self, client, prefix: str = "session:"):
+        self.client = client
+        self.prefix = prefix
+        self.errors = 0
+
+    async def get(self, key: str) -> Optional[dict]:
+        raw = await self.client.get(self.prefix + key)
+        if raw is None:
+            return None
+        return json.loads(raw)
+
+    async def set(self, key: str, value: dict, ttl: float) -> None:
+        await self.client.set(self.prefix + key, json.dumps(value), ex=max(1, math.ceil(ttl)))
+
+    async def delete(self, key: str) -> None:
+        await self.client.delete(self.prefix + key)
+
+    async def stop(self) -> None:
+        close = getattr(self.client, "aclose", None) or getattr(self.client, "close", None)
+        if close is not None:
+            await close()
+
+    def stats(self) -> Dict[str, object]:
+        return {"backend": "redis", "prefix": self.prefix}
+
+class FakeRedis:
+    """
+    In-process stand-in for redis.asyncio.Redis covering the commands the
+    session store uses, with real expiry semantics. Meant for tests and
+    local runs without a Redis server.
+    """
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[str, float]] = {}
+
+    def _live(self, key: str) -> Optional[str]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._data[key]
+            return None
+        return value
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._live(key)
+
+    async def set(self, key: str, value: str, ex: Optional[int] = None) -> bool:
+        self._data[key] = (value, time.monotonic() + ex if ex else math.inf)
+        return True
+
+    async def delete(self, *keys: str) -> int:
+        return sum(1 for key in keys if self._data.pop(key, None) is not None)
+
+    async def ttl(self, key: str) -> int:
+        if self._live(key) is None:
+            return -2
+        expires_at = self._data[key][1]
+        return -1 if expires_at == math.inf else math.ceil(expires_at - time.monotonic())
+
+    async def keys(self, pattern: str = "*") -> list:
+        return [key for key in list(self._data) if self._live(key) is not None and fnmatch.fnmatchcase(key, pattern)]
+
+    async def ping(self) -> bool:
+        return True
+
+    async def aclose(self) -> None:
+        self._data.clear()
+
+_session_store: Optional[SessionStore] = None
+
+def get_session_store() -> SessionStore:
+    """Get or create the shared session store configured by SESSION_STORE_BACKEND."""
+    global _session_store
+    if _session_store is None:
+        backend = os.getenv("SESSION_STORE_BACKEND", "memory").lower()
+        if backend == "redis":
+            if redis_asyncio is None:
+                raise RuntimeError("SESSION_STORE_BACKEND=redis requires the redis package")
+            client = redis_asyncio.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+            _session_store = RedisSessionStore(client)
+        elif backend == "fakeredis":
+            _session_store = RedisSessionStore(FakeRedis())
+        else:
+            # Holds revocations, which must outlive any amount of later traffic
+            _session_store = MemorySessionStore(evict=False)
+    return _session_store
+
+def set_session_store(store: SessionStore) -> None:
+    """Install a different store implementation (e.g. a shared or test store)."""
+    global _session_store
+    _session_store = store
@@ -0,0 +1,33 @@
+"""
+Settings Module
+Application configuration read from the environment and .env
+"""
+from functools import lru_cache
+from typing import Optional
+
+from pydantic import Field
+from pydantic_settings import BaseSettings
+
+class Settings(BaseSettings):
+    baseten_api_key: str = Field(..., env="BASETEN_API_KEY")
+    cors_origins: str = Field("*", env="CORS_ORIGINS")
+    debug: bool = Field(False, env="DEBUG")
+    log_level: str = Field("INFO", env="LOG_LEVEL")
+    port: int = Field(5004, env="PORT")
+    web_concurrency: int = Field(1, env="WEB_CONCURRENCY")
+    secret_key: Optional[str] = Field(None, env="SECRET_KEY")
+    admin_token: Optional[str] = Field(None, env="ADMIN_TOKEN")
+
+    class Config:
+        env_file = ".env"
+        case_sensitive = False
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """Load settings once per process, on first use rather than at import"""
+    try:
+        return Settings()
+    except Exception as e:
+        print(f"Error loading settings: {e}")
+        print("Make sure BASETEN_API_KEY is set in environment or .env file")
+        raise
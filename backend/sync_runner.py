@@ -0,0 +1,142 @@
+"""
+Sync Runner Module
+A long-lived background event loop behind the synchronous API wrappers
+"""
+import asyncio
+import atexit
+import concurrent.futures
+import contextvars
+import logging
+import os
+import threading
+from typing import Awaitable, Callable, Iterable, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+async def _in_context(coro: Awaitable[T], context: contextvars.Context) -> T:
+    # The task starts from the loop thread's context; carry over the caller's
+    # request id, prompt profile and other context variables
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+class LoopRunner:
+    """
+    Runs coroutines on one event loop in a daemon thread.
+
+    Synchronous callers (scripts, task-queue workers, notebooks) submit work
+    with run() or map() instead of asyncio.run(), so every call reuses the
+    same loop and therefore the same upstream clients and keep-alive
+    connections, and nothing is built and torn down per call. The loop is
+    started on first use and restarted in a forked child, which does not
+    inherit the parent's thread. stop() closes the upstream clients and the
+    loop; it is registered to run at exit.
+    """
+
+    def __init__(self, name: str = "sync-runner"):
+        self.name = name
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+
+    def _serve(self, loop: asyncio.AbstractEventLoop, ready: threading.Event) -> None:
+        asyncio.set_event_loop(loop)
+        loop.call_soon(ready.set)
+        try:
+            loop.run_forever()
+        finally:
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return self._loop
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+            thread = threading.Thread(target=self._serve, args=(loop, ready), name=self.name, daemon=True)
+            thread.start()
+            ready.wait()
+            self._loop, self._thread, self._pid = loop, thread, os.getpid()
+            return loop
+
+    def submit(self, coro: Awaitable[T]) -> "concurrent.futures.Future[T]":
+        """Schedule a coroutine on the loop and return a thread-safe future for its result"""
+        loop = self._ensure_loop()
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("LoopRunner cannot be called from its own loop; await the coroutine instead")
+        return asyncio.run_coroutine_threadsafe(_in_context(coro, contextvars.copy_context()), loop)
+
+    def run(self, coro: Awaitable[T], timeout: Optional[float] = None) -> T:
+        """
+        Run a coroutine on the loop and block until it finishes.
+
+        Raises:
+            TimeoutError: If timeout seconds pass first; the coroutine is cancelled
+        """
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def map(
+        self,
+        fn: Callable[[T], Awaitable[R]],
+        items: Iterable[T],
+        concurrency: int = 8,
+        return_exceptions: bool = False,
+    ) -> List[R]:
+        """
+        Run fn over every item with at most `concurrency` calls in flight and
+        return the results in input order. With return_exceptions, failures
+        are returned in place of their results instead of raised.
+        """
+        async def run_all() -> List[R]:
+            semaphore = asyncio.Semaphore(max(1, concurrency))
+
+            async def one(item: T) -> R:
+                async with semaphore:
+                    return await fn(item)
+
+            return await asyncio.gather(*(one(item) for item in items), return_exceptions=return_exceptions)
+
+        return self.run(run_all())
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Close the loop's upstream clients, then stop the loop thread"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            if loop is None or self._pid != os.getpid() or not thread.is_alive():
+                return
+            self._loop = self._thread = None
+        from llm_router import close_router
+
+        try:
+            asyncio.run_coroutine_threadsafe(close_router(), loop).result(timeout)
+        except Exception as e:
+            logger.warning("Closing upstream clients failed: %s", e)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+
+_runner: Optional[LoopRunner] = None
+_runner_lock = threading.Lock()
+
+def get_loop_runner() -> LoopRunner:
+    """Get or create the shared LoopRunner instance."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = LoopRunner()
+            atexit.register(_runner.stop)
+        return _runner
@@ -0,0 +1,127 @@
+"""
+AIMD limiter and the admission priority queue; no database or upstream needed.
+"""
+import asyncio
+import time
+
+import pytest
+
+from admission import (
+    PRIORITY_BATCH, PRIORITY_INTERACTIVE, AdaptiveLimiter, AdmissionController,
+    DeadlineExceededError, QueueFullError, QueueTimeoutError
+)
+
+def _limiter(limit: int = 4) -> AdaptiveLimiter:
+    return AdaptiveLimiter(initial_limit=limit, min_limit=1, max_limit=8, tolerance=2.0)
+
+def test_limiter_grows_additively_while_used():
+    limiter = _limiter(4)
+    for _ in range(4):
+        limiter.update(0.1, in_flight=4, ok=True)
+    assert 4.9 < limiter.limit < 5.0
+    assert limiter.current == 4
+
+def test_limiter_does_not_grow_while_idle():
+    limiter = _limiter(4)
+    for _ in range(10):
+        limiter.update(0.1, in_flight=1, ok=True)
+    assert limiter.limit == 4
+
+def test_limiter_backs_off_on_slow_or_failed_calls():
+    limiter = _limiter(4)
+    limiter.update(0.1, in_flight=4, ok=True)
+    before = limiter.limit
+    limiter.update(0.5, in_flight=4, ok=True)
+    assert limiter.limit == pytest.approx(before * 0.9)
+    limiter.update(0.1, in_flight=4, ok=False)
+    assert limiter.limit == pytest.approx(before * 0.81)
+
+def test_limiter_stays_within_bounds():
+    limiter = _limiter(4)
+    for _ in range(100):
+        limiter.update(1.0, in_flight=0, ok=False)
+    assert limiter.current == 1
+    limiter = _limiter(8)
+    for _ in range(100):
+        limiter.update(0.1, in_flight=8, ok=True)
+    assert limiter.limit == 8
+
+def test_queued_requests_are_admitted_by_priority():
+    async def scenario():
+        controller = AdmissionController(_limiter(1), max_queue=10, max_wait=5)
+        admitted = []
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.slot():
+                await release.wait()
+
+        async def request(name: str, priority: int):
+            async with controller.slot(priority):
+                admitted.append(name)
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiting = [
+            asyncio.create_task(request("batch", PRIORITY_BATCH)),
+            asyncio.create_task(request("interactive", PRIORITY_INTERACTIVE)),
+        ]
+        await asyncio.sleep(0)
+        assert controller.queue_depth == 2
+        release.set()
+        await asyncio.gather(holder, *waiting)
+        return admitted, controller
+
+    admitted, controller = asyncio.run(scenario())
+    assert admitted == ["interactive", "batch"]
+    assert controller.in_flight == 0
+    assert controller.admitted == 3
+
+def test_full_queue_is_refused_with_retry_after():
+    async def scenario():
+        controller = AdmissionController(_limiter(1), max_queue=1, max_wait=5)
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.slot():
+                await release.wait()
+
+        tasks = [asyncio.create_task(hold()), asyncio.create_task(hold())]
+        await asyncio.sleep(0)
+        with pytest.raises(QueueFullError) as refused:
+            controller.ensure_capacity()
+        release.set()
+        await asyncio.gather(*tasks)
+        return refused.value, controller
+
+    error, controller = asyncio.run(scenario())
+    assert error.status_code == 429
+    assert error.retry_after >= 1
+    assert controller.rejected == 1
+
+def test_waiters_fail_by_their_own_deadline_or_max_wait():
+    async def scenario():
+        controller = AdmissionController(_limiter(1), max_queue=10, max_wait=0.05)
+        release = asyncio.Event()
+
+        async def hold():
+            async with controller.slot():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        with pytest.raises(DeadlineExceededError):
+            async with controller.slot(deadline=time.monotonic() + 0.01):
+                pass
+        with pytest.raises(QueueTimeoutError) as timed_out:
+            async with controller.slot():
+                pass
+        release.set()
+        await holder
+        return timed_out.value, controller
+
+    error, controller = asyncio.run(scenario())
+    assert error.retry_after >= 1
+    assert controller.expired == 2
+    assert controller.queue_depth == 0
+    assert controller.in_flight == 0
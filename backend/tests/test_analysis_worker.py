@@ -0,0 +1,119 @@
+"""
+Analysis worker against a real Postgres.
+
+Set ANALYSIS_TEST_DATABASE to the name of a scratch database to run these;
+its tables are dropped and recreated from database/init.sql. The connection
+uses DATABASE_HOST, DATABASE_USER and POSTGRES_PASSWORD like the worker.
+
+    ANALYSIS_TEST_DATABASE=analysis_test python -m pytest tests
+"""
+import asyncio
+import os
+import subprocess
+import sys
+
+import asyncpg
+import pytest
+
+import analysis_worker
+from analysis_worker import AnalysisWorker
+from database import Database
+from pipeline import PipelineResult
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INIT_SQL = os.path.join(BACKEND_DIR, "..", "database", "init.sql")
+TEST_DATABASE = os.getenv("ANALYSIS_TEST_DATABASE")
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE, reason="ANALYSIS_TEST_DATABASE is not set")
+
+RESET_SQL = """
+    DROP TABLE IF EXISTS input_table, conversation_messages, idempotency_keys, analysis_audit CASCADE;
+    DROP FUNCTION IF EXISTS audit_analysis() CASCADE;
+"""
+
+# Records every write of an analysis result, so a row analyzed twice shows up
+# as two audit rows
+AUDIT_SQL = """
+    CREATE TABLE analysis_audit (id INTEGER, created_at TIMESTAMP WITH TIME ZONE, processed BOOLEAN);
+    CREATE FUNCTION audit_analysis() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO analysis_audit VALUES (NEW.id, NEW.created_at, NEW.processed);
+        RETURN NEW;
+    END;
+    $$ LANGUAGE plpgsql;
+    CREATE TRIGGER audit_analysis AFTER UPDATE OF analysis ON input_table
+        FOR EACH ROW EXECUTE FUNCTION audit_analysis();
+"""
+
+def _database() -> Database:
+    return Database(database=TEST_DATABASE)
+
+async def _reset(rows: int) -> None:
+    conn = await _database().connect_single()
+    try:
+        await conn.execute(RESET_SQL)
+        with open(INIT_SQL) as f:
+            await conn.execute(f.read())
+        await conn.execute("DELETE FROM input_table")
+        await conn.execute(AUDIT_SQL)
+        # Spread over recent partitions and the default one
+        await conn.execute("""
+            INSERT INTO input_table (input, created_at)
+            SELECT CASE WHEN i % 7 = 0 THEN 'bad message ' ELSE 'message ' END || i,
+                   CASE WHEN i % 10 = 0 THEN TIMESTAMPTZ '2020-01-15' ELSE now() END - make_interval(secs => i)
+            FROM generate_series(1, $1) AS i
+        """, rows)
+    finally:
+        await conn.close()
+
+async def _fetch(query: str, *args):
+    conn = await _database().connect_single()
+    try:
+        return await conn.fetch(query, *args)
+    finally:
+        await conn.close()
+
+def test_drain_with_two_workers_processes_every_row_once():
+    asyncio.run(_reset(3000))
+    env = dict(os.environ, DATABASE_NAME=TEST_DATABASE, LOG_LEVEL="WARNING")
+    command = [sys.executable, "analysis_worker.py", "--drain", "--batch-size", "50", "--concurrency", "2"]
+    workers = [
+        subprocess.Popen(command, cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        for _ in range(2)
+    ]
+    for worker in workers:
+        _, stderr = worker.communicate(timeout=300)
+        assert worker.returncode == 0, stderr.decode()
+
+    left = asyncio.run(_fetch("SELECT count(*) FROM input_table WHERE processed = false AND analysis_attempts = 0"))
+    assert left[0][0] == 0
+    twice = asyncio.run(_fetch("SELECT id, created_at FROM analysis_audit GROUP BY id, created_at HAVING count(*) > 1"))
+    assert twice == []
+    processed = asyncio.run(_fetch("SELECT count(*) FROM input_table WHERE processed"))
+    audited = asyncio.run(_fetch("SELECT count(*) FROM analysis_audit WHERE processed"))
+    assert processed[0][0] == audited[0][0] == 3000
+
+def test_failed_rows_stay_unprocessed_until_attempts_run_out(monkeypatch):
+    asyncio.run(_reset(100))
+
+    async def analyze_input(text: str) -> PipelineResult:
+        if text.startswith("bad"):
+            return PipelineResult(text, errors={"sentiment": "stage failed"})
+        return PipelineResult(text, results={"sentiment": "neutral"})
+
+    monkeypatch.setattr(analysis_worker, "analyze_input", analyze_input)
+    worker = AnalysisWorker(_database(), batch_size=10, concurrency=2, max_attempts=3, retry_delay=0)
+    asyncio.run(worker.run(drain=True))
+
+    rows = asyncio.run(_fetch("SELECT input, processed, analysis_attempts, analysis FROM input_table"))
+    bad = [row for row in rows if row["input"].startswith("bad")]
+    good = [row for row in rows if not row["input"].startswith("bad")]
+    assert bad and all(not row["processed"] and row["analysis_attempts"] == 3 for row in bad)
+    assert all('"errors"' in row["analysis"] for row in bad)
+    assert all(row["processed"] and row["analysis_attempts"] == 0 for row in good)
+    assert worker.processed == len(good)
+    assert worker.failed == 3 * len(bad)
+
+    assert asyncio.run(worker.retry_exhausted()) == len(bad)
+    rows = asyncio.run(_fetch("SELECT count(*) FROM input_table WHERE processed = false AND analysis_attempts = 0"))
+    assert rows[0][0] == len(bad)
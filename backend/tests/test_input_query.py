@@ -0,0 +1,71 @@
+"""
+Pagination cursors, keyset queries and the admin check of the gateway's
+input endpoints.
+"""
+import importlib.util
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+# llm_gateway has modules named like the backend's own (rate_limit,
+# idempotency), so load input_query by path rather than via sys.path
+_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "llm_gateway", "input_query.py")
+_spec = importlib.util.spec_from_file_location("gateway_input_query", _PATH)
+input_query = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(input_query)
+
+def _row(row_id: int, created_at: datetime) -> dict:
+    return {
+        "id": row_id,
+        "input_uuid": None,
+        "input": f"message {row_id}",
+        "conversation_id": None,
+        "created_at": created_at,
+        "processed": False,
+    }
+
+def test_cursor_round_trips_its_position():
+    created_at = datetime(2026, 3, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+    cursor = input_query.encode_cursor(created_at, 42)
+    assert "=" not in cursor
+    assert input_query.decode_cursor(cursor) == (created_at, 42)
+
+@pytest.mark.parametrize("cursor", ["", "not a cursor", "bm90IGpzb24", "WyJ4IiwgMV0", "WzFd"])
+def test_malformed_cursors_are_rejected(cursor):
+    with pytest.raises(input_query.InvalidCursor):
+        input_query.decode_cursor(cursor)
+
+def test_query_starts_strictly_after_the_cursor():
+    after = (datetime(2026, 3, 1, tzinfo=timezone.utc), 42)
+    sql, params = input_query.build_query("conv", after=after, limit=11, numbered=True)
+    assert "conversation_id = $1" in sql
+    assert "(created_at, id) < ($2, $3)" in sql
+    assert sql.endswith("ORDER BY created_at DESC, id DESC LIMIT $4")
+    assert params == ["conv", after[0], 42, 11]
+
+    sql, params = input_query.build_query(since=after[0], until=after[0] + timedelta(days=1))
+    assert "created_at >= %s AND created_at < %s" in sql
+    assert "LIMIT" not in sql
+
+def test_page_has_a_cursor_only_when_more_rows_follow():
+    start = datetime(2026, 3, 1, tzinfo=timezone.utc)
+    rows = [_row(row_id, start - timedelta(minutes=row_id)) for row_id in range(1, 5)]
+
+    page, next_cursor = input_query._page(rows, 3)
+    assert [row["id"] for row in page] == [1, 2, 3]
+    assert input_query.decode_cursor(next_cursor) == (rows[2]["created_at"], 3)
+
+    page, next_cursor = input_query._page(rows[3:], 3)
+    assert [row["id"] for row in page] == [4]
+    assert next_cursor is None
+
+def test_admin_token_is_required(monkeypatch):
+    monkeypatch.delenv("INPUTS_ADMIN_TOKEN", raising=False)
+    assert input_query.check_admin("Bearer anything")[1] == 403
+
+    monkeypatch.setenv("INPUTS_ADMIN_TOKEN", "secret")
+    assert input_query.check_admin(None)[1] == 401
+    assert input_query.check_admin("Bearer wrong")[1] == 401
+    assert input_query.check_admin("Basic secret")[1] == 401
+    assert input_query.check_admin("Bearer secret") is None
@@ -0,0 +1,104 @@
+"""
+Dependency ordering, concurrency and failure handling of the stage engine.
+"""
+import asyncio
+import time
+from typing import Any, Dict
+
+import pytest
+
+from pipeline import MODE_THREAD, Pipeline, PipelineError, StageFailedError
+
+def test_stages_see_their_dependencies_and_the_latest_transform():
+    pipeline = Pipeline("test")
+
+    @pipeline.stage("strip", transforms=True)
+    def strip(text: str, deps: Dict[str, Any]) -> str:
+        return text.strip()
+
+    @pipeline.stage("length")
+    def length(text: str, deps: Dict[str, Any]) -> int:
+        return len(text)
+
+    @pipeline.stage("upper", transforms=True, depends_on=("strip",))
+    def upper(text: str, deps: Dict[str, Any]) -> str:
+        return text.upper()
+
+    @pipeline.stage("summary", depends_on=("upper", "length"))
+    async def summary(text: str, deps: Dict[str, Any]) -> str:
+        return f"{text}:{deps['length']}"
+
+    result = asyncio.run(pipeline.run("  hi  "))
+    assert result.text == "HI"
+    # length has no transforming ancestor, so it read the original text
+    assert result.results["length"] == 6
+    assert result.results["summary"] == "HI:6"
+    assert result.errors == {}
+
+def test_independent_stages_run_concurrently():
+    pipeline = Pipeline("test")
+
+    for name in ("a", "b", "c"):
+        @pipeline.stage(name)
+        async def wait(text: str, deps: Dict[str, Any]) -> None:
+            await asyncio.sleep(0.1)
+
+    start = time.perf_counter()
+    asyncio.run(pipeline.run("text"))
+    assert time.perf_counter() - start < 0.25
+
+def test_thread_stages_run_off_the_loop():
+    pipeline = Pipeline("test")
+
+    @pipeline.stage("blocking", mode=MODE_THREAD)
+    def blocking(text: str, deps: Dict[str, Any]) -> str:
+        time.sleep(0.05)
+        return text[::-1]
+
+    assert asyncio.run(pipeline.run("abc")).results["blocking"] == "cba"
+
+def test_fail_open_stages_yield_their_default():
+    pipeline = Pipeline("test")
+
+    @pipeline.stage("broken", default="unknown")
+    def broken(text: str, deps: Dict[str, Any]) -> str:
+        raise ValueError("bad input")
+
+    @pipeline.stage("slow", timeout=0.01, default="late")
+    async def slow(text: str, deps: Dict[str, Any]) -> str:
+        await asyncio.sleep(1)
+        return "done"
+
+    @pipeline.stage("after", depends_on=("broken",))
+    def after(text: str, deps: Dict[str, Any]) -> str:
+        return deps["broken"]
+
+    result = asyncio.run(pipeline.run("text"))
+    assert result.results == {"broken": "unknown", "slow": "late", "after": "unknown"}
+    assert result.errors == {"broken": "bad input", "slow": "timed out after 0.01s"}
+    assert pipeline.stats()["stages"]["slow"]["timeouts"] == 1
+
+def test_fail_closed_stage_aborts_the_run():
+    pipeline = Pipeline("test")
+
+    @pipeline.stage("guard", fail_open=False)
+    def guard(text: str, deps: Dict[str, Any]) -> None:
+        raise ValueError("blocked")
+
+    with pytest.raises(StageFailedError) as failed:
+        asyncio.run(pipeline.run("text"))
+    assert failed.value.stage == "guard"
+
+def test_invalid_definitions_are_rejected():
+    pipeline = Pipeline("test")
+    pipeline.stage("first", transforms=True)(lambda text, deps: text)
+
+    with pytest.raises(PipelineError):
+        pipeline.stage("first")(lambda text, deps: text)
+    with pytest.raises(PipelineError):
+        pipeline.stage("orphan", depends_on=("missing",))(lambda text, deps: text)
+    with pytest.raises(PipelineError):
+        # Two transforms must be ordered by their dependencies
+        pipeline.stage("second", transforms=True)(lambda text, deps: text)
+    with pytest.raises(PipelineError):
+        pipeline.stage("odd", mode="gpu")(lambda text, deps: text)
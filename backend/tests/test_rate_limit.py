@@ -0,0 +1,79 @@
+"""
+Token buckets and token quota windows of the in-memory rate limit store.
+"""
+import asyncio
+
+import pytest
+
+import rate_limit
+from rate_limit import MemoryRateLimitStore, RateLimiter
+
+class FakeClock:
+    """Stands in for the time module so buckets refill on demand"""
+
+    def __init__(self, now: float = 1_000_000.0):
+        self.now = now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+def test_bucket_allows_a_burst_then_refills(clock):
+    limiter = RateLimiter(MemoryRateLimitStore(), rate=1, burst=3, token_quota=0)
+
+    decisions = [asyncio.run(limiter.check("alice", uses_llm=True)) for _ in range(4)]
+    assert [decision.allowed for decision in decisions] == [True, True, True, False]
+    assert [decision.remaining for decision in decisions[:3]] == [2, 1, 0]
+    assert decisions[3].reset == 1
+    assert decisions[3].reason == "Too many requests"
+
+    clock.now += 1
+    assert asyncio.run(limiter.check("alice", uses_llm=True)).allowed
+    assert limiter.rejected_requests == 1
+
+def test_clients_have_separate_buckets(clock):
+    limiter = RateLimiter(MemoryRateLimitStore(), rate=1, burst=1, token_quota=0)
+    assert asyncio.run(limiter.check("alice", uses_llm=True)).allowed
+    assert not asyncio.run(limiter.check("alice", uses_llm=True)).allowed
+    assert asyncio.run(limiter.check("bob", uses_llm=True)).allowed
+
+def test_token_quota_refuses_llm_requests_until_the_window_slides(clock):
+    clock.now = 3600.0 * 1000
+    limiter = RateLimiter(MemoryRateLimitStore(), rate=100, burst=100, token_quota=1000, quota_window=3600)
+
+    asyncio.run(limiter.charge("alice", 1000))
+    refused = asyncio.run(limiter.check("alice", uses_llm=True))
+    assert not refused.allowed
+    assert refused.reason == "Token quota exceeded"
+    assert refused.limit == 1000
+    # Requests that do not call the model only spend from the bucket
+    assert asyncio.run(limiter.check("alice", uses_llm=False)).allowed
+
+    # Half way through the next window half of the previous one still counts
+    clock.now += 3600 * 1.5
+    assert asyncio.run(limiter.store.window_usage("alice", 3600)) == pytest.approx(500)
+    assert asyncio.run(limiter.check("alice", uses_llm=True)).allowed
+
+def test_limiters_sharing_a_store_keep_separate_keys(clock):
+    store = MemoryRateLimitStore()
+    user = RateLimiter(store, rate=1, burst=1, token_quota=0)
+    address = RateLimiter(store, rate=1, burst=1, token_quota=0, key_prefix="address:")
+    assert asyncio.run(user.check("1.2.3.4", uses_llm=True)).allowed
+    assert asyncio.run(address.check("1.2.3.4", uses_llm=True)).allowed
+
+def test_store_evicts_least_recently_used_keys(clock):
+    store = MemoryRateLimitStore(max_keys=2)
+    for key in ("a", "b", "a", "c"):
+        asyncio.run(store.take(key, rate=1, burst=1))
+    assert store.evictions == 1
+    # "b" was evicted and starts over with a full bucket; "c" is still empty
+    assert asyncio.run(store.take("b", rate=1, burst=1))[0]
+    assert not asyncio.run(store.take("c", rate=1, burst=1))[0]
@@ -0,0 +1,78 @@
+"""
+Exact and similarity tiers of the in-memory response cache.
+"""
+import pytest
+
+import response_cache
+from response_cache import MemoryResponseCache, normalize_prompt, request_key
+
+PARAMS = {"model": "test", "temperature": 0.7}
+
+class FakeClock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def perf_counter(self) -> float:
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(response_cache, "time", clock)
+    return clock
+
+def test_normalized_prompts_share_a_key():
+    assert normalize_prompt("  Tell me   a JOKE!! ") == "tell me a joke"
+    assert request_key("Tell me a joke", PARAMS) == request_key("tell me a joke?", PARAMS)
+    assert request_key("Tell me a joke", PARAMS) != request_key("Tell me a joke", {**PARAMS, "temperature": 0})
+    assert request_key("Tell me a joke", PARAMS) != request_key("Tell me a joke", PARAMS, [{"role": "user", "content": "hi"}])
+
+def test_exact_hits_expire_after_the_ttl(clock):
+    cache = MemoryResponseCache(max_entries=10, ttl_seconds=60, similarity_threshold=0)
+    cache.set("Tell me a joke", PARAMS, "knock knock")
+    assert cache.get("tell me a joke.", PARAMS) == "knock knock"
+    assert cache.get("Tell me a joke", {**PARAMS, "temperature": 0}) is None
+
+    clock.now += 60
+    assert cache.get("Tell me a joke", PARAMS) is None
+    stats = cache.stats()
+    assert (stats["exact_hits"], stats["misses"], stats["entries"]) == (1, 2, 0)
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = MemoryResponseCache(max_entries=2, ttl_seconds=60, similarity_threshold=0)
+    cache.set("one", PARAMS, "1")
+    cache.set("two", PARAMS, "2")
+    assert cache.get("one", PARAMS) == "1"
+    cache.set("three", PARAMS, "3")
+    assert cache.get("two", PARAMS) is None
+    assert cache.get("one", PARAMS) == "1"
+    assert cache.stats()["evictions"] == 1
+
+def test_similarity_tier_matches_close_first_turn_prompts(clock):
+    cache = MemoryResponseCache(max_entries=10, ttl_seconds=60, similarity_threshold=0.8)
+    cache.set("tell me a joke about penguins", PARAMS, "penguin joke")
+
+    assert cache.get("tell me a joke about the penguins", PARAMS) == "penguin joke"
+    assert cache.get("what is the capital of france", PARAMS) is None
+    # Neither other sampling parameters nor later turns are matched by similarity
+    assert cache.get("tell me a joke about the penguins", {**PARAMS, "temperature": 0}) is None
+    assert cache.get("tell me a joke about the penguins", PARAMS, [{"role": "user", "content": "hi"}]) is None
+    assert cache.stats()["similar_hits"] == 1
+
+def test_similarity_tier_skips_expired_and_evicted_entries(clock):
+    cache = MemoryResponseCache(max_entries=2, ttl_seconds=60, similarity_threshold=0.5)
+    cache.set("first prompt", PARAMS, "stale", similarity_text="tell me a joke about penguins")
+    clock.now += 30
+    cache.set("second prompt", PARAMS, "fresh", similarity_text="tell me a joke about penguin")
+    clock.now += 40
+    # The closest entry has expired; the next closest is still served
+    assert cache.get("third prompt", PARAMS, similarity_text="tell me a joke about penguins") == "fresh"
+
+    cache.set("something else entirely", PARAMS, "other")
+    cache.set("another unrelated prompt", PARAMS, "other")
+    # Both penguin entries have left the cache, and the index with them
+    assert cache.get("third prompt", PARAMS, similarity_text="tell me a joke about penguins") is None
+    assert set(cache._index.slots) == set(cache._entries)
@@ -0,0 +1,89 @@
+"""
+Coalescing of concurrent identical calls and streams.
+"""
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+def test_concurrent_callers_share_one_call():
+    calls = 0
+
+    async def fetch() -> str:
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "reply"
+
+    async def scenario():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("key", fetch) for _ in range(5)))
+        # A call after the first finished starts a new one
+        results.append(await flight.do("key", fetch))
+        return results, flight
+
+    results, flight = asyncio.run(scenario())
+    assert results == ["reply"] * 6
+    assert calls == 2
+    assert flight.stats() == {"in_flight": 0, "leaders": 2, "followers": 4, "cancelled": 0}
+
+def test_errors_reach_every_waiter():
+    async def fail() -> str:
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream failed")
+
+    async def scenario():
+        flight = SingleFlight()
+        return await asyncio.gather(*(flight.do("key", fail) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+def test_shared_call_is_cancelled_only_with_its_last_waiter():
+    finished = []
+
+    async def slow() -> str:
+        await asyncio.sleep(0.05)
+        finished.append(True)
+        return "reply"
+
+    async def scenario():
+        flight = SingleFlight()
+        first = asyncio.create_task(flight.do("key", slow))
+        second = asyncio.create_task(flight.do("key", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == "reply"
+
+        third = asyncio.create_task(flight.do("other", slow))
+        await asyncio.sleep(0)
+        third.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await third
+        await asyncio.sleep(0.1)
+        return flight
+
+    flight = asyncio.run(scenario())
+    assert finished == [True]
+    assert flight.cancelled == 1
+    assert flight.stats()["in_flight"] == 0
+
+def test_late_stream_subscribers_replay_then_follow():
+    async def chunks():
+        for chunk in ("a", "b", "c"):
+            await asyncio.sleep(0.01)
+            yield chunk
+
+    async def collect(flight: SingleFlight, delay: float) -> str:
+        await asyncio.sleep(delay)
+        return "".join([chunk async for chunk in flight.stream("key", chunks)])
+
+    async def scenario():
+        flight = SingleFlight()
+        results = await asyncio.gather(collect(flight, 0), collect(flight, 0.015))
+        return results, flight
+
+    results, flight = asyncio.run(scenario())
+    assert results == ["abc", "abc"]
+    assert (flight.leaders, flight.followers) == (1, 1)
@@ -0,0 +1,183 @@
+"""
+Upstream Transport Module
+Explicitly configured HTTP connection pools for the LLM backends, with connection
+accounting and startup warmup
+"""
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+import httpx
+
+from metrics import LLM_UPSTREAM_CONNECT_SECONDS, LLM_UPSTREAM_CONNECTIONS
+
+try:
+    import h2  # noqa: F401
+except ImportError:  # HTTP/2 is optional
+    h2 = None
+
+if TYPE_CHECKING:
+    from llm_router import Backend, LLMRouter
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class TransportSettings:
+    """Connection pool settings shared by every backend's client"""
+    max_connections: int
+    max_keepalive_connections: int
+    keepalive_expiry: float
+    connect_timeout: float
+    http2: bool
+
+    @classmethod
+    def from_env(cls) -> "TransportSettings":
+        max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+        http2 = os.getenv("LLM_HTTP2", "false").lower() == "true"
+        if http2 and h2 is None:
+            logger.warning("LLM_HTTP2 is set but the h2 package is not installed, using HTTP/1.1")
+            http2 = False
+        return cls(
+            max_connections=max_connections,
+            max_keepalive_connections=int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", str(max_connections))),
+            # Longer than httpx's 5s default so connections survive gaps between chats
+            keepalive_expiry=float(os.getenv("LLM_KEEPALIVE_EXPIRY_SECONDS", "60")),
+            connect_timeout=float(os.getenv("LLM_CONNECT_TIMEOUT", "5")),
+            http2=http2,
+        )
+
+class ConnectionStats:
+    """
+    Counts new connections to one backend through httpcore's trace hook.
+
+    A connection that is reused from the pool produces no connect events, so
+    opened / requests is the churn rate: near zero with a healthy pool, near
+    one when every request reconnects.
+    """
+
+    def __init__(self, backend: str):
+        self.backend = backend
+        self.requests = 0
+        self.opened = 0
+        self.connect_seconds_total = 0.0
+
+    async def on_request(self, request: httpx.Request) -> None:
+        self.requests += 1
+        started: Dict[str, float] = {}
+        tls = request.url.scheme == "https"
+
+        async def trace(event: str, info: Dict[str, Any]) -> None:
+            if event == "connection.connect_tcp.started":
+                started["at"] = time.perf_counter()
+            elif event == "connection.connect_tcp.complete":
+                self.opened += 1
+                LLM_UPSTREAM_CONNECTIONS.inc(1, self.backend)
+                if not tls:
+                    self._observe(started)
+            elif event == "connection.start_tls.complete":
+                self._observe(started)
+
+        request.extensions["trace"] = trace
+
+    def _observe(self, started: Dict[str, float]) -> None:
+        if "at" in started:
+            elapsed = time.perf_counter() - started["at"]
+            self.connect_seconds_total += elapsed
+            LLM_UPSTREAM_CONNECT_SECONDS.observe(elapsed, self.backend)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "requests": self.requests,
+            "opened": self.opened,
+            "reuse_ratio": round(1 - self.opened / self.requests, 4) if self.requests else None,
+            "avg_connect_ms": round(self.connect_seconds_total / self.opened * 1000, 1) if self.opened else None,
+        }
+
+def create_http_client(backend: str, settings: Optional[TransportSettings] = None) -> Tuple[httpx.AsyncClient, ConnectionStats]:
+    """
+    An httpx client for one backend with explicit pool limits, keep-alive
+    expiry and HTTP/2, and the stats object counting its connections. The
+    OpenAI client that wraps it closes it.
+    """
+    settings = settings or TransportSettings.from_env()
+    stats = ConnectionStats(backend)
+    client = httpx.AsyncClient(
+        http2=settings.http2,
+        limits=httpx.Limits(
+            max_connections=settings.max_connections,
+            max_keepalive_connections=settings.max_keepalive_connections,
+            keepalive_expiry=settings.keepalive_expiry,
+        ),
+        # Read timeouts are set per request by the completion parameters
+        timeout=httpx.Timeout(60.0, connect=settings.connect_timeout),
+        event_hooks={"request": [stats.on_request]},
+    )
+    return client, stats
+
+async def _open_connections(backend: "Backend", count: int) -> int:
+    """
+    Open up to count pooled connections with concurrent lightweight GETs.
+
+    Any HTTP answer, even an error status, leaves a connection with DNS,
+    TCP and TLS done in the keep-alive pool.
+    """
+    http_client = backend.http_client
+    url = str(backend.client.base_url).rstrip("/") + "/models"
+    headers = {"Authorization": f"Bearer {backend.config.api_key}"}
+    results = await asyncio.gather(
+        *(http_client.get(url, headers=headers) for _ in range(count)), return_exceptions=True
+    )
+    failures = [result for result in results if isinstance(result, BaseException)]
+    if failures:
+        logger.warning("Warmup of LLM backend %s: %s of %s connections failed: %s", backend.name, len(failures), count, failures[0])
+    return count - len(failures)
+
+async def _probe(backend: "Backend") -> float:
+    """One-token completion, exercising auth, routing and the model itself"""
+    started = time.perf_counter()
+    await backend.client.chat.completions.create(
+        model=backend.config.model,
+        messages=[{"role": "user", "content": "ping"}],
+        max_tokens=1,
+        timeout=float(os.getenv("LLM_WARMUP_TIMEOUT", "10")),
+    )
+    return time.perf_counter() - started
+
+async def warm_up(router: "LLMRouter", connections: Optional[int] = None, probe: Optional[bool] = None) -> Dict[str, object]:
+    """
+    Pre-open connections to every backend and optionally send a probe
+    completion, so the first chat after a deploy does not pay connection
+    setup. Failures are logged and never fail startup; the whole warmup
+    is bounded by LLM_WARMUP_TIMEOUT.
+    """
+    connections = connections if connections is not None else int(os.getenv("LLM_WARMUP_CONNECTIONS", "2"))
+    probe = probe if probe is not None else os.getenv("LLM_WARMUP_PROBE", "false").lower() == "true"
+    report: Dict[str, object] = {}
+    if connections <= 0 and not probe:
+        return report
+
+    async def warm(backend: "Backend") -> None:
+        entry: Dict[str, object] = {}
+        report[backend.name] = entry
+        if connections > 0:
+            entry["connections"] = await _open_connections(backend, connections)
+        if probe:
+            try:
+                entry["probe_ms"] = round(await _probe(backend) * 1000, 1)
+            except Exception as e:
+                entry["probe_error"] = str(e)
+                logger.warning("Warmup probe of LLM backend %s failed: %s", backend.name, e)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(warm(backend) for backend in router.backends)),
+            timeout=float(os.getenv("LLM_WARMUP_TIMEOUT", "10"))
+        )
+    except asyncio.TimeoutError:
+        logger.warning("LLM backend warmup did not finish within LLM_WARMUP_TIMEOUT, continuing")
+    logger.info("Warmed up LLM backends in %.0f ms: %s", (time.perf_counter() - started) * 1000, report)
+    return report
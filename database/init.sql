@@ -1,22 +1,172 @@
 -- Initialize NotATherapist Database
 
 -- Create the input_table with timestamp and metadata
+-- Partitioned by month on created_at: recent queries only touch the hot
+-- partitions, vacuum and index maintenance work per month, and retention is
+-- a partition detach/drop instead of a bulk DELETE. The primary key has to
+-- include the partition key. Existing unpartitioned tables are converted by
+-- database/migrate_partition_input_table.sql.
 CREATE TABLE IF NOT EXISTS input_table (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
+    input_uuid UUID,
     input TEXT NOT NULL,
-    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
     conversation_id VARCHAR(255),
-    processed BOOLEAN DEFAULT FALSE
-);
+    processed BOOLEAN DEFAULT FALSE,
+    analysis JSONB,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+-- Catches rows outside every monthly partition so inserts never fail; it
+-- should stay empty while the maintenance job keeps partitions ahead of time
+CREATE TABLE IF NOT EXISTS input_table_default PARTITION OF input_table DEFAULT;
+
+-- Create the monthly partitions (UTC months, named input_table_pYYYYMM) from
+-- start_month through the following `months` months that do not exist yet,
+-- plus one for every month that already has rows in input_table_default.
+-- Such rows would make the new partition's CREATE fail, so when there are any
+-- the default partition is detached once, the partitions created and each
+-- month's rows moved into its partition, and the default re-attached (one
+-- scan to validate it) at the end, all in this transaction.
+-- Returns how many were created. Called here and by backend/partition_maintenance.py.
+CREATE OR REPLACE FUNCTION ensure_input_partitions(start_month DATE, months INTEGER)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE;
+    month_from TIMESTAMP WITH TIME ZONE;
+    month_to TIMESTAMP WITH TIME ZONE;
+    partition_name TEXT;
+    -- Rows in the default partition can only belong to months without a
+    -- partition, so any at all means one of the CREATEs below needs them moved
+    stranded BOOLEAN := EXISTS (SELECT 1 FROM input_table_default);
+    created INTEGER := 0;
+BEGIN
+    IF stranded THEN
+        ALTER TABLE input_table DETACH PARTITION input_table_default;
+    END IF;
+
+    FOR month_start IN
+        SELECT (date_trunc('month', start_month) + make_interval(months => i))::date
+        FROM generate_series(0, months) AS i
+        UNION
+        SELECT DISTINCT date_trunc('month', created_at AT TIME ZONE 'UTC')::date
+        FROM input_table_default
+        ORDER BY 1
+    LOOP
+        partition_name := 'input_table_p' || to_char(month_start, 'YYYYMM');
+        CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+
+        month_from := month_start::timestamp AT TIME ZONE 'UTC';
+        month_to := (month_start + interval '1 month')::timestamp AT TIME ZONE 'UTC';
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF input_table FOR VALUES FROM (%L) TO (%L)',
+            partition_name, month_from, month_to
+        );
+        IF stranded THEN
+            EXECUTE format(
+                'WITH moved AS ('
+                '    DELETE FROM input_table_default WHERE created_at >= %L AND created_at < %L'
+                '    RETURNING id, input_uuid, input, created_at, conversation_id, processed,'
+                '              analysis, analysis_attempts, analysis_retry_at'
+                ') '
+                'INSERT INTO %I (id, input_uuid, input, created_at, conversation_id, processed,'
+                '                analysis, analysis_attempts, analysis_retry_at) '
+                'SELECT id, input_uuid, input, created_at, conversation_id, processed,'
+                '       analysis, analysis_attempts, analysis_retry_at FROM moved',
+                month_from, month_to, partition_name
+            );
+        END IF;
+        created := created + 1;
+    END LOOP;
+
+    IF stranded THEN
+        ALTER TABLE input_table ATTACH PARTITION input_table_default DEFAULT;
+    END IF;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT ensure_input_partitions(CURRENT_DATE, 3);
+
+-- Inputs are written in batches after the request returns, so each one
+-- carries an ID generated at enqueue time that the API hands back to clients
+ALTER TABLE input_table ADD COLUMN IF NOT EXISTS input_uuid UUID;
+
+-- Results of the background analysis worker (language, sentiment, safety
+-- tags, ...), keyed by stage name; set together with processed = true
+ALTER TABLE input_table ADD COLUMN IF NOT EXISTS analysis JSONB;
+
+-- A row whose analysis stages failed stays unprocessed, with its failed runs
+-- counted in analysis_attempts and its next try no earlier than
+-- analysis_retry_at. The worker stops claiming it after ANALYSIS_MAX_ATTEMPTS
+-- failures until analysis_attempts is reset.
+ALTER TABLE input_table ADD COLUMN IF NOT EXISTS analysis_attempts SMALLINT NOT NULL DEFAULT 0;
+ALTER TABLE input_table ADD COLUMN IF NOT EXISTS analysis_retry_at TIMESTAMP WITH TIME ZONE;
 
 -- Create index for faster queries
-CREATE INDEX IF NOT EXISTS idx_input_created_at ON input_table(created_at DESC);
-CREATE INDEX IF NOT EXISTS idx_input_conversation_id ON input_table(conversation_id);
-CREATE INDEX IF NOT EXISTS idx_input_processed ON input_table(processed);
+-- Keyset pagination orders by (created_at, id) newest first; these indexes
+-- match that order so each page is a single range scan from the cursor.
+-- The per-conversation index also carries the small columns, so history
+-- lookups that do not need the input text are index-only.
+CREATE INDEX IF NOT EXISTS idx_input_created_id ON input_table(created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_input_conversation_created ON input_table(conversation_id, created_at DESC, id DESC)
+    INCLUDE (input_uuid, processed);
+-- Superseded by the composite indexes above
+DROP INDEX IF EXISTS idx_input_created_at;
+DROP INDEX IF EXISTS idx_input_conversation_id;
+-- Only unprocessed rows are ever looked up by this flag, and they are a small
+-- recent fraction of the table, so a partial index stays tiny
+CREATE INDEX IF NOT EXISTS idx_input_unprocessed ON input_table(created_at, id) WHERE processed = false;
+DROP INDEX IF EXISTS idx_input_processed;
+-- Lets the input log merge each batch with ON CONFLICT DO NOTHING, so a
+-- batch retried after a write that may have committed is not stored twice.
+-- A unique index on a partitioned table has to include the partition key;
+-- created_at is fixed when the input is queued, so a retry repeats the pair.
+-- Inputs stored twice by writes from before this index are deduplicated once.
+DO $$
+BEGIN
+    IF to_regclass('idx_input_uuid_created') IS NULL THEN
+        DELETE FROM input_table duplicate
+        USING input_table kept
+        WHERE duplicate.input_uuid = kept.input_uuid
+          AND duplicate.created_at = kept.created_at
+          AND duplicate.id > kept.id;
+        CREATE UNIQUE INDEX idx_input_uuid_created ON input_table(input_uuid, created_at);
+    END IF;
+END $$;
+-- Superseded by idx_input_uuid_created, which serves lookups by input_uuid
+DROP INDEX IF EXISTS idx_input_uuid;
+
+-- Conversation turns backing the in-memory conversation store
+-- conversation_key is "<user>:<conversation_id>" so history is scoped to its owner
+CREATE TABLE IF NOT EXISTS conversation_messages (
+    id BIGSERIAL PRIMARY KEY,
+    conversation_key VARCHAR(300) NOT NULL,
+    role VARCHAR(16) NOT NULL,
+    content TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_conversation_messages_key ON conversation_messages(conversation_key, id DESC);
+
+-- Completed /chat responses by Idempotency-Key, so a retried request is
+-- answered from here by any worker instead of generating again. Rows past
+-- expires_at are ignored and purged by the gateways as they write.
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    idempotency_key VARCHAR(300) PRIMARY KEY,
+    fingerprint CHAR(64) NOT NULL,
+    response JSONB NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at);
 
 -- Grant permissions (for the notatherapist user)
 GRANT ALL PRIVILEGES ON TABLE input_table TO notatherapist;
 GRANT USAGE, SELECT ON SEQUENCE input_table_id_seq TO notatherapist;
+GRANT ALL PRIVILEGES ON TABLE conversation_messages TO notatherapist;
+GRANT USAGE, SELECT ON SEQUENCE conversation_messages_id_seq TO notatherapist;
+GRANT ALL PRIVILEGES ON TABLE idempotency_keys TO notatherapist;
 
 -- Insert a test record
 INSERT INTO input_table (input, conversation_id) 
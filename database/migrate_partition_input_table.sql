@@ -0,0 +1,85 @@
+-- Convert an existing unpartitioned input_table to the monthly partitioned
+-- layout created by init.sql. Run once, in a maintenance window, after
+-- creating init.sql's ensure_input_partitions function (the rest of init.sql
+-- expects the partitioned table, so re-run it afterwards). Columns added to
+-- input_table since the old table was created are added to it first, so every
+-- column, including analysis results and retry state, is carried over:
+--   docker exec -i notatherapist-postgres psql -U notatherapist -d notatherapist_db \
+--       -v ON_ERROR_STOP=1 < database/migrate_partition_input_table.sql
+-- Writers must be stopped: the copy holds an exclusive lock on the old table.
+
+BEGIN;
+
+-- Partitions cover UTC months
+SET LOCAL timezone = 'UTC';
+
+LOCK TABLE input_table IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE input_table
+    ADD COLUMN IF NOT EXISTS input_uuid UUID,
+    ADD COLUMN IF NOT EXISTS analysis JSONB,
+    ADD COLUMN IF NOT EXISTS analysis_attempts SMALLINT NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS analysis_retry_at TIMESTAMP WITH TIME ZONE;
+
+ALTER TABLE input_table RENAME TO input_table_unpartitioned;
+ALTER TABLE input_table_unpartitioned RENAME CONSTRAINT input_table_pkey TO input_table_unpartitioned_pkey;
+ALTER INDEX IF EXISTS idx_input_created_at RENAME TO idx_input_unpartitioned_created_at;
+ALTER INDEX IF EXISTS idx_input_created_id RENAME TO idx_input_unpartitioned_created_id;
+ALTER INDEX IF EXISTS idx_input_conversation_id RENAME TO idx_input_unpartitioned_conversation_id;
+ALTER INDEX IF EXISTS idx_input_conversation_created RENAME TO idx_input_unpartitioned_conversation_created;
+ALTER INDEX IF EXISTS idx_input_processed RENAME TO idx_input_unpartitioned_processed;
+ALTER INDEX IF EXISTS idx_input_uuid RENAME TO idx_input_unpartitioned_uuid;
+
+-- Keep the existing id sequence so ids stay unique across old and new rows
+CREATE TABLE input_table (
+    id INTEGER NOT NULL DEFAULT nextval('input_table_id_seq'),
+    input_uuid UUID,
+    input TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    conversation_id VARCHAR(255),
+    processed BOOLEAN DEFAULT FALSE,
+    analysis JSONB,
+    analysis_attempts SMALLINT NOT NULL DEFAULT 0,
+    analysis_retry_at TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+ALTER SEQUENCE input_table_id_seq OWNED BY input_table.id;
+
+CREATE TABLE input_table_default PARTITION OF input_table DEFAULT;
+
+-- One partition for every month that has data, through three months ahead
+SELECT ensure_input_partitions(first_month, months_with_data + 3)
+FROM (
+    SELECT date_trunc('month', LEAST(COALESCE(min(created_at), now()), now()))::date AS first_month
+    FROM input_table_unpartitioned
+) bounds,
+LATERAL (
+    SELECT ((extract(year FROM CURRENT_DATE) - extract(year FROM first_month)) * 12
+            + extract(month FROM CURRENT_DATE) - extract(month FROM first_month))::integer AS months_with_data
+) span;
+
+-- Inputs stored twice by a retried batch write are copied once
+CREATE UNIQUE INDEX idx_input_uuid_created ON input_table(input_uuid, created_at);
+
+INSERT INTO input_table (
+    id, input_uuid, input, created_at, conversation_id, processed,
+    analysis, analysis_attempts, analysis_retry_at
+)
+SELECT id, input_uuid, input, COALESCE(created_at, CURRENT_TIMESTAMP), conversation_id, processed,
+    analysis, analysis_attempts, analysis_retry_at
+FROM input_table_unpartitioned
+ORDER BY id
+ON CONFLICT (input_uuid, created_at) DO NOTHING;
+
+CREATE INDEX idx_input_created_id ON input_table(created_at DESC, id DESC);
+CREATE INDEX idx_input_conversation_created ON input_table(conversation_id, created_at DESC, id DESC)
+    INCLUDE (input_uuid, processed);
+CREATE INDEX idx_input_unprocessed ON input_table(created_at, id) WHERE processed = false;
+
+GRANT ALL PRIVILEGES ON TABLE input_table TO notatherapist;
+
+DROP TABLE input_table_unpartitioned;
+
+COMMIT;
+
+ANALYZE input_table;
@@ -13,9 +13,11 @@ echo "  - Building frontend..."
 docker build -t notatherapist-frontend ./frontend
 echo "  - Building backend..."
 docker build -t notatherapist-backend ./backend
+echo "  - Building partition maintenance..."
+docker build -t notatherapist-maintenance ./backend
 
 echo "💾 Saving Docker images..."
-docker save notatherapist-frontend notatherapist-backend | gzip > notatherapist-images.tar.gz
+docker save notatherapist-frontend notatherapist-backend notatherapist-maintenance | gzip > notatherapist-images.tar.gz
 
 echo "📤 Uploading to server..."
 scp -i "${SSH_KEY}" notatherapist-images.tar.gz ubuntu@${REMOTE_HOST}:/tmp/
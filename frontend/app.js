@@ -195,33 +195,35 @@ document.addEventListener('DOMContentLoaded', function() {
         chatInput.value = '';
         
         try {
-            // Send to LLM Gateway at port 5004
-            const response = await fetch('/api/llm/chat', {
+            const conversationId = sessionStorage.getItem('conversation_id') || generateConversationId();
+            // One key per message: every retry of it is answered by the same generation
+            const idempotencyKey = generateIdempotencyKey();
+            
+            // Prefer the streaming endpoint so text appears as it is generated
+            const response = await fetch('/api/llm/chat/stream', {
                 method: 'POST',
                 headers: {
                     'Content-Type': 'application/json',
+                    'Accept': 'text/event-stream',
                 },
                 body: JSON.stringify({
                     message: message,
-                    conversation_id: sessionStorage.getItem('conversation_id') || generateConversationId()
+                    conversation_id: conversationId
                 })
             });
             
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
+            if (response.status === 404 || response.status === 405) {
+                // Backend without streaming support
+                await sendMessageBuffered(message, conversationId, idempotencyKey);
+                return;
             }
             
-            const data = await response.json();
-            
-            // Display the response
-            responseArea.classList.remove('loading');
-            responseArea.textContent = data.response || data.message || 'I received your message but had trouble processing it.';
-            
-            // Store conversation ID if provided
-            if (data.conversation_id) {
-                sessionStorage.setItem('conversation_id', data.conversation_id);
+            if (!response.ok || !response.body) {
+                throw new Error(`HTTP error! status: ${response.status}`);
             }
             
+            await readEventStream(response);
+            
         } catch (error) {
             console.error('Error sending message:', error);
             responseArea.classList.remove('loading');
@@ -237,6 +239,113 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     }
     
+    async function sendMessageBuffered(message, conversationId, idempotencyKey) {
+        // Send to LLM Gateway at port 5004
+        const response = await fetchWithRetry('/api/llm/chat', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Idempotency-Key': idempotencyKey,
+            },
+            body: JSON.stringify({
+                message: message,
+                conversation_id: conversationId
+            })
+        });
+        
+        if (!response.ok) {
+            throw new Error(`HTTP error! status: ${response.status}`);
+        }
+        
+        const data = await response.json();
+        
+        // Display the response
+        responseArea.classList.remove('loading');
+        responseArea.textContent = data.response || data.message || 'I received your message but had trouble processing it.';
+        
+        // Store conversation ID if provided
+        if (data.conversation_id) {
+            sessionStorage.setItem('conversation_id', data.conversation_id);
+        }
+    }
+    
+    async function readEventStream(response) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let started = false;
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            
+            buffer += decoder.decode(value, { stream: true });
+            
+            // SSE messages are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                
+                let eventName = 'message';
+                let dataLines = [];
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) {
+                        eventName = line.slice(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        dataLines.push(line.slice(5).trim());
+                    }
+                });
+                const data = dataLines.length ? JSON.parse(dataLines.join('\n')) : {};
+                
+                if (eventName === 'start' && data.conversation_id) {
+                    sessionStorage.setItem('conversation_id', data.conversation_id);
+                } else if (eventName === 'delta') {
+                    if (!started) {
+                        responseArea.classList.remove('loading');
+                        responseArea.textContent = '';
+                        started = true;
+                    }
+                    responseArea.textContent += data.delta;
+                } else if (eventName === 'error') {
+                    throw new Error(data.detail || 'Stream failed');
+                }
+            }
+        }
+        
+        if (!started) {
+            responseArea.classList.remove('loading');
+            responseArea.textContent = 'I received your message but had trouble processing it.';
+        }
+    }
+    
+    // Network failures and gateway errors are retried with the same request,
+    // including its Idempotency-Key, so the server answers a retry from the
+    // first attempt instead of generating again
+    async function fetchWithRetry(url, options, retries = 2) {
+        for (let attempt = 0; ; attempt++) {
+            let response;
+            try {
+                response = await fetch(url, options);
+            } catch (error) {
+                if (attempt >= retries) throw error;
+            }
+            if (response && ![502, 503, 504].includes(response.status)) return response;
+            if (response && attempt >= retries) return response;
+            
+            const retryAfter = response && parseInt(response.headers.get('Retry-After'), 10);
+            const delay = retryAfter > 0 ? Math.min(retryAfter, 5) * 1000 : 500 * 2 ** attempt;
+            await new Promise(resolve => setTimeout(resolve, delay));
+        }
+    }
+    
+    function generateIdempotencyKey() {
+        if (window.crypto && crypto.randomUUID) {
+            return crypto.randomUUID();
+        }
+        return 'msg_' + Date.now() + '_' + Math.random().toString(36).substr(2, 12);
+    }
+    
     function generateConversationId() {
         return 'conv_' + Date.now() + '_' + Math.random().toString(36).substr(2, 9);
     }